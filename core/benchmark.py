@@ -0,0 +1,370 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from core.config import SessionProfile, WDTaggerConfig, parse_model_id
+from core.mcut import batch_mcut_threshold, mcut_threshold, verify_mcut_parity
+from core.metrics import peak_rss_mb
+
+TINY_REPO_ID = "benchmark/tiny-tagger"
+
+# Category layout of the tiny model: 4 ratings, then general, then characters
+TINY_RATINGS = ["general", "sensitive", "questionable", "explicit"]
+
+def make_tiny_model(directory: str, target_size: int = 448, num_tags: int = 10000,
+                    character_tags: Optional[int] = None, seed: int = 0) -> Tuple[str, str]:
+    """
+    Write a tiny ONNX model with the WD tagger IO signature plus its labels
+    Input is (batch, target_size, target_size, 3) float32, output is
+    (batch, num_tags) sigmoid probabilities. Returns (csv_path, model_path).
+    character_tags defaults to a fifth of the tags; at least one is general.
+    """
+    try:
+        import onnx
+        from onnx import TensorProto, helper, numpy_helper
+    except ImportError:
+        raise Exception("The tiny benchmark model requires onnx (pip install onnx)")
+
+    if num_tags <= len(TINY_RATINGS):
+        raise ValueError(f"The tiny model needs more than {len(TINY_RATINGS)} tags")
+    if character_tags is None:
+        character_tags = num_tags // 5
+    character_tags = min(character_tags, num_tags - len(TINY_RATINGS) - 1)
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    weights = (rng.standard_normal((3, num_tags)) * 0.05).astype(np.float32)
+    bias = (rng.standard_normal(num_tags) - 2.0).astype(np.float32)
+
+    graph = helper.make_graph(
+        [
+            helper.make_node("ReduceMean", ["input_1"], ["pooled"], axes=[1, 2], keepdims=0),
+            helper.make_node("MatMul", ["pooled", "weights"], ["logits_raw"]),
+            helper.make_node("Add", ["logits_raw", "bias"], ["logits"]),
+            helper.make_node("Sigmoid", ["logits"], ["predictions_sigmoid"]),
+        ],
+        "tiny_tagger",
+        [helper.make_tensor_value_info("input_1", TensorProto.FLOAT, ["batch", target_size, target_size, 3])],
+        [helper.make_tensor_value_info("predictions_sigmoid", TensorProto.FLOAT, ["batch", num_tags])],
+        [numpy_helper.from_array(weights, "weights"), numpy_helper.from_array(bias, "bias")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    model_path = os.path.join(directory, "model.onnx")
+    onnx.save(model, model_path)
+
+    csv_path = os.path.join(directory, "selected_tags.csv")
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["tag_id", "name", "category", "count"])
+        for index in range(num_tags):
+            if index < len(TINY_RATINGS):
+                name, category = TINY_RATINGS[index], 9
+            elif index >= num_tags - character_tags:
+                name, category = f"character_{index}_(series)", 4
+            else:
+                name, category = f"general_tag_{index}", 0
+            writer.writerow([index, name, category, 0])
+    return csv_path, model_path
+
+def synthetic_images(count: int, sizes: Sequence[Tuple[int, int]], seed: int = 0) -> List[Image.Image]:
+    """Noisy gradient RGB images cycling through the given (width, height) sizes"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for index in range(count):
+        width, height = sizes[index % len(sizes)]
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+        noise = rng.integers(0, 64, (height, width, 3)).astype(np.float32)
+        pixels = np.clip(gradient * 0.75 + noise, 0, 255).astype(np.uint8)
+        images.append(Image.fromarray(pixels, "RGB"))
+    return images
+
+def load_local_images(directory: str, count: int) -> List[Image.Image]:
+    """Decode up to `count` images from a directory"""
+    from core.dataset import find_images
+    images = []
+    for path in find_images(directory, recursive=True)[:count]:
+        with Image.open(path) as image:
+            image.load()
+            images.append(image.copy())
+    return images
+
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 1, items: int = 1) -> Dict[str, float]:
+    """Time repeated calls of fn; `items` is how many images one call handles"""
+    for _ in range(warmup):
+        fn()
+    timings = np.empty(repeat, dtype=np.float64)
+    for index in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings[index] = time.perf_counter() - start
+    mean = float(timings.mean())
+    return {
+        "p50_ms": float(np.percentile(timings, 50) * 1000),
+        "p95_ms": float(np.percentile(timings, 95) * 1000),
+        "mean_ms": mean * 1000,
+        "items_per_sec": items / mean if mean > 0 else 0.0,
+        "repeat": repeat,
+        "items": items,
+    }
+
+def parse_sizes(text: str) -> List[Tuple[int, int]]:
+    """Parse "512x512,1920x1080" into [(512, 512), (1920, 1080)]"""
+    sizes = []
+    for part in text.split(","):
+        width, height = part.lower().split("x")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+class BenchmarkSuite:
+    """
+    Times each stage of tagging in isolation
+    Stages are preprocessing, session.run per batch size and thread count,
+    post-processing, MCut and tag formatting. The prediction cache is
+    disabled so every call does real work. Before MCut is timed, the batched
+    MCut is checked against the per-image one and the run fails on any
+    difference.
+    """
+
+    def __init__(self, config: WDTaggerConfig, model_repo: str, images: List[Image.Image], repeat: int = 20):
+        from core.predictor import WaifuDiffusionPredictor
+
+        config.prediction_cache.enabled = False
+        config.scheduler.enabled = False
+        self.config = config
+        self.model_repo = model_repo
+        self.images = images
+        self.repeat = repeat
+        self.predictor = WaifuDiffusionPredictor(config)
+        if not self.predictor.load_model(model_repo):
+            raise Exception(f"Model loading failed: {model_repo}")
+        self.entry = self.predictor.active_model
+        self.results: Dict[str, Dict[str, float]] = {}
+
+    def _record(self, name: str, stats: Dict[str, float]):
+        self.results[name] = stats
+        print(
+            f"{name:<40}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}"
+            f"{stats['items_per_sec']:>12.1f}"
+        )
+
+    def bench_preprocess(self):
+        sizes = sorted({image.size for image in self.images})
+        for size in sizes:
+            image = next(image for image in self.images if image.size == size)
+            self._record(
+                f"prepare_image[{size[0]}x{size[1]}]",
+                measure(lambda: self.predictor.prepare_image(image, self.entry), self.repeat)
+            )
+
+    def bench_session(self, batch_sizes: Sequence[int], thread_counts: Sequence[int]):
+        from core.quantize import convert_model
+        from core.session import create_session
+
+        repo_id, precision = parse_model_id(self.model_repo)
+        _, model_path = self.predictor.download_model(repo_id)
+        model_path = convert_model(model_path, precision, repo_id, self.predictor.converted_model_dir())
+        entry = self.entry
+        target_size = entry.target_size
+        sample = self.predictor.prepare_image(self.images[0], entry)[0]
+        base = self.config.get_session_profile(self.model_repo)
+
+        for threads in thread_counts:
+            profile = SessionProfile(**{**base.__dict__, "intra_op_num_threads": threads})
+            session = create_session(model_path, profile)
+            for batch_size in batch_sizes:
+                batch = np.broadcast_to(sample, (batch_size, target_size, target_size, 3)).copy()
+                if entry.input_layout == "NCHW":
+                    batch = np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+                feed = {entry.input_name: batch}
+                self._record(
+                    f"session.run[batch={batch_size},threads={threads}]",
+                    measure(lambda: session.run([entry.label_name], feed), self.repeat, items=batch_size)
+                )
+
+    def _random_preds(self, rows: int, confident: int = 40) -> np.ndarray:
+        """Mostly near-zero scores with `confident` high ones per row, like real output"""
+        rng = np.random.default_rng(0)
+        num_tags = len(self.entry.tag_names)
+        preds = rng.beta(0.3, 8.0, (rows, num_tags)).astype(np.float32)
+        for row in preds:
+            row[rng.choice(num_tags, min(confident, num_tags), replace=False)] = rng.uniform(0.4, 1.0, min(confident, num_tags))
+        return preds
+
+    def bench_postprocess(self):
+        preds = self._random_preds(1)[0]
+        for mcut in (False, True):
+            self._record(
+                f"process_predictions[mcut={mcut}]",
+                measure(lambda: self.predictor.process_predictions(preds, 0.35, mcut, 0.85, mcut), self.repeat)
+            )
+
+    def check_mcut(self):
+        """Fail unless batch_mcut_threshold matches mcut_threshold, with and without top_k"""
+        top_k = self.config.thresholds.mcut_top_k
+        failures = verify_mcut_parity(top_ks=(None, 1, 5, 64) + ((top_k,) if top_k else ()))
+        if failures:
+            name, dtype, top_k, difference = failures[0]
+            raise Exception(
+                f"batch_mcut_threshold differs from mcut_threshold by {difference:g} "
+                f"on {name} {dtype} scores with top_k={top_k}"
+            )
+        print(f"{'mcut parity':<40}{'ok':>10}")
+
+    def bench_mcut(self, rows: int = 64):
+        preds = self._random_preds(rows)[:, self.entry.general_indexes].astype(np.float64)
+        self._record("mcut_threshold", measure(lambda: mcut_threshold(preds[0]), self.repeat))
+        self._record(
+            f"batch_mcut_threshold[rows={rows}]",
+            measure(lambda: batch_mcut_threshold(preds), self.repeat, items=rows)
+        )
+        top_k = self.config.thresholds.mcut_top_k or 64
+        self._record(
+            f"batch_mcut_threshold[rows={rows},top_k={top_k}]",
+            measure(lambda: batch_mcut_threshold(preds, top_k), self.repeat, items=rows)
+        )
+
+    def bench_formatting(self):
+        entry = self.entry
+        tag_processor = self.predictor.tag_processor
+        probs = self._random_preds(1)[0][entry.general_indexes]
+        indexes = entry.general_indexes[probs > 0.35]
+        selected = probs[probs > 0.35]
+        tag_results = list(zip(entry.tag_names[indexes].tolist(), selected.tolist()))
+
+        self._record(
+            "format_standard_indexes",
+            measure(lambda: tag_processor.format_standard_indexes(entry.vocabulary, indexes, selected), self.repeat)
+        )
+        self._record(
+            "format_r34_indexes",
+            measure(lambda: tag_processor.format_r34_indexes(entry.vocabulary, indexes, selected), self.repeat)
+        )
+        self._record("format_standard_tags", measure(lambda: tag_processor.format_standard_tags(tag_results), self.repeat))
+        self._record("format_r34_tags", measure(lambda: tag_processor.format_r34_tags(tag_results), self.repeat))
+        self._record("enhance_r34_tags", measure(lambda: tag_processor.enhance_r34_tags(tag_results), self.repeat))
+        self._record(
+            "enhance_r34_indexes",
+            measure(lambda: tag_processor.enhance_r34_indexes(entry.vocabulary, indexes, selected), self.repeat)
+        )
+
+    def run(self, batch_sizes: Sequence[int], thread_counts: Sequence[int]) -> Dict[str, object]:
+        """Run every stage and return the report"""
+        print(f"{'benchmark':<40}{'p50 ms':>10}{'p95 ms':>10}{'items/s':>12}")
+        self.bench_preprocess()
+        self.bench_session(batch_sizes, thread_counts)
+        self.bench_postprocess()
+        self.check_mcut()
+        self.bench_mcut()
+        self.bench_formatting()
+        return {
+            "meta": environment_info(self.model_repo, len(self.entry.tag_names)),
+            "peak_rss_mb": peak_rss_mb(),
+            "results": self.results,
+        }
+
+def environment_info(model_repo: str, num_tags: int) -> Dict[str, object]:
+    """Versions and machine details stored with every report"""
+    import onnxruntime
+    return {
+        "model": model_repo,
+        "num_tags": num_tags,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "onnxruntime": onnxruntime.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def compare_reports(baseline: Dict[str, object], current: Dict[str, object],
+                    tolerance: float = 0.10) -> List[Tuple[str, float, float]]:
+    """Benchmarks whose p50 grew by more than `tolerance` over the baseline"""
+    regressions = []
+    for name, stats in current["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None or previous["p50_ms"] <= 0:
+            continue
+        if stats["p50_ms"] > previous["p50_ms"] * (1 + tolerance):
+            regressions.append((name, previous["p50_ms"], stats["p50_ms"]))
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark WD Tagger preprocessing, inference and formatting")
+    parser.add_argument("--model", default=None, help="Model to benchmark (default: a generated tiny model)")
+    parser.add_argument("--tiny-size", type=int, default=448, help="Input size of the tiny model")
+    parser.add_argument("--tiny-tags", type=int, default=10000, help="Number of tags of the tiny model")
+    parser.add_argument("--images", default=None, help="Directory of local images instead of synthetic ones")
+    parser.add_argument("--count", type=int, default=16, help="Number of images")
+    parser.add_argument("--sizes", default="512x512,1024x768,768x1344,2048x2048",
+                        help="Synthetic image sizes as WxH, comma separated")
+    parser.add_argument("--batch-sizes", default="1,4,8")
+    parser.add_argument("--threads", default="0", help="intra-op thread counts, 0 lets ONNX Runtime decide")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    parser.add_argument("--compare", default=None, help="Baseline JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed p50 slowdown, as a fraction")
+    args = parser.parse_args(argv)
+
+    config = WDTaggerConfig()
+    model_repo = args.model
+    tiny_dir = None
+    if model_repo is None:
+        tiny_dir = tempfile.TemporaryDirectory(prefix="wd-tagger-bench-")
+        try:
+            make_tiny_model(
+                os.path.join(tiny_dir.name, TINY_REPO_ID.replace("/", "--")),
+                target_size=args.tiny_size, num_tags=args.tiny_tags
+            )
+        except Exception as e:
+            tiny_dir.cleanup()
+            print(f"Could not create the tiny model: {str(e)}")
+            return 1
+        config.resolver.local_models_dir = tiny_dir.name
+        config.cache.persist_optimized_models = False
+        config.cache.persist_label_tables = False
+        model_repo = TINY_REPO_ID
+
+    if args.images:
+        images = load_local_images(args.images, args.count)
+    else:
+        images = synthetic_images(args.count, parse_sizes(args.sizes))
+
+    try:
+        suite = BenchmarkSuite(config, model_repo, images, repeat=args.repeat)
+        report = suite.run(
+            [int(size) for size in args.batch_sizes.split(",")],
+            [int(threads) for threads in args.threads.split(",")]
+        )
+    finally:
+        if tiny_dir is not None:
+            tiny_dir.cleanup()
+
+    if report["peak_rss_mb"] is not None:
+        print(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.tolerance)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: p50 {before:.3f} ms -> {after:.3f} ms")
+        if regressions:
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,172 @@
+import json
+import os
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), "data", "tag_categories.json")
+
+DEFAULT_CATEGORY = "other"
+
+MATCH_MODES = ("substring", "exact")
+
+class SubstringMatcher:
+    """
+    Aho-Corasick automaton over many keywords at once
+    Each keyword carries a value; find_min returns the smallest value of all
+    keywords occurring anywhere in the text, in a single pass over it.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._best: List[Optional[int]] = [None]
+        self._built = True
+
+    def add(self, keyword: str, value: int):
+        """Register a keyword; call build() before matching"""
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            state = next_state
+        if self._best[state] is None or value < self._best[state]:
+            self._best[state] = value
+        self._built = False
+
+    def build(self):
+        """Compute failure links and fold outputs along them"""
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                inherited = self._best[self._fail[next_state]]
+                if inherited is not None and (self._best[next_state] is None or inherited < self._best[next_state]):
+                    self._best[next_state] = inherited
+                queue.append(next_state)
+        self._built = True
+
+    def find_min(self, text: str) -> Optional[int]:
+        """Smallest value among the keywords found in text, or None"""
+        if not self._built:
+            self.build()
+        goto, fail, best = self._goto, self._fail, self._best
+        state = 0
+        found = None
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            value = best[state]
+            if value is not None and (found is None or value < found):
+                found = value
+                if found == 0:
+                    break
+        return found
+
+class TagCategorizer:
+    """
+    Assigns each tag the category of the first rule that matches it
+    Rules are either substring rules (keyword occurs anywhere in the
+    lowercased tag) or exact rules (lowercased tag equals a pattern). All
+    substring rules are matched together by one automaton and all exact rules
+    by one dict, so categorizing a tag costs a single pass over it.
+    """
+
+    def __init__(self):
+        self.rules: List[Dict] = []
+        self._matcher: Optional[SubstringMatcher] = None
+        self._exact: Dict[str, int] = {}
+        self._memo: Dict[str, str] = {}
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_RULES_PATH) -> "TagCategorizer":
+        """Create a categorizer from a JSON rules file"""
+        categorizer = cls()
+        categorizer.load_rules(path)
+        return categorizer
+
+    def load_rules(self, path: str, first: bool = False):
+        """Add every rule of a JSON rules file, in file order"""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        rules = data.get("rules", [])
+        if first:
+            rules = list(reversed(rules))
+        for rule in rules:
+            self.add_rule(rule["category"], rule["patterns"], rule.get("match", "substring"), first=first)
+
+    def add_rule(self, category: str, patterns: Iterable[str], match: str = "substring", first: bool = False):
+        """
+        Add a category rule
+        With first=True the rule takes precedence over every existing rule,
+        which is how user-defined rules override the defaults.
+        """
+        if match not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode: {match}")
+        rule = {
+            "category": category,
+            "match": match,
+            "patterns": [pattern.lower() for pattern in patterns],
+        }
+        if first:
+            self.rules.insert(0, rule)
+        else:
+            self.rules.append(rule)
+        self._matcher = None
+        self._memo.clear()
+
+    def _compile(self):
+        matcher = SubstringMatcher()
+        exact: Dict[str, int] = {}
+        for order, rule in enumerate(self.rules):
+            for pattern in rule["patterns"]:
+                if rule["match"] == "substring":
+                    matcher.add(pattern, order)
+                elif pattern not in exact:
+                    exact[pattern] = order
+        matcher.build()
+        self._matcher = matcher
+        self._exact = exact
+
+    def categories(self) -> List[str]:
+        """Every category name known to the rules, in rule order"""
+        return list(dict.fromkeys(rule["category"] for rule in self.rules))
+
+    def exact_patterns(self, category: str) -> Set[str]:
+        """All exact-match patterns of a category"""
+        return {
+            pattern
+            for rule in self.rules if rule["category"] == category and rule["match"] == "exact"
+            for pattern in rule["patterns"]
+        }
+
+    def categorize(self, tag: str) -> str:
+        """Category of a single tag"""
+        category = self._memo.get(tag)
+        if category is not None:
+            return category
+
+        if self._matcher is None:
+            self._compile()
+        tag_lower = tag.lower()
+        orders = [order for order in (self._matcher.find_min(tag_lower), self._exact.get(tag_lower)) if order is not None]
+        category = self.rules[min(orders)]["category"] if orders else DEFAULT_CATEGORY
+        self._memo[tag] = category
+        return category
+
+    def categorize_vocabulary(self, tag_names: Iterable[str]) -> np.ndarray:
+        """Category of every tag in a label set, by tag index"""
+        return np.array([self.categorize(tag) for tag in tag_names], dtype=object)
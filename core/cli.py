@@ -0,0 +1,137 @@
+import argparse
+import os
+import sys
+from contextlib import redirect_stdout
+from typing import List, Optional
+
+from core.config import WDTaggerConfig
+from core.dataset import CAPTION_FORMATS, find_images
+from core.export import EXPORT_FORMATS, open_exporter
+from core.server import add_server_arguments, serve
+
+def _configure(config: WDTaggerConfig, args):
+    """Apply the performance options shared by the subcommands"""
+    if args.threads is not None:
+        config.session_profile.intra_op_num_threads = args.threads
+    if args.workers is not None:
+        config.inference.preprocess_workers = args.workers
+    if args.models_dir:
+        config.resolver.local_models_dir = args.models_dir
+    # A one-shot process gets nothing from the single-image scheduler
+    config.scheduler.enabled = False
+
+def _progress(done: int, total: int, path: str):
+    print(f"\r{done}/{total}", end="" if done < total else "\n", file=sys.stderr, flush=True)
+
+def tag(args, config: WDTaggerConfig) -> int:
+    """Caption files and folders, or stream their tags as records"""
+    from core.predictor import WaifuDiffusionPredictor
+
+    _configure(config, args)
+    predictor = WaifuDiffusionPredictor(config)
+    progress = _progress if args.progress else None
+    failed = 0
+
+    if args.captions:
+        for input_path in args.inputs:
+            stats = predictor.tag_directory(
+                input_path, args.model,
+                args.general_thresh, args.general_mcut, args.character_thresh, args.character_mcut,
+                caption_format=args.captions,
+                output_dir=args.output_dir,
+                prepend_character_tags=not args.no_character_prefix,
+                skip_existing=not args.overwrite,
+                recursive=not args.no_recursive,
+                batch_size=args.batch_size,
+                progress=progress,
+                incremental=args.incremental
+            )
+            failed += stats["failed"]
+            print(
+                f"{input_path}: {stats['tagged']} tagged, {stats.get('rederived', 0)} re-derived, "
+                f"{stats['skipped']} skipped, {stats['failed']} failed in {stats['elapsed']:.1f}s",
+                file=sys.stderr
+            )
+        return 0 if failed == 0 else 1
+
+    images = []
+    for input_path in args.inputs:
+        found = find_images(input_path, not args.no_recursive)
+        if not found:
+            print(f"No images found: {input_path}", file=sys.stderr)
+        images.extend(found)
+
+    with open_exporter(args.output, args.format, args.flush_every) as exporter:
+        # Records may be going to stdout; keep log messages off it
+        with redirect_stdout(sys.stderr):
+            stats = predictor.export_images(
+                images, exporter, args.model,
+                args.general_thresh, args.general_mcut, args.character_thresh, args.character_mcut,
+                top_k=args.top_k, batch_size=args.batch_size, progress=progress
+            )
+    print(
+        f"Tagged {stats['exported']}/{stats['total']} images ({stats['failed']} failed) "
+        f"in {stats['elapsed']:.1f}s, {stats['images_per_sec']:.1f} images/sec",
+        file=sys.stderr
+    )
+    return 0 if stats["failed"] == 0 else 1
+
+def build_parser(config: WDTaggerConfig) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m core.cli",
+        description="Tag images with WD Tagger without the WebUI"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    tag_parser = commands.add_parser(
+        "tag",
+        help="Tag image files, folders or globs",
+        description="Write caption sidecar files with --captions, otherwise one JSON record "
+                    "per image to stdout or --output"
+    )
+    tag_parser.add_argument("inputs", nargs="+", help="Image files, directories or glob patterns")
+    tag_parser.add_argument("--model", default=config.get_default_model(),
+                            help=f"Model id, e.g. org/repo or org/repo@int8 (default: {config.get_default_model()})")
+    tag_parser.add_argument("--general-thresh", type=float, default=config.thresholds.general_default)
+    tag_parser.add_argument("--general-mcut", action="store_true")
+    tag_parser.add_argument("--character-thresh", type=float, default=config.thresholds.character_default)
+    tag_parser.add_argument("--character-mcut", action="store_true")
+    tag_parser.add_argument("--captions", choices=CAPTION_FORMATS, default=None,
+                            help="Write .txt captions in this format instead of records")
+    tag_parser.add_argument("--output-dir", default=None, help="Mirror captions into this folder")
+    tag_parser.add_argument("--overwrite", action="store_true", help="Rewrite up-to-date captions")
+    tag_parser.add_argument("--incremental", action="store_true",
+                            help="Use a manifest to re-tag only what changed")
+    tag_parser.add_argument("--no-character-prefix", action="store_true",
+                            help="Do not put character tags first in captions")
+    tag_parser.add_argument("--output", default="-", help="Record file (.jsonl, .parquet or .db); - for stdout")
+    tag_parser.add_argument("--format", choices=EXPORT_FORMATS, default=None)
+    tag_parser.add_argument("--top-k", type=int, default=0, help="Also store the top K raw scores")
+    tag_parser.add_argument("--flush-every", type=int, default=100)
+    tag_parser.add_argument("--batch-size", type=int, default=config.inference.max_batch_size)
+    tag_parser.add_argument("--threads", type=int, default=None, help="ONNX Runtime intra-op threads")
+    tag_parser.add_argument("--workers", type=int, default=None, help="Image decoding threads")
+    tag_parser.add_argument("--models-dir", default=None, help="Local models directory to check first")
+    tag_parser.add_argument("--no-recursive", action="store_true")
+    tag_parser.add_argument("--progress", action="store_true", help="Report progress on stderr")
+
+    serve_parser = commands.add_parser(
+        "serve",
+        help="Run the local HTTP tagging service",
+        description="Keep models loaded and answer POST /tag with JSON records"
+    )
+    add_server_arguments(serve_parser, config)
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    config = WDTaggerConfig()
+    args = build_parser(config).parse_args(argv)
+    if args.command == "serve":
+        return serve(args, config)
+    if args.output != "-" and os.path.isdir(args.output):
+        print(f"--output must be a file, not a directory: {args.output}", file=sys.stderr)
+        return 2
+    return tag(args, config)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
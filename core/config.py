@@ -1,6 +1,31 @@
 import os
-from typing import Dict, List, Tuple
-from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+
+@dataclass
+class SessionProfile:
+    """ONNX Runtime session settings"""
+    intra_op_num_threads: int = 0  # 0 lets ONNX Runtime decide
+    inter_op_num_threads: int = 0
+    graph_optimization_level: str = "all"  # disable, basic, extended or all
+    execution_mode: str = "sequential"  # sequential or parallel
+    enable_cpu_mem_arena: bool = True
+    enable_mem_pattern: bool = True
+    providers: List[str] = field(default_factory=lambda: ["CPUExecutionProvider"])
+
+MODEL_PRECISIONS = ("fp32", "fp16", "int8")
+
+def default_cache_root() -> str:
+    """Root of the wd-tagger caches: WD_TAGGER_CACHE_DIR or ~/.cache/wd-tagger"""
+    return os.environ.get("WD_TAGGER_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "wd-tagger")
+
+def parse_model_id(model_id: str) -> Tuple[str, str]:
+    """Split a model id such as "org/repo@int8" into repo id and precision"""
+    repo_id, _, precision = model_id.partition("@")
+    precision = precision or "fp32"
+    if precision not in MODEL_PRECISIONS:
+        raise ValueError(f"Unknown model precision: {precision}")
+    return repo_id, precision
 
 @dataclass
 class ModelConfig:
@@ -9,6 +34,15 @@ class ModelConfig:
     display_name: str
     description: str
     version: str
+    session_profile: Optional[SessionProfile] = None
+    precision: str = "fp32"  # fp32 (original), fp16 or int8, converted locally
+    
+    @property
+    def model_id(self) -> str:
+        """Identifier used to select the model; variants carry an @precision suffix"""
+        if self.precision == "fp32":
+            return self.repo_id
+        return f"{self.repo_id}@{self.precision}"
 
 @dataclass
 class ThresholdConfig:
@@ -18,6 +52,99 @@ class ThresholdConfig:
     rating_default: float = 0.5
     slider_step: float = 0.05
     min_character_mcut: float = 0.15
+    mcut_top_k: Optional[int] = None  # search only the top K + 1 scores; rows where that could miss the cut are fully sorted
+
+@dataclass
+class InferenceConfig:
+    """Configuration for batched inference"""
+    max_batch_size: int = 8
+    preprocess_workers: int = 4
+    prefetch_batches: int = 2
+    ordered_results: bool = True
+    ensemble_concurrent: bool = True  # run ensemble members on parallel threads
+
+@dataclass
+class SchedulerConfig:
+    """Configuration for micro-batching concurrent single-image requests"""
+    enabled: bool = True
+    max_batch_size: int = 8
+    max_wait_ms: float = 10.0  # how long the first request waits for company
+    max_queue_depth: int = 64
+
+@dataclass
+class PreprocessConfig:
+    """Configuration for image preprocessing"""
+    resample: str = "lanczos"  # lanczos, bicubic, bilinear, box or nearest
+    use_draft: bool = True
+    reduce_large_images: bool = True
+
+@dataclass
+class PredictionCacheConfig:
+    """Configuration for the raw prediction cache"""
+    enabled: bool = True
+    max_memory_entries: int = 2048
+    disk_dir: Optional[str] = None  # set to keep predictions on disk as well
+    disk_dtype: str = "float16"  # float16 halves disk use at ~1e-3 precision
+
+@dataclass
+class CategoryConfig:
+    """Configuration for tag categorization rules"""
+    rules_file: Optional[str] = None  # defaults to core/data/tag_categories.json
+    user_rules_file: Optional[str] = None  # rules here take precedence
+
+@dataclass
+class TagIndexConfig:
+    """Configuration for the searchable tag index"""
+    index_dir: Optional[str] = None  # defaults to <cache root_dir>/tag-index
+    update_on_batch: bool = True  # index folders tagged from the Batch Folder tab
+    save_interval_s: float = 30.0  # saves sooner than this after the last one are deferred
+
+@dataclass
+class ManifestConfig:
+    """Configuration for incremental folder tagging"""
+    filename: str = ".wd-tagger-manifest.db"  # created in the output folder, or the input folder
+    store_scores: bool = True  # keep raw scores so threshold changes skip inference
+    score_dtype: str = "float32"  # float16 halves the manifest size at slightly lower precision
+
+@dataclass
+class MetricsConfig:
+    """Configuration for hot-path timing and counters"""
+    enabled: bool = True
+    expose_endpoint: bool = True  # serve Prometheus text on the WebUI app
+    endpoint: str = "/wd-tagger/metrics"
+
+@dataclass
+class ServerConfig:
+    """Configuration for the standalone HTTP tagging service"""
+    host: str = "127.0.0.1"
+    port: int = 7862
+    allow_paths: bool = True  # let clients name image files on this machine
+    max_body_mb: float = 64.0
+    preload_models: List[str] = field(default_factory=list)  # empty keeps the default model warm
+
+@dataclass
+class StartupConfig:
+    """Configuration for extension startup"""
+    warmup_default_model: bool = False  # also enabled by WD_TAGGER_WARMUP=1
+
+@dataclass
+class ResolverConfig:
+    """Configuration for locating model files"""
+    local_models_dir: Optional[str] = None  # also WD_TAGGER_MODELS_DIR
+    offline: bool = False  # also WD_TAGGER_OFFLINE=1 or HF_HUB_OFFLINE=1
+    prefetch_workers: int = 4
+
+@dataclass
+class CacheConfig:
+    """Configuration for the loaded model cache"""
+    max_loaded_models: int = 3
+    memory_budget_mb: int = 4096
+    root_dir: Optional[str] = None  # defaults to WD_TAGGER_CACHE_DIR or ~/.cache/wd-tagger
+    persist_optimized_models: bool = True
+    optimized_model_dir: Optional[str] = None  # defaults to <root_dir>/optimized
+    persist_label_tables: bool = True
+    label_cache_dir: Optional[str] = None  # defaults to <root_dir>/labels
+    converted_model_dir: Optional[str] = None  # fp16/int8 variants, defaults to <root_dir>/converted
 
 class WDTaggerConfig:
     """Main configuration class for WaifuDiffusion Tagger"""
@@ -33,6 +160,19 @@ class WDTaggerConfig:
         
         self.models = self._init_models()
         self.thresholds = ThresholdConfig()
+        self.inference = InferenceConfig()
+        self.scheduler = SchedulerConfig()
+        self.preprocess = PreprocessConfig()
+        self.cache = CacheConfig()
+        self.prediction_cache = PredictionCacheConfig()
+        self.session_profile = SessionProfile()
+        self.categories = CategoryConfig()
+        self.startup = StartupConfig()
+        self.resolver = ResolverConfig()
+        self.tag_index = TagIndexConfig()
+        self.manifest = ManifestConfig()
+        self.metrics = MetricsConfig()
+        self.server = ServerConfig()
         self.file_config = self._init_file_config()
         self.kaomojis = self._init_kaomojis()
     
@@ -112,7 +252,7 @@ class WDTaggerConfig:
     
     def get_model_choices(self) -> List[str]:
         """Get list of model choices for dropdown"""
-        return [model.repo_id for model in self.models.values()]
+        return [model.model_id for model in self.models.values()]
     
     def get_model_labels(self) -> List[str]:
         """Get list of model display names"""
@@ -120,7 +260,41 @@ class WDTaggerConfig:
     
     def get_default_model(self) -> str:
         """Get default model repository ID"""
-        return self.models["swinv2_v3"].repo_id
+        return self.models["swinv2_v3"].model_id
+    
+    def get_repo_ids(self) -> List[str]:
+        """Distinct repositories behind all configured models"""
+        return list(dict.fromkeys(model.repo_id for model in self.models.values()))
+    
+    def get_model_config(self, model_id: str) -> Optional[ModelConfig]:
+        """Get the model configuration for a model ID, if known"""
+        for model in self.models.values():
+            if model.model_id == model_id:
+                return model
+        return None
+    
+    def get_session_profile(self, model_id: str) -> SessionProfile:
+        """Get the session profile for a model, honoring per-model overrides"""
+        model = self.get_model_config(model_id)
+        if model is not None and model.session_profile is not None:
+            return model.session_profile
+        return self.session_profile
+    
+    def warmup_enabled(self) -> bool:
+        """Whether the default model should be loaded once the WebUI has started"""
+        return self.startup.warmup_default_model or os.environ.get("WD_TAGGER_WARMUP", "") == "1"
+    
+    def get_local_models_dir(self) -> Optional[str]:
+        """Directory searched for model files before the HuggingFace cache"""
+        return self.resolver.local_models_dir or os.environ.get("WD_TAGGER_MODELS_DIR") or None
+    
+    def is_offline(self) -> bool:
+        """Whether model files may only come from local storage"""
+        return (
+            self.resolver.offline
+            or os.environ.get("WD_TAGGER_OFFLINE", "") == "1"
+            or os.environ.get("HF_HUB_OFFLINE", "") == "1"
+        )
     
     def get_hf_token(self) -> str:
         """Get HuggingFace token from environment"""
@@ -0,0 +1,208 @@
+import glob
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from core.fileio import atomic_write
+from core.manifest import TagManifest, settings_key
+from core.pipeline import TaggingPipeline
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+
+CAPTION_FORMATS = ("standard", "r34")
+
+ProgressCallback = Callable[[int, int, str], None]
+
+def find_images(input_path: str, recursive: bool = True) -> List[str]:
+    """List image files in a directory, or matching a glob pattern"""
+    if os.path.isdir(input_path):
+        if recursive:
+            paths = [
+                os.path.join(root, name)
+                for root, _, files in os.walk(input_path)
+                for name in files
+            ]
+        else:
+            paths = [os.path.join(input_path, name) for name in os.listdir(input_path)]
+    else:
+        paths = glob.glob(input_path, recursive=recursive)
+
+    return sorted(
+        path for path in paths
+        if os.path.isfile(path) and os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+    )
+
+def caption_path_for(image_path: str, input_root: str, output_dir: Optional[str] = None) -> str:
+    """Sidecar caption path, either next to the image or mirrored into output_dir"""
+    stem = os.path.splitext(image_path)[0]
+    if not output_dir:
+        return f"{stem}.txt"
+    relative = os.path.relpath(stem, input_root)
+    return os.path.join(output_dir, f"{relative}.txt")
+
+def is_caption_current(image_path: str, caption_path: str) -> bool:
+    """Whether a caption exists and is newer than its image"""
+    try:
+        return os.path.getmtime(caption_path) >= os.path.getmtime(image_path)
+    except OSError:
+        return False
+
+def write_caption(caption_path: str, caption: str):
+    """Write a caption file atomically"""
+    with atomic_write(caption_path, "w", encoding="utf-8") as f:
+        f.write(caption)
+
+class DatasetTagger:
+    """Tags a folder of images and writes caption sidecar files"""
+
+    def __init__(self, predictor):
+        self.predictor = predictor
+
+    def _input_root(self, input_path: str) -> str:
+        """Directory that output paths are mirrored relative to"""
+        if os.path.isdir(input_path):
+            return input_path
+        if os.path.isfile(input_path):
+            return os.path.dirname(input_path) or "."
+        # Use the non-wildcard prefix of a glob pattern
+        root = input_path
+        while glob.has_magic(root):
+            root = os.path.dirname(root)
+        return root or "."
+
+    def open_manifest(self, input_path: str, output_dir: Optional[str] = None,
+                      manifest_path: Optional[str] = None) -> TagManifest:
+        """Manifest of a folder, kept in the output folder or else the input folder"""
+        config = self.predictor.config.manifest
+        input_root = self._input_root(input_path)
+        manifest_path = manifest_path or os.path.join(output_dir or input_root, config.filename)
+        return TagManifest(manifest_path, input_root, config.store_scores, config.score_dtype)
+
+    def tag(
+        self,
+        input_path: str,
+        model_repo: str,
+        general_thresh: float,
+        general_mcut_enabled: bool,
+        character_thresh: float,
+        character_mcut_enabled: bool,
+        caption_format: str = "standard",
+        output_dir: Optional[str] = None,
+        prepend_character_tags: bool = True,
+        skip_existing: bool = True,
+        recursive: bool = True,
+        batch_size: Optional[int] = None,
+        progress: Optional[ProgressCallback] = None,
+        index=None,
+        incremental: bool = False,
+        manifest_path: Optional[str] = None
+    ) -> Dict[str, float]:
+        """
+        Caption every image under input_path
+        Images whose caption is already newer than the image are skipped when
+        skip_existing is set, so an interrupted run can simply be restarted.
+        With incremental set, a manifest decides instead: only new or changed
+        files and files last tagged by another model are run through the
+        model, and captions whose thresholds or format changed are re-derived
+        from the stored raw scores. Tagged images are also added to `index`
+        (a TagIndex) when given. Returns counts and throughput for the run.
+        """
+        if caption_format not in CAPTION_FORMATS:
+            raise ValueError(f"Unknown caption format: {caption_format}")
+
+        input_root = self._input_root(input_path)
+        images = find_images(input_path, recursive)
+        captions = {path: caption_path_for(path, input_root, output_dir) for path in images}
+
+        start = time.perf_counter()
+        manifest = plan = None
+        if incremental:
+            labels = self.predictor.get_model(model_repo)
+            model_key = f"{labels.repo_id}|{labels.revision}|{self.predictor.preprocessor.cache_version}"
+            settings = {
+                path: settings_key({
+                    "general_thresh": float(general_thresh),
+                    "general_mcut": bool(general_mcut_enabled),
+                    "character_thresh": float(character_thresh),
+                    "character_mcut": bool(character_mcut_enabled),
+                    "caption_format": caption_format,
+                    "prepend_character_tags": bool(prepend_character_tags),
+                    "caption_path": os.path.abspath(captions[path]),
+                })
+                for path in images
+            }
+            manifest = self.open_manifest(input_path, output_dir, manifest_path)
+            plan = manifest.plan(images, model_key, settings, captions)
+            pending = plan.retag
+        else:
+            pending = [
+                path for path in images
+                if not (skip_existing and is_caption_current(path, captions[path]))
+            ]
+            labels = self.predictor.get_model(model_repo) if pending else None
+
+        stats = {
+            "total": len(images),
+            "skipped": len(images) - len(pending) - (len(plan.rederive) if plan else 0),
+            "rederived": 0,
+            "tagged": 0,
+            "failed": 0,
+            "elapsed": 0.0,
+            "images_per_sec": 0.0,
+        }
+
+        def write(path: str, preds):
+            result = self.predictor.process_predictions(
+                preds, general_thresh, general_mcut_enabled,
+                character_thresh, character_mcut_enabled, labels=labels
+            )
+            standard_tags, r34_tags, _, character_dict, _ = result
+            if prepend_character_tags:
+                standard_tags, r34_tags = self.predictor.tag_processor.prepend_character_tags(
+                    standard_tags, r34_tags, character_dict
+                )
+            write_caption(captions[path], standard_tags if caption_format == "standard" else r34_tags)
+            if index is not None:
+                index.add_result(path, result)
+
+        try:
+            if plan is not None:
+                # Threshold or format changes only: no inference needed
+                for path in plan.rederive:
+                    try:
+                        write(path, manifest.scores(path))
+                        manifest.update(path, settings=settings[path])
+                        stats["rederived"] += 1
+                    except Exception as e:
+                        stats["failed"] += 1
+                        print(f"Failed to re-derive {path}: {str(e)}")
+                manifest.prune(images)
+
+            pipeline = TaggingPipeline(self.predictor)
+            raw_results = pipeline.iter_raw(
+                pending, model_repo, batch_size=batch_size, with_digests=manifest is not None,
+                digests=plan.digests if plan is not None else None
+            ) if pending else []
+
+            for done, (_, path, preds, error, digest) in enumerate(raw_results, start=1):
+                try:
+                    if error is not None:
+                        raise error
+                    write(path, preds)
+                    if manifest is not None:
+                        manifest.record(path, plan.stats[path], digest, model_key, settings[path], preds)
+                    stats["tagged"] += 1
+                except Exception as e:
+                    stats["failed"] += 1
+                    print(f"Failed to tag {path}: {str(e)}")
+
+                if progress is not None:
+                    progress(done, len(pending), path)
+        finally:
+            if manifest is not None:
+                manifest.close()
+
+        stats["elapsed"] = time.perf_counter() - start
+        if stats["elapsed"] > 0:
+            stats["images_per_sec"] = (stats["tagged"] + stats["rederived"] + stats["failed"]) / stats["elapsed"]
+        return stats
@@ -0,0 +1,231 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from core.model_cache import LoadedModel
+from core.prediction_cache import image_digest
+
+FUSION_METHODS = ("mean", "max", "weighted")
+
+@dataclass
+class AlignedVocabulary:
+    """Union label table of several models and where each model's outputs land in it"""
+    labels: LoadedModel
+    columns: List[np.ndarray]
+
+def align_vocabularies(members: Sequence[LoadedModel], tag_processor) -> AlignedVocabulary:
+    """
+    Merge the label sets of several models by tag name
+    Tags keep the order and category of the first model that has them; tags
+    only known to later models are appended.
+    """
+    positions: Dict[str, int] = {}
+    names: List[str] = []
+    categories: List[str] = []
+    columns = []
+
+    for member in members:
+        category_of = np.full(len(member.tag_names), "", dtype=object)
+        category_of[member.rating_indexes] = "rating"
+        category_of[member.general_indexes] = "general"
+        category_of[member.character_indexes] = "character"
+
+        member_columns = np.empty(len(member.tag_names), dtype=np.intp)
+        for column, name in enumerate(member.tag_names.tolist()):
+            position = positions.get(name)
+            if position is None:
+                position = positions[name] = len(names)
+                names.append(name)
+                categories.append(category_of[column])
+            member_columns[column] = position
+        columns.append(member_columns)
+
+    tag_names = np.array(names, dtype=str)
+    categories = np.array(categories, dtype=object)
+    labels = LoadedModel(
+        repo_id="+".join(member.repo_id for member in members),
+        session=None,
+        input_name="",
+        label_name="",
+        input_layout="NHWC",
+        target_size=0,
+        tag_names=tag_names,
+        rating_indexes=np.flatnonzero(categories == "rating").astype(np.intp),
+        general_indexes=np.flatnonzero(categories == "general").astype(np.intp),
+        character_indexes=np.flatnonzero(categories == "character").astype(np.intp),
+        vocabulary=tag_processor.build_vocabulary(tag_names),
+        revision="+".join(member.revision for member in members),
+    )
+    return AlignedVocabulary(labels=labels, columns=columns)
+
+def fuse_predictions(
+    member_preds: Sequence[np.ndarray],
+    columns: Sequence[np.ndarray],
+    num_tags: int,
+    method: str = "mean",
+    weights: Optional[Sequence[float]] = None
+) -> np.ndarray:
+    """
+    Fuse (B, N_i) prediction matrices into one (B, num_tags) matrix
+    mean and weighted average only over the models that know a tag, so a tag
+    missing from one label set is not pulled towards zero; max takes the
+    highest probability of any model.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method: {method}")
+    if method != "weighted" or weights is None:
+        weights = [1.0] * len(member_preds)
+    if len(weights) != len(member_preds):
+        raise ValueError("Expected one weight per model")
+
+    batch = len(member_preds[0])
+    fused = np.zeros((batch, num_tags), dtype=np.float64)
+    if method == "max":
+        for preds, cols in zip(member_preds, columns):
+            np.maximum.at(fused, (slice(None), cols), preds)
+        return fused.astype(np.float32)
+
+    weight_sum = np.zeros(num_tags, dtype=np.float64)
+    for preds, cols, weight in zip(member_preds, columns, weights):
+        np.add.at(fused, (slice(None), cols), weight * np.asarray(preds, dtype=np.float64))
+        np.add.at(weight_sum, cols, weight)
+    np.divide(fused, weight_sum, out=fused, where=weight_sum > 0)
+    return fused.astype(np.float32)
+
+class EnsembleTagger:
+    """
+    Tags images with several models and fuses their probabilities
+    Each image is decoded once and preprocessed once per distinct input size.
+    The member sessions run side by side on a thread pool, and each member
+    still reads and fills its own slot of the prediction cache.
+    """
+
+    def __init__(self, predictor):
+        self.predictor = predictor
+        self._aligned: Dict[Tuple[str, ...], AlignedVocabulary] = {}
+
+    def members(self, model_repos: Sequence[str]) -> List[LoadedModel]:
+        """Loaded models of the ensemble, without switching the active model"""
+        if len(model_repos) > self.predictor.registry.max_models:
+            print(
+                f"Ensemble of {len(model_repos)} models exceeds the model cache "
+                f"({self.predictor.registry.max_models}); members will be reloaded on every call"
+            )
+        return [self.predictor.get_model(model_repo) for model_repo in model_repos]
+
+    def aligned_vocabulary(self, members: Sequence[LoadedModel]) -> AlignedVocabulary:
+        """Union label table of the members, computed once per combination"""
+        key = tuple(f"{member.repo_id}|{member.revision}" for member in members)
+        aligned = self._aligned.get(key)
+        if aligned is None:
+            aligned = self._aligned[key] = align_vocabularies(members, self.predictor.tag_processor)
+        return aligned
+
+    def _decode(self, image: Union[Image.Image, str], target_size: int) -> Image.Image:
+        if isinstance(image, str):
+            with self.predictor.preprocessor.open_image(image, target_size) as opened:
+                opened.load()
+                return opened.copy()
+        return image
+
+    def _member_preds(self, images: Sequence[Union[Image.Image, str]],
+                      members: Sequence[LoadedModel]) -> List[np.ndarray]:
+        """(B, N_i) predictions of every member, from the cache where possible"""
+        predictor = self.predictor
+        cache = predictor.prediction_cache
+        digests = [image_digest(image) for image in images] if cache is not None else None
+
+        member_preds: List[List[Optional[np.ndarray]]] = []
+        keys: List[List[Optional[str]]] = []
+        for member in members:
+            member_keys = [
+                cache.make_key(digest, member.repo_id, member.revision, predictor.preprocessor.cache_version)
+                for digest in digests
+            ] if cache is not None else [None] * len(images)
+            keys.append(member_keys)
+            member_preds.append([cache.get(key) if key is not None else None for key in member_keys])
+
+        # Decode once, preprocess once per input size the missing rows need
+        pending_sizes = {
+            member.target_size
+            for member, preds in zip(members, member_preds)
+            if any(row is None for row in preds)
+        }
+        batches: Dict[int, np.ndarray] = {}
+        if pending_sizes:
+            decoded = [self._decode(image, max(pending_sizes)) for image in images]
+            for size in pending_sizes:
+                batch = np.empty((len(images), size, size, 3), dtype=np.float32)
+                for row, image in enumerate(decoded):
+                    predictor.preprocessor.prepare(image, size, out=batch[row])
+                batches[size] = batch
+
+        def run(position: int):
+            member = members[position]
+            missing = [row for row, preds in enumerate(member_preds[position]) if preds is None]
+            if missing:
+                preds = predictor.run_batch(batches[member.target_size][missing], member)
+                for row, output in zip(missing, preds):
+                    member_preds[position][row] = output
+                    if keys[position][row] is not None:
+                        cache.put(keys[position][row], output)
+            return np.stack(member_preds[position])
+
+        if predictor.config.inference.ensemble_concurrent and len(members) > 1:
+            with ThreadPoolExecutor(max_workers=len(members)) as executor:
+                return list(executor.map(run, range(len(members))))
+        return [run(position) for position in range(len(members))]
+
+    def predict_raw(
+        self,
+        images: Sequence[Union[Image.Image, str]],
+        model_repos: Sequence[str],
+        method: str = "mean",
+        weights: Optional[Sequence[float]] = None
+    ) -> Tuple[np.ndarray, LoadedModel]:
+        """Fused (B, num_tags) probabilities and the union label table they index"""
+        members = self.members(model_repos)
+        aligned = self.aligned_vocabulary(members)
+        member_preds = self._member_preds(images, members)
+        fused = fuse_predictions(
+            member_preds, aligned.columns, len(aligned.labels.tag_names), method, weights
+        )
+        return fused, aligned.labels
+
+    def batch_predict(
+        self,
+        images: Sequence[Union[Image.Image, str]],
+        model_repos: Sequence[str],
+        general_thresh: float,
+        general_mcut_enabled: bool,
+        character_thresh: float,
+        character_mcut_enabled: bool,
+        method: str = "mean",
+        weights: Optional[Sequence[float]] = None,
+        batch_size: Optional[int] = None
+    ) -> List[Tuple]:
+        """Ensemble predictions for several images, in predict()'s result format"""
+        predictor = self.predictor
+        batch_size = max(1, batch_size or predictor.config.inference.max_batch_size)
+        results = []
+        for start in range(0, len(images), batch_size):
+            chunk = images[start:start + batch_size]
+            try:
+                fused, labels = self.predict_raw(chunk, model_repos, method, weights)
+            except Exception as e:
+                results.extend((f"Ensemble prediction error: {str(e)}", "", {}, {}, {}) for _ in chunk)
+                continue
+
+            general_threshes, character_threshes = predictor.batch_thresholds(
+                fused, general_thresh, general_mcut_enabled,
+                character_thresh, character_mcut_enabled, labels=labels
+            )
+            for row in range(len(chunk)):
+                results.append(predictor.process_predictions(
+                    fused[row], general_threshes[row], False,
+                    character_threshes[row], False, labels=labels
+                ))
+        return results
@@ -0,0 +1,337 @@
+import abc
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from core.dataset import ProgressCallback, find_images
+from core.pipeline import TaggingPipeline
+
+EXPORT_FORMATS = ("jsonl", "parquet", "sqlite")
+
+FORMAT_EXTENSIONS = {
+    ".jsonl": "jsonl",
+    ".json": "jsonl",
+    ".parquet": "parquet",
+    ".db": "sqlite",
+    ".sqlite": "sqlite",
+    ".sqlite3": "sqlite",
+}
+
+def export_format_for(path: str) -> str:
+    """Export format implied by an output file extension"""
+    if path == "-":
+        return "jsonl"
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Cannot tell the export format of {path}; use one of {', '.join(EXPORT_FORMATS)}")
+    return FORMAT_EXTENSIONS[extension]
+
+def _scored(tags: Dict[str, float]) -> List[Dict[str, object]]:
+    return [{"tag": tag, "score": float(score)} for tag, score in tags.items()]
+
+def build_record(
+    path: str,
+    digest: str,
+    model_repo: str,
+    thresholds: Dict[str, object],
+    result: tuple,
+    preds: Optional[np.ndarray] = None,
+    tag_names: Optional[np.ndarray] = None,
+    top_k: int = 0
+) -> Dict[str, object]:
+    """One exported row: where the image is, what it is, and what the model said"""
+    standard_tags, r34_tags, rating_dict, character_dict, general_dict = result
+    record = {
+        "path": path,
+        "digest": digest,
+        "model": model_repo,
+        **thresholds,
+        "tags": standard_tags,
+        "r34_tags": r34_tags,
+        "rating": _scored(rating_dict),
+        "character": _scored(character_dict),
+        "general": _scored(general_dict),
+        "top_k": [],
+    }
+    if top_k and preds is not None:
+        top_k = min(top_k, len(preds))
+        top = np.argpartition(preds, len(preds) - top_k)[len(preds) - top_k:]
+        top = top[np.argsort(-preds[top], kind="stable")]
+        record["top_k"] = [
+            {"index": int(index), "tag": str(tag_names[index]), "score": float(preds[index])}
+            for index in top
+        ]
+    return record
+
+class ResultExporter(abc.ABC):
+    """
+    Writes result records incrementally
+    Records are buffered and handed to the backend every `flush_every`
+    records, so memory stays constant however many images are exported.
+    """
+
+    def __init__(self, path: str, flush_every: int = 1000):
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self.written = 0
+        self._buffer: List[Dict[str, object]] = []
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, record: Dict[str, object]):
+        self._buffer.append(record)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._write_rows(self._buffer)
+            self.written += len(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    @abc.abstractmethod
+    def _write_rows(self, rows: List[Dict[str, object]]):
+        """Hand one buffer of records to the backend"""
+
+    def _close(self):
+        pass
+
+    def __enter__(self) -> "ResultExporter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class JsonlExporter(ResultExporter):
+    """One JSON object per line; a path of "-" writes to stdout"""
+
+    def __init__(self, path: str, flush_every: int = 1000):
+        super().__init__(path, flush_every)
+        self._owns_file = path != "-"
+        self._file = open(path, "w", encoding="utf-8") if self._owns_file else sys.stdout
+
+    def _write_rows(self, rows: List[Dict[str, object]]):
+        self._file.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+        self._file.flush()
+
+    def _close(self):
+        if self._owns_file:
+            self._file.close()
+
+class ParquetExporter(ResultExporter):
+    """Parquet file with one row group per flush; needs pyarrow"""
+
+    def __init__(self, path: str, flush_every: int = 1000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception("Parquet export requires pyarrow (pip install pyarrow)")
+        super().__init__(path, flush_every)
+        self._pa = pa
+        scored = pa.list_(pa.struct([("tag", pa.string()), ("score", pa.float32())]))
+        self.schema = pa.schema([
+            ("path", pa.string()),
+            ("digest", pa.string()),
+            ("model", pa.string()),
+            ("general_thresh", pa.float64()),
+            ("general_mcut", pa.bool_()),
+            ("character_thresh", pa.float64()),
+            ("character_mcut", pa.bool_()),
+            ("tags", pa.string()),
+            ("r34_tags", pa.string()),
+            ("rating", scored),
+            ("character", scored),
+            ("general", scored),
+            ("top_k", pa.list_(pa.struct([("index", pa.int32()), ("tag", pa.string()), ("score", pa.float32())]))),
+        ])
+        self._writer = pq.ParquetWriter(path, self.schema)
+
+    def _write_rows(self, rows: List[Dict[str, object]]):
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self.schema))
+
+    def _close(self):
+        self._writer.close()
+
+class SqliteExporter(ResultExporter):
+    """
+    SQLite database with an images table and one tags row per selected tag
+    The tags table is indexed by tag, so "which images have X" is a lookup.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS images (
+        id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL,
+        digest TEXT NOT NULL,
+        model TEXT NOT NULL,
+        general_thresh REAL,
+        general_mcut INTEGER,
+        character_thresh REAL,
+        character_mcut INTEGER,
+        tags TEXT,
+        r34_tags TEXT,
+        top_k TEXT
+    );
+    CREATE TABLE IF NOT EXISTS tags (
+        image_id INTEGER NOT NULL REFERENCES images(id),
+        category TEXT NOT NULL,
+        tag TEXT NOT NULL,
+        score REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS tags_by_tag ON tags(tag, score);
+    CREATE INDEX IF NOT EXISTS tags_by_image ON tags(image_id);
+    CREATE INDEX IF NOT EXISTS images_by_digest ON images(digest);
+    CREATE INDEX IF NOT EXISTS images_by_path ON images(path);
+    """
+
+    def __init__(self, path: str, flush_every: int = 1000):
+        super().__init__(path, flush_every)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(self.SCHEMA)
+
+    def _write_rows(self, rows: List[Dict[str, object]]):
+        with self._connection:
+            for row in rows:
+                cursor = self._connection.execute(
+                    "INSERT INTO images (path, digest, model, general_thresh, general_mcut, character_thresh,"
+                    " character_mcut, tags, r34_tags, top_k) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        row["path"], row["digest"], row["model"],
+                        row["general_thresh"], int(row["general_mcut"]),
+                        row["character_thresh"], int(row["character_mcut"]),
+                        row["tags"], row["r34_tags"],
+                        json.dumps(row["top_k"]) if row["top_k"] else None,
+                    )
+                )
+                image_id = cursor.lastrowid
+                self._connection.executemany(
+                    "INSERT INTO tags (image_id, category, tag, score) VALUES (?, ?, ?, ?)",
+                    [
+                        (image_id, category, item["tag"], item["score"])
+                        for category in ("rating", "character", "general")
+                        for item in row[category]
+                    ]
+                )
+
+    def _close(self):
+        self._connection.close()
+
+EXPORTERS = {
+    "jsonl": JsonlExporter,
+    "parquet": ParquetExporter,
+    "sqlite": SqliteExporter,
+}
+
+def open_exporter(path: str, export_format: Optional[str] = None, flush_every: int = 1000) -> ResultExporter:
+    """Create the exporter for a path, picking the format from its extension by default"""
+    export_format = export_format or export_format_for(path)
+    if export_format not in EXPORTERS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    return EXPORTERS[export_format](path, flush_every)
+
+class ResultExportStage:
+    """Tags a folder of images and streams the results into an exporter"""
+
+    def __init__(self, predictor):
+        self.predictor = predictor
+
+    def export(
+        self,
+        input_path: str,
+        output_path: str,
+        model_repo: str,
+        general_thresh: float,
+        general_mcut_enabled: bool,
+        character_thresh: float,
+        character_mcut_enabled: bool,
+        export_format: Optional[str] = None,
+        top_k: int = 0,
+        flush_every: int = 1000,
+        recursive: bool = True,
+        batch_size: Optional[int] = None,
+        progress: Optional[ProgressCallback] = None,
+        index=None
+    ) -> Dict[str, float]:
+        """
+        Export the tags of every image under input_path to output_path
+        With top_k set, each row also carries the top_k raw scores over the
+        whole vocabulary. Exported rows are also added to `index` (a
+        TagIndex) when given. Returns counts and throughput for the run.
+        """
+        images = find_images(input_path, recursive)
+        with open_exporter(output_path, export_format, flush_every) as exporter:
+            return self.export_images(
+                images, exporter, model_repo, general_thresh, general_mcut_enabled,
+                character_thresh, character_mcut_enabled, top_k, batch_size, progress, index
+            )
+
+    def export_images(
+        self,
+        images: List[str],
+        exporter: ResultExporter,
+        model_repo: str,
+        general_thresh: float,
+        general_mcut_enabled: bool,
+        character_thresh: float,
+        character_mcut_enabled: bool,
+        top_k: int = 0,
+        batch_size: Optional[int] = None,
+        progress: Optional[ProgressCallback] = None,
+        index=None
+    ) -> Dict[str, float]:
+        """Tag a list of image files into an already open exporter"""
+        predictor = self.predictor
+        labels = predictor.get_model(model_repo)
+        thresholds = {
+            "general_thresh": float(general_thresh),
+            "general_mcut": bool(general_mcut_enabled),
+            "character_thresh": float(character_thresh),
+            "character_mcut": bool(character_mcut_enabled),
+        }
+        stats = {"total": len(images), "exported": 0, "failed": 0, "elapsed": 0.0, "images_per_sec": 0.0}
+
+        start = time.perf_counter()
+        pipeline = TaggingPipeline(predictor)
+        raw_results = pipeline.iter_raw(images, model_repo, batch_size=batch_size, with_digests=True) if images else []
+        for done, (_, path, preds, error, digest) in enumerate(raw_results, start=1):
+            try:
+                if error is not None:
+                    raise error
+                result = predictor.process_predictions(
+                    preds, general_thresh, general_mcut_enabled,
+                    character_thresh, character_mcut_enabled, labels=labels
+                )
+                record = build_record(
+                    path, digest, model_repo, thresholds, result,
+                    preds, labels.tag_names, top_k
+                )
+                exporter.write(record)
+                if index is not None:
+                    index.add_record(record)
+                stats["exported"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"Failed to export {path}: {str(e)}", file=sys.stderr)
+
+            if progress is not None:
+                progress(done, len(images), path)
+
+        stats["elapsed"] = time.perf_counter() - start
+        if stats["elapsed"] > 0:
+            stats["images_per_sec"] = (stats["exported"] + stats["failed"]) / stats["elapsed"]
+        return stats
+
+if __name__ == "__main__":
+    # Tagging into an export file is `python -m core.cli tag INPUT... --output FILE`
+    from core.cli import main
+    raise SystemExit(main(["tag", *sys.argv[1:]]))
@@ -0,0 +1,34 @@
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional
+
+@contextmanager
+def atomic_path(path: str, directory: bool = False) -> Iterator[str]:
+    """
+    Yield a temporary path next to path and move it into place on success
+    The temporary name is unique per call, so concurrent writers never share
+    one; if the block raises, the temporary file or directory is removed.
+    """
+    parent = os.path.dirname(path) or "."
+    os.makedirs(parent, exist_ok=True)
+    # Not tempfile.mkstemp: its 0600 mode would carry over to caption files
+    tmp_path = os.path.join(parent, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    if directory:
+        os.mkdir(tmp_path)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w", encoding: Optional[str] = None) -> Iterator[IO]:
+    """Open a file for writing that replaces path only once fully written"""
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            yield f
@@ -0,0 +1,106 @@
+import csv
+import hashlib
+import os
+import shutil
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from core.config import default_cache_root
+from core.fileio import atomic_path
+
+# Bump whenever the cached layout or the name processing changes
+LABEL_CACHE_VERSION = 1
+
+RATING_CATEGORY = 9
+GENERAL_CATEGORY = 0
+CHARACTER_CATEGORY = 4
+
+LABEL_ARRAYS = ("tag_names", "rating_indexes", "general_indexes", "character_indexes")
+
+LabelTable = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+def default_label_cache_dir(cache_root: Optional[str] = None) -> str:
+    """Directory for parsed label tables under the wd-tagger cache root"""
+    return os.path.join(cache_root or default_cache_root(), "labels")
+
+def parse_label_csv(csv_path: str) -> Tuple[List[str], np.ndarray]:
+    """Read tag names and category codes from a selected_tags.csv file"""
+    names = []
+    categories = []
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            names.append(row["name"])
+            categories.append(int(row["category"]))
+    return names, np.asarray(categories, dtype=np.int64)
+
+def build_label_table(names: Iterable[str], categories: Iterable[int], kaomojis: Iterable[str]) -> LabelTable:
+    """
+    Turn raw names and category codes into display names and index arrays
+    Underscores become spaces except in kaomojis, which keep them.
+    """
+    kaomojis = set(kaomojis)
+    tag_names = np.array(
+        [name.replace("_", " ") if name not in kaomojis else name for name in names],
+        dtype=str
+    )
+
+    categories = np.asarray(categories)
+    rating_indexes = np.flatnonzero(categories == RATING_CATEGORY).astype(np.intp)
+    general_indexes = np.flatnonzero(categories == GENERAL_CATEGORY).astype(np.intp)
+    character_indexes = np.flatnonzero(categories == CHARACTER_CATEGORY).astype(np.intp)
+
+    return tag_names, rating_indexes, general_indexes, character_indexes
+
+def label_cache_key(csv_path: str, kaomojis: Iterable[str]) -> str:
+    """Key of a label table: the CSV contents plus everything applied to it"""
+    digest = hashlib.sha256()
+    digest.update(f"v{LABEL_CACHE_VERSION}\0".encode("utf-8"))
+    digest.update("\0".join(sorted(kaomojis)).encode("utf-8"))
+    with open(csv_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+def _load_cached(table_dir: str) -> Optional[LabelTable]:
+    """Memory-map a cached label table, or None if it is missing or broken"""
+    if not os.path.isdir(table_dir):
+        return None
+    try:
+        return tuple(
+            np.load(os.path.join(table_dir, f"{name}.npy"), mmap_mode="r")
+            for name in LABEL_ARRAYS
+        )
+    except (OSError, ValueError) as e:
+        print(f"Discarding label cache {table_dir}: {str(e)}")
+        shutil.rmtree(table_dir, ignore_errors=True)
+        return None
+
+def _save_cached(table_dir: str, table: LabelTable):
+    """Write a label table as one .npy file per array, atomically"""
+    try:
+        with atomic_path(table_dir, directory=True) as tmp_dir:
+            for name, array in zip(LABEL_ARRAYS, table):
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    except OSError as e:
+        print(f"Could not write label cache {table_dir}: {str(e)}")
+
+def load_label_table(csv_path: str, kaomojis: Iterable[str], cache_dir: Optional[str] = None) -> LabelTable:
+    """
+    Load the label table of a model
+    With a cache_dir, the parsed table is stored there keyed by the CSV hash
+    and later loads memory-map it instead of parsing the CSV.
+    """
+    kaomojis = list(kaomojis)
+    if cache_dir is None:
+        return build_label_table(*parse_label_csv(csv_path), kaomojis)
+
+    table_dir = os.path.join(cache_dir, label_cache_key(csv_path, kaomojis))
+    table = _load_cached(table_dir)
+    if table is not None:
+        return table
+
+    table = build_label_table(*parse_label_csv(csv_path), kaomojis)
+    os.makedirs(cache_dir, exist_ok=True)
+    _save_cached(table_dir, table)
+    return table
@@ -0,0 +1,192 @@
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from core.prediction_cache import image_digest
+
+@dataclass
+class ManifestEntry:
+    """What was recorded the last time a file was tagged"""
+    path: str
+    size: int
+    mtime_ns: int
+    digest: str
+    model_key: str
+    settings: str
+    has_scores: bool
+
+@dataclass
+class ManifestPlan:
+    """How each image of a folder has to be handled in an incremental run"""
+    unchanged: List[str]
+    rederive: List[str]
+    retag: List[str]
+    stats: Dict[str, os.stat_result]
+    digests: Dict[str, str]
+
+def settings_key(settings: Dict[str, object]) -> str:
+    """Canonical form of the caption settings, compared between runs"""
+    return json.dumps(settings, sort_keys=True)
+
+class TagManifest:
+    """
+    SQLite record of every file tagged in a folder
+    Rows hold the file's size, mtime and content hash, the model and caption
+    settings it was tagged with, and optionally its raw scores. Paths are
+    stored relative to the folder root so the folder can be moved.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        digest TEXT NOT NULL,
+        model_key TEXT NOT NULL,
+        settings TEXT NOT NULL,
+        scores BLOB,
+        score_dtype TEXT,
+        tagged_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path: str, root: str, store_scores: bool = True,
+                 score_dtype: str = "float32", commit_every: int = 500):
+        if score_dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported score dtype: {score_dtype}")
+        self.path = path
+        self.root = root
+        self.store_scores = store_scores
+        self.score_dtype = score_dtype
+        self.commit_every = max(1, commit_every)
+        self._uncommitted = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(self.SCHEMA)
+
+    def relative(self, path: str) -> str:
+        return os.path.relpath(path, self.root)
+
+    def entries(self) -> Dict[str, ManifestEntry]:
+        """Every recorded file, keyed by relative path, without the scores"""
+        rows = self._connection.execute(
+            "SELECT path, size, mtime_ns, digest, model_key, settings, scores IS NOT NULL FROM files"
+        )
+        return {
+            row[0]: ManifestEntry(row[0], row[1], row[2], row[3], row[4], row[5], bool(row[6]))
+            for row in rows
+        }
+
+    def scores(self, path: str) -> Optional[np.ndarray]:
+        """Stored raw scores of a file as float32, or None"""
+        row = self._connection.execute(
+            "SELECT scores, score_dtype FROM files WHERE path = ?", (self.relative(path),)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return np.frombuffer(row[0], dtype=row[1]).astype(np.float32)
+
+    def record(self, path: str, stat: os.stat_result, digest: str, model_key: str,
+               settings: str, scores: Optional[np.ndarray] = None):
+        """Record a freshly tagged file"""
+        blob = None
+        if self.store_scores and scores is not None:
+            blob = np.ascontiguousarray(scores, dtype=self.score_dtype).tobytes()
+        self._connection.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, digest, model_key, settings, scores,"
+            " score_dtype, tagged_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                self.relative(path), stat.st_size, stat.st_mtime_ns, digest, model_key, settings,
+                blob, self.score_dtype if blob is not None else None, time.time(),
+            )
+        )
+        self._maybe_commit()
+
+    def update(self, path: str, stat: Optional[os.stat_result] = None, settings: Optional[str] = None):
+        """Refresh the stat or settings of a file whose content and scores still hold"""
+        relative = self.relative(path)
+        if stat is not None:
+            self._connection.execute(
+                "UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                (stat.st_size, stat.st_mtime_ns, relative)
+            )
+        if settings is not None:
+            self._connection.execute(
+                "UPDATE files SET settings = ?, tagged_at = ? WHERE path = ?",
+                (settings, time.time(), relative)
+            )
+        self._maybe_commit()
+
+    def prune(self, keep: Iterable[str]) -> int:
+        """Forget files that no longer exist on disk and are not in `keep`"""
+        keep = {self.relative(path) for path in keep}
+        stale = [
+            (path,) for (path,) in self._connection.execute("SELECT path FROM files")
+            if path not in keep and not os.path.exists(os.path.join(self.root, path))
+        ]
+        self._connection.executemany("DELETE FROM files WHERE path = ?", stale)
+        self._maybe_commit()
+        return len(stale)
+
+    def plan(self, images: List[str], model_key: str, settings: Dict[str, str],
+             caption_paths: Dict[str, str]) -> ManifestPlan:
+        """
+        Sort images into unchanged, re-derivable and to-be-tagged
+        A file whose size and mtime match its record is trusted without
+        hashing; otherwise it is hashed, so a touched but identical file is
+        not re-tagged. Files tagged with the same model but other settings,
+        or whose caption is gone, are re-derived from stored scores.
+        """
+        entries = self.entries()
+        plan = ManifestPlan([], [], [], {}, {})
+        for path in images:
+            stat = os.stat(path)
+            plan.stats[path] = stat
+            entry = entries.get(self.relative(path))
+            if entry is None:
+                plan.retag.append(path)
+                continue
+
+            if entry.size != stat.st_size or entry.mtime_ns != stat.st_mtime_ns:
+                digest = image_digest(path)
+                plan.digests[path] = digest
+                if digest != entry.digest:
+                    plan.retag.append(path)
+                    continue
+                self.update(path, stat=stat)
+
+            if entry.model_key != model_key:
+                plan.retag.append(path)
+            elif entry.settings == settings[path] and os.path.exists(caption_paths[path]):
+                plan.unchanged.append(path)
+            elif entry.has_scores:
+                plan.rederive.append(path)
+            else:
+                plan.retag.append(path)
+        self.commit()
+        return plan
+
+    def _maybe_commit(self):
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self._connection.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+    def __enter__(self) -> "TagManifest":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,198 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+STAGES = (
+    "resolve",
+    "session_load",
+    "decode",
+    "preprocess",
+    "inference",
+    "scheduler_wait",
+    "postprocess",
+    "format",
+)
+
+StageHook = Callable[[str, float], None]
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process, if the platform reports it"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _StageTimer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics: "PredictorMetrics", stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+class PredictorMetrics:
+    """
+    Per-stage timers and event counters for the tagging hot path
+    Totals are process-wide. Inside a request() block the stages timed on
+    the calling thread are also collected for that request alone, which is
+    what the Processing Info panel shows. Hooks receive every (stage,
+    seconds) observation, for forwarding to an external metrics system.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._hooks: List[StageHook] = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._count: Dict[str, int] = {}
+            self._total: Dict[str, float] = {}
+            self._max: Dict[str, float] = {}
+            self._counters: Dict[str, float] = {}
+
+    def time(self, stage: str):
+        """Context manager that times one stage"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, stage)
+
+    def observe(self, stage: str, seconds: float):
+        """Record one duration of a stage"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._count[stage] = self._count.get(stage, 0) + 1
+            self._total[stage] = self._total.get(stage, 0.0) + seconds
+            if seconds > self._max.get(stage, 0.0):
+                self._max[stage] = seconds
+        timings = getattr(self._local, "timings", None)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+        for hook in self._hooks:
+            try:
+                hook(stage, seconds)
+            except Exception as e:
+                print(f"Metrics hook failed: {str(e)}")
+
+    def increment(self, name: str, amount: float = 1):
+        """Add to an event counter"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe_batch(self, size: int, capacity: int):
+        """Record how full an inference batch was"""
+        self.increment("batches")
+        self.increment("batch_images", size)
+        self.increment("batch_capacity", max(size, capacity))
+
+    @contextmanager
+    def request(self) -> Iterator[Dict[str, float]]:
+        """Collect the stage timings of the calling thread into a dict"""
+        previous = getattr(self._local, "timings", None)
+        timings: Dict[str, float] = {}
+        self._local.timings = timings
+        try:
+            yield timings
+        finally:
+            self._local.timings = previous
+
+    def add_hook(self, hook: StageHook):
+        """Call hook(stage, seconds) for every observation"""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: StageHook):
+        if hook in self._hooks:
+            self._hooks.remove(hook)
+
+    def batch_fill_ratio(self) -> float:
+        """Mean fraction of batch capacity that carried images"""
+        with self._lock:
+            capacity = self._counters.get("batch_capacity", 0)
+            return self._counters.get("batch_images", 0) / capacity if capacity else 0.0
+
+    def snapshot(self, extra_counters: Optional[Dict[str, float]] = None,
+                 gauges: Optional[Dict[str, float]] = None) -> Dict[str, object]:
+        """Stage totals, counters, gauges and the memory high-water mark"""
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": self._count[stage],
+                    "total_seconds": self._total[stage],
+                    "mean_ms": self._total[stage] / self._count[stage] * 1000,
+                    "max_ms": self._max[stage] * 1000,
+                }
+                for stage in sorted(self._count, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES))
+            }
+            counters = dict(self._counters)
+        counters.update(extra_counters or {})
+        return {
+            "stages": stages,
+            "counters": counters,
+            "gauges": dict(gauges or {}),
+            "batch_fill_ratio": self.batch_fill_ratio(),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    def prometheus_text(self, extra_counters: Optional[Dict[str, float]] = None,
+                        gauges: Optional[Dict[str, float]] = None, prefix: str = "wd_tagger") -> str:
+        """Snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot(extra_counters, gauges)
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each stage of tagging",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for stage, values in snapshot["stages"].items():
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {values["total_seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {values["count"]}')
+        lines += [
+            f"# HELP {prefix}_stage_max_seconds Longest single observation of each stage",
+            f"# TYPE {prefix}_stage_max_seconds gauge",
+        ]
+        for stage, values in snapshot["stages"].items():
+            lines.append(f'{prefix}_stage_max_seconds{{stage="{stage}"}} {values["max_ms"] / 1000:.6f}')
+        lines += [
+            f"# HELP {prefix}_events_total Counted events",
+            f"# TYPE {prefix}_events_total counter",
+        ]
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f'{prefix}_events_total{{event="{name}"}} {value:g}')
+        lines += [
+            f"# HELP {prefix}_batch_fill_ratio Mean fraction of batch capacity used",
+            f"# TYPE {prefix}_batch_fill_ratio gauge",
+            f"{prefix}_batch_fill_ratio {snapshot['batch_fill_ratio']:.6f}",
+        ]
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines += [f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value:g}"]
+        if snapshot["peak_rss_mb"] is not None:
+            lines += [
+                f"# HELP {prefix}_peak_rss_bytes Peak resident set size of the process",
+                f"# TYPE {prefix}_peak_rss_bytes gauge",
+                f"{prefix}_peak_rss_bytes {int(snapshot['peak_rss_mb'] * 1024 * 1024)}",
+            ]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+@dataclass
+class LoadedModel:
+    """An inference session together with its label tables"""
+    repo_id: str
+    session: Any
+    input_name: str
+    label_name: str
+    input_layout: str
+    target_size: int
+    tag_names: np.ndarray
+    rating_indexes: np.ndarray
+    general_indexes: np.ndarray
+    character_indexes: np.ndarray
+    vocabulary: Any = None
+    revision: str = ""
+    memory_bytes: int = 0
+
+class ModelRegistry:
+    """
+    Keeps several loaded models at once, keyed by repo_id
+    Entries are evicted least-recently-used first whenever the number of
+    models or their estimated memory exceeds the configured limits. The most
+    recently inserted model is always kept, even if it alone is over budget.
+    """
+
+    def __init__(self, max_models: int = 3, memory_budget_mb: int = 4096):
+        self.max_models = max_models
+        self.memory_budget_bytes = memory_budget_mb * 1024 * 1024
+        self._entries: "OrderedDict[str, LoadedModel]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, repo_id: str) -> Optional[LoadedModel]:
+        """Return a cached model and mark it as most recently used"""
+        with self._lock:
+            entry = self._entries.get(repo_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(repo_id)
+            self.hits += 1
+            return entry
+
+    def peek(self, repo_id: str) -> Optional[LoadedModel]:
+        """Return a cached model without counting a hit or miss or touching its recency"""
+        with self._lock:
+            return self._entries.get(repo_id)
+
+    def put(self, entry: LoadedModel) -> List[str]:
+        """Insert a model and return the repo_ids evicted to make room"""
+        with self._lock:
+            self._entries[entry.repo_id] = entry
+            self._entries.move_to_end(entry.repo_id)
+            return self._enforce_limits()
+
+    def evict(self, repo_id: str) -> bool:
+        """Drop a single model from the registry"""
+        with self._lock:
+            if self._entries.pop(repo_id, None) is None:
+                return False
+            self.evictions += 1
+            return True
+
+    def clear(self):
+        """Drop every loaded model"""
+        with self._lock:
+            self.evictions += len(self._entries)
+            self._entries.clear()
+
+    def _enforce_limits(self) -> List[str]:
+        """Evict least recently used models until within limits"""
+        evicted = []
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_models
+            or self.memory_usage() > self.memory_budget_bytes
+        ):
+            repo_id, _ = self._entries.popitem(last=False)
+            evicted.append(repo_id)
+            self.evictions += 1
+        return evicted
+
+    def memory_usage(self) -> int:
+        """Estimated memory held by all loaded models, in bytes"""
+        return sum(entry.memory_bytes for entry in self._entries.values())
+
+    def loaded_repos(self) -> List[str]:
+        """Repo ids currently loaded, least recently used first"""
+        with self._lock:
+            return list(self._entries.keys())
+
+    def __contains__(self, repo_id: str) -> bool:
+        return repo_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss/eviction counters and current usage"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "loaded_models": len(self._entries),
+                "memory_bytes": self.memory_usage(),
+            }
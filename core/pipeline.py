@@ -0,0 +1,234 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from core.model_cache import LoadedModel
+from core.prediction_cache import image_digest
+
+ImageSource = Union[str, Image.Image]
+
+_DONE = object()
+
+class CachedPrediction:
+    """Marks a probability vector that came from the prediction cache"""
+
+    def __init__(self, preds: np.ndarray):
+        self.preds = preds
+
+class TaggingPipeline:
+    """
+    Producer/consumer pipeline around a WaifuDiffusionPredictor
+    A thread pool decodes and preprocesses images while the calling thread
+    runs the ONNX session, so decoding and inference overlap. Ready batches
+    wait in a bounded queue, which blocks the producer when inference falls
+    behind. Results come back in input order, or in completion order when
+    `ordered` is False.
+    """
+
+    def __init__(
+        self,
+        predictor,
+        num_workers: Optional[int] = None,
+        prefetch_batches: Optional[int] = None,
+        ordered: Optional[bool] = None
+    ):
+        inference = predictor.config.inference
+        self.predictor = predictor
+        self.num_workers = max(1, num_workers or inference.preprocess_workers)
+        self.prefetch_batches = max(1, prefetch_batches or inference.prefetch_batches)
+        self.ordered = inference.ordered_results if ordered is None else ordered
+
+    def _prepare(
+        self,
+        index: int,
+        source: ImageSource,
+        entry: LoadedModel,
+        with_digest: bool,
+        digest: Optional[str] = None
+    ) -> Tuple[int, Any, Optional[str], Optional[str]]:
+        """
+        Decode and preprocess one image, returning the error instead of raising
+        Images found in the prediction cache come back as ready probability
+        vectors wrapped in CachedPrediction and skip preprocessing entirely.
+        The content digest is computed once, for the cache key and the caller,
+        unless the caller already knows it.
+        """
+        key = None
+        try:
+            if source is None:
+                raise ValueError("No image provided")
+            if digest is None and (with_digest or self.predictor.prediction_cache is not None):
+                digest = image_digest(source)
+            key = self.predictor.prediction_key(source, entry, digest)
+            if key is not None:
+                cached = self.predictor.prediction_cache.get(key)
+                if cached is not None:
+                    return index, CachedPrediction(cached), key, digest
+            return index, self.predictor.preprocessor.prepare(source, entry.target_size), key, digest
+        except Exception as e:
+            return index, e, key, digest
+
+    def _produce(
+        self,
+        sources: Iterable[ImageSource],
+        entry: LoadedModel,
+        batch_size: int,
+        with_digests: bool,
+        digests: Optional[Dict[str, str]],
+        ready: "queue.Queue",
+        stop: threading.Event
+    ):
+        """Feed preprocessed batches into the ready queue"""
+        def emit(item) -> bool:
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        window = batch_size * (self.prefetch_batches + 1)
+        pending: "deque[Future]" = deque()
+        items: List[Tuple[int, ImageSource, Any, Optional[str], Optional[str]]] = []
+        sources_by_index = {}
+
+        def collect(futures: Iterable[Future]) -> bool:
+            for future in futures:
+                index, prepared, key, digest = future.result()
+                items.append((index, sources_by_index.pop(index), prepared, key, digest))
+                if len(items) >= batch_size:
+                    if not emit(list(items)):
+                        return False
+                    items.clear()
+            return True
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="wd-tagger-prep") as pool:
+                for index, source in enumerate(sources):
+                    if stop.is_set():
+                        return
+                    sources_by_index[index] = source
+                    known = digests.get(source) if digests and isinstance(source, str) else None
+                    pending.append(pool.submit(self._prepare, index, source, entry, with_digests, known))
+
+                    if len(pending) < window:
+                        continue
+                    if self.ordered:
+                        done = [pending.popleft()]
+                    else:
+                        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        done = [f for f in pending if f in finished]
+                        for future in done:
+                            pending.remove(future)
+                    if not collect(done):
+                        return
+
+                if not collect(pending):
+                    return
+                if items:
+                    emit(list(items))
+        except Exception as e:
+            emit(e)
+        finally:
+            emit(_DONE)
+
+    def iter_raw(
+        self,
+        sources: Iterable[ImageSource],
+        model_repo: str,
+        batch_size: Optional[int] = None,
+        with_digests: bool = False,
+        digests: Optional[Dict[str, str]] = None
+    ) -> Iterator[Tuple[int, ImageSource, Optional[np.ndarray], Optional[Exception], Optional[str]]]:
+        """
+        Yield (index, source, probabilities, error, digest) for every source
+        Exactly one of probabilities and error is set. The model is resolved
+        once and used explicitly, so jobs on different models can run side by
+        side without touching the predictor's active model. digest is the
+        content hash of the source when with_digests is set or the prediction
+        cache needed it, and None otherwise; paths found in `digests` reuse
+        the digest given there instead of being hashed again.
+        """
+        try:
+            entry = self.predictor.get_model(model_repo)
+        except Exception as e:
+            raise Exception(f"Model loading failed: {model_repo}: {str(e)}")
+
+        batch_size = max(1, batch_size or self.predictor.config.inference.max_batch_size)
+        ready: "queue.Queue" = queue.Queue(maxsize=self.prefetch_batches)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce,
+            args=(sources, entry, batch_size, with_digests, digests, ready, stop),
+            name="wd-tagger-producer",
+            daemon=True
+        )
+        producer.start()
+
+        try:
+            while True:
+                items = ready.get()
+                if items is _DONE:
+                    break
+                if isinstance(items, Exception):
+                    raise items
+
+                prepared = [
+                    array for _, _, array, _, _ in items
+                    if not isinstance(array, (Exception, CachedPrediction))
+                ]
+                preds, batch_error = None, None
+                if prepared:
+                    self.predictor.metrics.observe_batch(len(prepared), batch_size)
+                    try:
+                        preds = self.predictor.run_batch(np.stack(prepared), entry)
+                    except Exception as e:
+                        batch_error = e
+
+                row = 0
+                for index, source, array, key, digest in items:
+                    if isinstance(array, Exception):
+                        yield index, source, None, array, digest
+                    elif isinstance(array, CachedPrediction):
+                        yield index, source, array.preds, None, digest
+                    elif batch_error is not None:
+                        yield index, source, None, batch_error, digest
+                    else:
+                        if key is not None:
+                            self.predictor.prediction_cache.put(key, preds[row])
+                        yield index, source, preds[row], None, digest
+                        row += 1
+        finally:
+            stop.set()
+            producer.join()
+
+    def run(
+        self,
+        sources: Iterable[ImageSource],
+        model_repo: str,
+        general_thresh: float,
+        general_mcut_enabled: bool,
+        character_thresh: float,
+        character_mcut_enabled: bool,
+        batch_size: Optional[int] = None
+    ) -> Iterator[Tuple[int, ImageSource, Tuple]]:
+        """Yield (index, source, prediction result) for every source"""
+        labels = self.predictor.get_model(model_repo)
+        for index, source, preds, error, _ in self.iter_raw(sources, model_repo, batch_size):
+            if error is not None:
+                yield index, source, (f"Error processing image {index+1}: {str(error)}", "", {}, {}, {})
+                continue
+            try:
+                result = self.predictor.process_predictions(
+                    preds, general_thresh, general_mcut_enabled,
+                    character_thresh, character_mcut_enabled, labels=labels
+                )
+            except Exception as e:
+                result = (f"Error processing image {index+1}: {str(e)}", "", {}, {}, {})
+            yield index, source, result
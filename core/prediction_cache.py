@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from core.config import PredictionCacheConfig
+from core.fileio import atomic_write
+
+def image_digest(image: Union[Image.Image, str]) -> str:
+    """
+    Content hash of an image
+    Files are hashed by their bytes, in-memory images by mode, size and pixels.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    else:
+        digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("utf-8"))
+        digest.update(image.tobytes())
+    return digest.hexdigest()
+
+class PredictionCache:
+    """
+    Cache of raw prediction vectors keyed by image content and model
+    A bounded in-memory LRU tier sits in front of an optional on-disk tier
+    that stores float16 (by default) .npy files and reads them back
+    memory-mapped.
+    """
+
+    def __init__(self, config: PredictionCacheConfig):
+        self.config = config
+        self.disk_dir = config.disk_dir
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(digest: str, repo_id: str, revision: str, preprocess_version: str) -> str:
+        """Combine everything a prediction vector depends on into one key"""
+        raw = f"{digest}|{repo_id}|{revision}|{preprocess_version}"
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=20).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Look up a prediction vector, promoting disk hits into memory"""
+        with self._lock:
+            preds = self._memory.get(key)
+            if preds is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return preds
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            if os.path.isfile(path):
+                try:
+                    preds = np.load(path, mmap_mode="r")
+                except (OSError, ValueError) as e:
+                    print(f"Discarding unreadable cached prediction {path}: {str(e)}")
+                    preds = None
+                if preds is not None:
+                    preds = np.array(preds, dtype=np.float32)
+                    preds.setflags(write=False)
+                    self._remember(key, preds)
+                    with self._lock:
+                        self.disk_hits += 1
+                    return preds
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key: str, preds: np.ndarray):
+        with self._lock:
+            self._memory[key] = preds
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.config.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, key: str, preds: np.ndarray):
+        """Store a prediction vector in memory and, if enabled, on disk"""
+        preds = np.array(preds, dtype=np.float32)
+        preds.setflags(write=False)
+        self._remember(key, preds)
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with atomic_write(path, "wb") as f:
+                    np.save(f, preds.astype(self.config.disk_dtype))
+            except OSError as e:
+                print(f"Could not write cached prediction {path}: {str(e)}")
+
+    def clear(self):
+        """Drop the in-memory tier"""
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and in-memory size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+            }
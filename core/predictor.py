@@ -1,204 +1,498 @@
+import atexit
 import os
 import re
-from typing import Dict, List, Tuple, Optional
+import threading
+import time
+from typing import Dict, List, Tuple, Optional, Union
 import numpy as np
-import pandas as pd
 from PIL import Image
-import huggingface_hub
-import onnxruntime as rt
 
-from core.config import WDTaggerConfig
+from core.config import WDTaggerConfig, parse_model_id
+from core.dataset import DatasetTagger
+from core.ensemble import EnsembleTagger
+from core.export import ResultExportStage
+from core.labels import build_label_table, default_label_cache_dir, load_label_table
+from core.mcut import batch_mcut_threshold, mcut_threshold
+from core.metrics import PredictorMetrics
+from core.model_cache import LoadedModel, ModelRegistry
+from core.prediction_cache import PredictionCache, image_digest
+from core.preprocess import ImagePreprocessor
+from core.quantize import convert_model, default_converted_model_dir, list_converted_models
+from core.resolver import ModelResolver
+from core.scheduler import InferenceScheduler
+from core.session import create_session, default_optimized_model_dir, model_revision
+from core.tag_index import TagIndex, default_tag_index_dir
 from core.tag_processor import TagProcessor
 
 class WaifuDiffusionPredictor:
     """Main predictor class for WaifuDiffusion Tagger"""
     
-    def __init__(self):
-        self.config = WDTaggerConfig()
+    def __init__(self, config: Optional[WDTaggerConfig] = None):
+        self.config = config or WDTaggerConfig()
+        self.metrics = PredictorMetrics(self.config.metrics.enabled)
         self.tag_processor = TagProcessor(self.config)
-        self.model = None
-        self.model_target_size = None
-        self.last_loaded_repo = None
-        self.tag_names = []
-        self.rating_indexes = []
-        self.general_indexes = []
-        self.character_indexes = []
+        self.preprocessor = ImagePreprocessor(self.config.preprocess, self.metrics)
+        self.resolver = ModelResolver(self.config)
+        self.ensemble = EnsembleTagger(self)
+        self.scheduler = InferenceScheduler(self, self.config.scheduler)
+        self.prediction_cache = (
+            PredictionCache(self.config.prediction_cache)
+            if self.config.prediction_cache.enabled else None
+        )
+        self.registry = ModelRegistry(
+            max_models=self.config.cache.max_loaded_models,
+            memory_budget_mb=self.config.cache.memory_budget_mb
+        )
+        self.active_model: Optional[LoadedModel] = None
+        self._load_lock = threading.RLock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._tag_index: Optional[TagIndex] = None
+        self._index_save_lock = threading.Lock()
+        self._index_save_timer: Optional[threading.Timer] = None
+        self._index_saved_at = 0.0
+        self._warmup_thread = None
     
     def download_model(self, model_repo: str) -> Tuple[str, str]:
-        """Download model files from HuggingFace Hub"""
+        """
+        Locate model files, downloading them from HuggingFace Hub if needed
+        Local copies and the HF cache are used without any network access.
+        """
+        return self.resolver.resolve(model_repo)
+    
+    def load_labels(self, dataframe) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Load and process labels from a parsed CSV table
+        Accepts anything indexable by "name" and "category", such as a pandas
+        DataFrame. Tag names are returned as a string array and the category
+        indexes as intp arrays so predictions can be sliced with fancy indexing.
+        """
+        return build_label_table(dataframe["name"], dataframe["category"], self.config.kaomojis)
+    
+    def _label_cache_dir(self) -> Optional[str]:
+        """Directory for cached label tables, or None when disabled"""
+        if not self.config.cache.persist_label_tables:
+            return None
+        return self.config.cache.label_cache_dir or default_label_cache_dir(self.config.cache.root_dir)
+    
+    def _optimized_model_dir(self) -> Optional[str]:
+        """Directory for persisted optimized graphs, or None when disabled"""
+        if not self.config.cache.persist_optimized_models:
+            return None
+        return self.config.cache.optimized_model_dir or default_optimized_model_dir(self.config.cache.root_dir)
+    
+    def converted_model_dir(self) -> str:
+        """Directory for fp16/int8 model variants"""
+        return self.config.cache.converted_model_dir or default_converted_model_dir(self.config.cache.root_dir)
+    
+    def model_choices(self) -> List[str]:
+        """Configured models, plus the fp16/int8 variants already converted on disk"""
+        choices = self.config.get_model_choices()
         try:
-            csv_path = huggingface_hub.hf_hub_download(
-                model_repo,
-                self.config.file_config["label_filename"],
-                token=self.config.get_hf_token() or None,
-            )
-            model_path = huggingface_hub.hf_hub_download(
-                model_repo,
-                self.config.file_config["model_filename"],
-                token=self.config.get_hf_token() or None,
-            )
-            return csv_path, model_path
+            converted = list_converted_models(self.converted_model_dir(), self.config.get_repo_ids())
         except Exception as e:
-            raise Exception(f"Failed to download model from {model_repo}: {str(e)}")
+            print(f"Could not list converted models: {str(e)}")
+            converted = []
+        return choices + [model_id for model_id in converted if model_id not in choices]
     
-    def load_labels(self, dataframe: pd.DataFrame) -> Tuple[List[str], List[int], List[int], List[int]]:
-        """Load and process labels from CSV file"""
-        name_series = dataframe["name"]
-        name_series = name_series.map(
-            lambda x: x.replace("_", " ") if x not in self.config.kaomojis else x
+    def _build_model(self, model_repo: str) -> LoadedModel:
+        """
+        Download, parse labels and create the inference session for a model
+        model_repo may name a converted variant ("org/repo@int8"), which is
+        created from the original model on first use.
+        """
+        repo_id, precision = parse_model_id(model_repo)
+        with self.metrics.time("resolve"):
+            csv_path, model_path = self.download_model(repo_id)
+            revision = model_revision(model_path)
+            if precision != "fp32":
+                model_path = convert_model(model_path, precision, repo_id, self.converted_model_dir())
+                revision = f"{revision}-{precision}"
+        
+        with self.metrics.time("session_load"):
+            # Load labels
+            tag_names, rating_indexes, general_indexes, character_indexes = load_label_table(
+                csv_path, self.config.kaomojis, self._label_cache_dir()
+            )
+            
+            # Load model
+            session = create_session(
+                model_path,
+                self.config.get_session_profile(model_repo),
+                repo_id=model_repo,
+                cache_dir=self._optimized_model_dir()
+            )
+        self.metrics.increment("model_loads")
+        model_input = session.get_inputs()[0]
+        
+        # WD taggers are NHWC, but accept channel-first exports as well
+        _, dim1, dim2, dim3 = model_input.shape
+        if dim1 == 3 and dim3 != 3:
+            input_layout, target_size = "NCHW", dim2
+        else:
+            input_layout, target_size = "NHWC", dim1
+        
+        memory_bytes = os.path.getsize(model_path) + sum(
+            arr.nbytes for arr in (tag_names, rating_indexes, general_indexes, character_indexes)
         )
-        tag_names = name_series.tolist()
         
-        rating_indexes = list(np.where(dataframe["category"] == 9)[0])
-        general_indexes = list(np.where(dataframe["category"] == 0)[0])
-        character_indexes = list(np.where(dataframe["category"] == 4)[0])
+        return LoadedModel(
+            repo_id=model_repo,
+            session=session,
+            input_name=model_input.name,
+            label_name=session.get_outputs()[0].name,
+            input_layout=input_layout,
+            target_size=target_size,
+            tag_names=tag_names,
+            rating_indexes=rating_indexes,
+            general_indexes=general_indexes,
+            character_indexes=character_indexes,
+            vocabulary=self.tag_processor.build_vocabulary(tag_names),
+            revision=revision,
+            memory_bytes=memory_bytes
+        )
+    
+    def _activate_model(self, entry: LoadedModel):
+        """
+        Make a loaded model the active one
+        The active model is the default of the methods taking an optional
+        entry; the attributes below all read from it, so they cannot go out
+        of sync. Replacing it is a single assignment, safe between threads.
+        """
+        self.active_model = entry
+    
+    def _active(self, attribute: str, default):
+        entry = self.active_model
+        return default if entry is None else getattr(entry, attribute)
+    
+    @property
+    def model(self):
+        """Inference session of the active model"""
+        return self._active("session", None)
+    
+    @property
+    def model_target_size(self) -> Optional[int]:
+        return self._active("target_size", None)
+    
+    @property
+    def model_input_layout(self) -> str:
+        return self._active("input_layout", "NHWC")
+    
+    @property
+    def input_name(self) -> Optional[str]:
+        return self._active("input_name", None)
+    
+    @property
+    def label_name(self) -> Optional[str]:
+        return self._active("label_name", None)
+    
+    @property
+    def model_revision(self) -> str:
+        return self._active("revision", "")
+    
+    @property
+    def last_loaded_repo(self) -> Optional[str]:
+        return self._active("repo_id", None)
+    
+    @property
+    def tag_names(self) -> np.ndarray:
+        return self._active("tag_names", np.empty(0, dtype=str))
+    
+    @property
+    def rating_indexes(self) -> np.ndarray:
+        return self._active("rating_indexes", np.empty(0, dtype=np.intp))
+    
+    @property
+    def general_indexes(self) -> np.ndarray:
+        return self._active("general_indexes", np.empty(0, dtype=np.intp))
+    
+    @property
+    def character_indexes(self) -> np.ndarray:
+        return self._active("character_indexes", np.empty(0, dtype=np.intp))
+    
+    @property
+    def vocabulary(self):
+        return self._active("vocabulary", None)
+    
+    def _require_model(self, entry: Optional[LoadedModel]) -> LoadedModel:
+        """The given entry, or the active model"""
+        entry = entry or self.active_model
+        if entry is None:
+            raise Exception("No model loaded; call load_model() or pass a loaded model")
+        return entry
+    
+    def use_model(self, model_repo: str) -> LoadedModel:
+        """Get a model from the registry and make it the active one"""
+        entry = self.get_model(model_repo)
+        self._activate_model(entry)
+        return entry
+    
+    def get_model(self, model_repo: str) -> LoadedModel:
+        """
+        Return a loaded model from the registry, building it on a miss, without activating it
+        A build (download, conversion, session creation) holds only a lock
+        for that model, so it does not stall requests for models already loaded.
+        """
+        with self._load_lock:
+            entry = self.registry.get(model_repo)
+            if entry is not None:
+                self.metrics.increment("model_cache_hits")
+                return entry
+            build_lock = self._build_locks.setdefault(model_repo, threading.Lock())
         
-        return tag_names, rating_indexes, general_indexes, character_indexes
+        with build_lock:
+            # Another thread may have built it while this one waited; the
+            # miss was already counted above
+            entry = self.registry.peek(model_repo)
+            if entry is not None:
+                return entry
+            entry = self._build_model(model_repo)
+            with self._load_lock:
+                evicted = self.registry.put(entry)
+            if evicted:
+                self.metrics.increment("model_evictions", len(evicted))
+                print(f"Evicted cached models: {', '.join(evicted)}")
+            return entry
     
     def load_model(self, model_repo: str) -> bool:
-        """Load model and labels"""
-        if model_repo == self.last_loaded_repo:
-            return True
-        
+        """Load model and labels, reusing cached sessions when available"""
         try:
-            csv_path, model_path = self.download_model(model_repo)
-            
-            # Load labels
-            tags_df = pd.read_csv(csv_path)
-            sep_tags = self.load_labels(tags_df)
-            
-            self.tag_names = sep_tags[0]
-            self.rating_indexes = sep_tags[1]
-            self.general_indexes = sep_tags[2]
-            self.character_indexes = sep_tags[3]
-            
-            # Load model
-            self.model = rt.InferenceSession(model_path)
-            _, height, width, _ = self.model.get_inputs()[0].shape
-            self.model_target_size = height
-            
-            self.last_loaded_repo = model_repo
+            self.use_model(model_repo)
             return True
             
         except Exception as e:
             print(f"Error loading model: {str(e)}")
             return False
     
-    def prepare_image(self, image: Image.Image) -> np.ndarray:
-        """Prepare image for model input"""
-        if image.mode != 'RGBA':
-            image = image.convert('RGBA')
-        
-        target_size = self.model_target_size
-        
-        # Create white background and composite
-        canvas = Image.new("RGBA", image.size, (255, 255, 255, 255))
-        canvas.alpha_composite(image)
-        image = canvas.convert("RGB")
-        
-        # Pad image to square
-        image_shape = image.size
-        max_dim = max(image_shape)
-        pad_left = (max_dim - image_shape[0]) // 2
-        pad_top = (max_dim - image_shape[1]) // 2
-        
-        padded_image = Image.new("RGB", (max_dim, max_dim), (255, 255, 255))
-        padded_image.paste(image, (pad_left, pad_top))
-        
-        # Resize to target size
-        if max_dim != target_size:
-            padded_image = padded_image.resize(
-                (target_size, target_size),
-                Image.LANCZOS
-            )
+    def warm_up(self, model_repo: Optional[str] = None, background: bool = True) -> Optional[threading.Thread]:
+        """
+        Download and load a model ahead of the first request
+        Runs on a daemon thread by default; returns the thread, or None when
+        the warm-up ran synchronously.
+        """
+        model_repo = model_repo or self.config.get_default_model()
         
-        # Convert to numpy array
-        image_array = np.asarray(padded_image, dtype=np.float32)
+        def run():
+            if self.load_model(model_repo):
+                print(f"WD Tagger warm-up finished: {model_repo}")
         
-        # Convert PIL-native RGB to BGR
-        image_array = image_array[:, :, ::-1]
+        if not background:
+            run()
+            return None
         
-        return np.expand_dims(image_array, axis=0)
+        self._warmup_thread = threading.Thread(target=run, name="wd-tagger-warmup", daemon=True)
+        self._warmup_thread.start()
+        return self._warmup_thread
+    
+    def prepare_image(self, image: Image.Image, entry: Optional[LoadedModel] = None) -> np.ndarray:
+        """Prepare image for the input of `entry`, or of the active model by default"""
+        processed = self.preprocessor.prepare(image, self._require_model(entry).target_size)
+        return np.expand_dims(processed, axis=0)
     
     def mcut_threshold(self, probs: np.ndarray) -> float:
         """
         Maximum Cut Thresholding (MCut)
         Largeron, C., Moulin, C., & Gery, M. (2012)
         """
-        if len(probs) == 0:
-            return 0.0
+        top_k = self.config.thresholds.mcut_top_k
+        if top_k is None:
+            return mcut_threshold(probs)
+        return batch_mcut_threshold(probs[np.newaxis, :], top_k)[0]
+    
+    def batch_thresholds(
+        self,
+        preds: np.ndarray,
+        general_thresh: float,
+        general_mcut_enabled: bool,
+        character_thresh: float,
+        character_mcut_enabled: bool,
+        labels: Optional[LoadedModel] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Per-row general and character thresholds for a (B, num_tags) matrix
+        Uses the label tables of `labels`, or of the active model by default.
+        """
+        labels = self._require_model(labels)
+        preds = np.asarray(preds, dtype=np.float64)
+        top_k = self.config.thresholds.mcut_top_k
+        
+        if general_mcut_enabled:
+            general = batch_mcut_threshold(preds[:, labels.general_indexes], top_k)
+        else:
+            general = np.full(len(preds), general_thresh, dtype=np.float64)
         
-        sorted_probs = probs[probs.argsort()[::-1]]
-        if len(sorted_probs) <= 1:
-            return sorted_probs[0] if len(sorted_probs) == 1 else 0.0
+        if character_mcut_enabled:
+            character = batch_mcut_threshold(preds[:, labels.character_indexes], top_k)
+            character = np.maximum(self.config.thresholds.min_character_mcut, character)
+        else:
+            character = np.full(len(preds), character_thresh, dtype=np.float64)
         
-        difs = sorted_probs[:-1] - sorted_probs[1:]
-        t = difs.argmax()
-        thresh = (sorted_probs[t] + sorted_probs[t + 1]) / 2
-        return thresh
+        return general, character
     
-    def predict(
+    def run_batch(self, batch: np.ndarray, entry: Optional[LoadedModel] = None) -> np.ndarray:
+        """Run a single inference call on a stacked NHWC batch, on the active model by default"""
+        entry = self._require_model(entry)
+        if entry.input_layout == "NCHW":
+            batch = np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+        with self.metrics.time("inference"):
+            preds = entry.session.run([entry.label_name], {entry.input_name: batch})[0]
+        self.metrics.increment("inference_images", len(batch))
+        return preds
+    
+    def _select_tags(self, indexes: np.ndarray, probs: np.ndarray, thresh: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Vocabulary indexes and probabilities of the tags above the threshold"""
+        mask = probs > thresh
+        return indexes[mask], probs[mask]
+    
+    def _label_dict(self, tag_names: np.ndarray, indexes: np.ndarray, probs: np.ndarray) -> Dict[str, float]:
+        """Build a {name: prob} dict only for the selected tags"""
+        return dict(zip(tag_names[indexes].tolist(), probs.tolist()))
+    
+    def process_predictions(
         self,
-        image: Image.Image,
-        model_repo: str,
+        preds: np.ndarray,
         general_thresh: float,
         general_mcut_enabled: bool,
         character_thresh: float,
         character_mcut_enabled: bool,
-        rating_thresh: float = 0.5
+        labels: Optional[LoadedModel] = None
     ) -> Tuple[str, str, Dict, Dict, Dict]:
         """
-        Main prediction function
-        Returns: (formatted_tags, r34_tags, rating_dict, character_dict, general_dict)
+        Turn one row of model output into formatted tags and label dicts
+        Uses the label tables of `labels`, or of the active model by default.
         """
-        if not self.load_model(model_repo):
-            return "Model loading failed", "", {}, {}, {}
-        
-        if image is None:
-            return "No image provided", "", {}, {}, {}
-        
-        try:
-            # Prepare image
-            processed_image = self.prepare_image(image)
-            
-            # Run inference
-            input_name = self.model.get_inputs()[0].name
-            label_name = self.model.get_outputs()[0].name
-            preds = self.model.run([label_name], {input_name: processed_image})[0]
-            
-            # Process predictions
-            labels = list(zip(self.tag_names, preds[0].astype(float)))
+        labels = self._require_model(labels)
+        tag_names = labels.tag_names
+        with self.metrics.time("postprocess"):
+            preds = np.asarray(preds, dtype=np.float64)
             
             # Process ratings
-            rating_labels = [labels[i] for i in self.rating_indexes]
-            rating_dict = dict(rating_labels)
+            rating_dict = self._label_dict(tag_names, labels.rating_indexes, preds[labels.rating_indexes])
             
             # Process general tags
-            general_labels = [labels[i] for i in self.general_indexes]
+            general_probs = preds[labels.general_indexes]
             
             if general_mcut_enabled:
-                general_probs = np.array([x[1] for x in general_labels])
                 general_thresh = self.mcut_threshold(general_probs)
             
-            general_results = [x for x in general_labels if x[1] > general_thresh]
-            general_dict = dict(general_results)
+            general_selected, general_selected_probs = self._select_tags(
+                labels.general_indexes, general_probs, general_thresh
+            )
+            general_dict = self._label_dict(tag_names, general_selected, general_selected_probs)
             
             # Process character tags
-            character_labels = [labels[i] for i in self.character_indexes]
+            character_probs = preds[labels.character_indexes]
             
             if character_mcut_enabled:
-                character_probs = np.array([x[1] for x in character_labels])
                 character_thresh = self.mcut_threshold(character_probs)
                 character_thresh = max(self.config.thresholds.min_character_mcut, character_thresh)
             
-            character_results = [x for x in character_labels if x[1] > character_thresh]
-            character_dict = dict(character_results)
-            
-            # Format tags
-            formatted_tags = self.tag_processor.format_standard_tags(general_results)
-            r34_tags = self.tag_processor.format_r34_tags(general_results)
+            character_dict = self._label_dict(
+                tag_names, *self._select_tags(labels.character_indexes, character_probs, character_thresh)
+            )
+        
+        # Format tags from the precomputed vocabulary tables
+        with self.metrics.time("format"):
+            formatted_tags = self.tag_processor.format_standard_indexes(
+                labels.vocabulary, general_selected, general_selected_probs
+            )
+            r34_tags = self.tag_processor.format_r34_indexes(
+                labels.vocabulary, general_selected, general_selected_probs
+            )
+        
+        return formatted_tags, r34_tags, rating_dict, character_dict, general_dict
+    
+    def prediction_key(self, image: Union[Image.Image, str], entry: Optional[LoadedModel] = None,
+                       digest: Optional[str] = None) -> Optional[str]:
+        """Prediction cache key for an image under `entry`, or the active model by default"""
+        if self.prediction_cache is None:
+            return None
+        entry = self._require_model(entry)
+        return self.prediction_cache.make_key(
+            digest or image_digest(image), entry.repo_id,
+            entry.revision, self.preprocessor.cache_version
+        )
+    
+    def infer(self, image: Union[Image.Image, str], entry: Optional[LoadedModel] = None) -> np.ndarray:
+        """Raw probability vector for one image, served from cache when possible"""
+        entry = self._require_model(entry)
+        key = self.prediction_key(image, entry)
+        if key is not None:
+            cached = self.prediction_cache.get(key)
+            if cached is not None:
+                return cached
+        
+        batch = self.preprocessor.prepare(image, entry.target_size)[np.newaxis]
+        preds = self.run_batch(batch, entry)[0]
+        if key is not None:
+            self.prediction_cache.put(key, preds)
+        return preds
+    
+    def predict_raw(self, image: Union[Image.Image, str], model_repo: str) -> np.ndarray:
+        """
+        Load the model if needed and return the raw probability vector
+        With the scheduler enabled, concurrent calls are micro-batched. Either
+        way the model becomes the active one.
+        """
+        try:
+            entry = self.use_model(model_repo)
+        except Exception as e:
+            raise Exception(f"Model loading failed: {model_repo}: {str(e)}")
+        if self.config.scheduler.enabled:
+            return self.scheduler.infer(image, model_repo)
+        return self.infer(image, entry)
+    
+    def predict_from_raw(
+        self,
+        preds: np.ndarray,
+        model_repo: str,
+        general_thresh: float,
+        general_mcut_enabled: bool,
+        character_thresh: float,
+        character_mcut_enabled: bool
+    ) -> Tuple[str, str, Dict, Dict, Dict]:
+        """Re-threshold a stored probability vector without running the model"""
+        try:
+            entry = self.use_model(model_repo)
+        except Exception as e:
+            raise Exception(f"Model loading failed: {model_repo}: {str(e)}")
+        return self.process_predictions(
+            preds, general_thresh, general_mcut_enabled,
+            character_thresh, character_mcut_enabled, labels=entry
+        )
+    
+    def predict(
+        self,
+        image: Image.Image,
+        model_repo: str,
+        general_thresh: float,
+        general_mcut_enabled: bool,
+        character_thresh: float,
+        character_mcut_enabled: bool,
+        rating_thresh: float = 0.5
+    ) -> Tuple[str, str, Dict, Dict, Dict]:
+        """
+        Main prediction function
+        Returns: (formatted_tags, r34_tags, rating_dict, character_dict, general_dict)
+        """
+        try:
+            labels = self.use_model(model_repo)
+        except Exception as e:
+            print(f"Error loading model: {str(e)}")
+            return "Model loading failed", "", {}, {}, {}
+        
+        if image is None:
+            return "No image provided", "", {}, {}, {}
+        
+        try:
+            if self.config.scheduler.enabled:
+                preds = self.scheduler.infer(image, model_repo)
+            else:
+                preds = self.infer(image, labels)
             
-            return formatted_tags, r34_tags, rating_dict, character_dict, general_dict
+            return self.process_predictions(
+                preds, general_thresh, general_mcut_enabled,
+                character_thresh, character_mcut_enabled, labels=labels
+            )
             
         except Exception as e:
             error_msg = f"Prediction error: {str(e)}"
@@ -212,21 +506,233 @@ class WaifuDiffusionPredictor:
         general_thresh: float,
         general_mcut_enabled: bool,
         character_thresh: float,
-        character_mcut_enabled: bool
+        character_mcut_enabled: bool,
+        batch_size: Optional[int] = None
     ) -> List[Tuple]:
-        """Batch prediction for multiple images"""
-        results = []
+        """
+        Batch prediction for multiple images
+        Images are stacked into batches of up to `batch_size` and run in a
+        single session call per batch.
+        """
+        try:
+            entry = self.use_model(model_repo)
+        except Exception as e:
+            print(f"Error loading model: {str(e)}")
+            return [("Model loading failed", "", {}, {}, {}) for _ in images]
         
-        for i, image in enumerate(images):
+        batch_size = max(1, batch_size or self.config.inference.max_batch_size)
+        target_size = entry.target_size
+        results: List[Optional[Tuple]] = [None] * len(images)
+        raw_preds: List[Optional[np.ndarray]] = [None] * len(images)
+        keys: List[Optional[str]] = [None] * len(images)
+        
+        def error_result(index: int, error) -> Tuple:
+            return (f"Error processing image {index+1}: {str(error)}", "", {}, {}, {})
+        
+        # Serve what we can from the prediction cache
+        pending = []
+        for index, image in enumerate(images):
+            if image is None:
+                results[index] = error_result(index, "No image provided")
+                continue
             try:
-                result = self.predict(
-                    image, model_repo, general_thresh, general_mcut_enabled,
-                    character_thresh, character_mcut_enabled
-                )
-                results.append(result)
-                print(f"Processed image {i+1}/{len(images)}")
+                keys[index] = self.prediction_key(image, entry)
+                if keys[index] is not None:
+                    raw_preds[index] = self.prediction_cache.get(keys[index])
             except Exception as e:
-                error_result = (f"Error processing image {i+1}: {str(e)}", "", {}, {}, {})
-                results.append(error_result)
+                results[index] = error_result(index, e)
+                continue
+            if raw_preds[index] is None:
+                pending.append(index)
         
-        return results
\ No newline at end of file
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch = np.empty((len(chunk), target_size, target_size, 3), dtype=np.float32)
+            filled = []
+            
+            # Prepare every image of the chunk, keeping failures per image
+            for index in chunk:
+                try:
+                    self.preprocessor.prepare(images[index], target_size, out=batch[len(filled)])
+                    filled.append(index)
+                except Exception as e:
+                    results[index] = error_result(index, e)
+            
+            if not filled:
+                continue
+            
+            try:
+                preds = self.run_batch(batch[:len(filled)], entry)
+            except Exception as e:
+                for index in filled:
+                    results[index] = error_result(index, e)
+                continue
+            
+            for row, index in enumerate(filled):
+                raw_preds[index] = preds[row]
+                if keys[index] is not None:
+                    self.prediction_cache.put(keys[index], preds[row])
+            
+            print(f"Processed {start + len(chunk)}/{len(pending)} uncached images")
+        
+        # Threshold every finished row at once, MCut included
+        ready = [index for index, preds in enumerate(raw_preds) if preds is not None]
+        if ready:
+            general_threshes, character_threshes = self.batch_thresholds(
+                np.stack([raw_preds[index] for index in ready]),
+                general_thresh, general_mcut_enabled,
+                character_thresh, character_mcut_enabled, labels=entry
+            )
+            for row, index in enumerate(ready):
+                try:
+                    results[index] = self.process_predictions(
+                        raw_preds[index], general_threshes[row], False,
+                        character_threshes[row], False, labels=entry
+                    )
+                except Exception as e:
+                    results[index] = error_result(index, e)
+        
+        return results
+    
+    def ensemble_predict(
+        self,
+        images: List[Union[Image.Image, str]],
+        model_repos: List[str],
+        general_thresh: float,
+        general_mcut_enabled: bool,
+        character_thresh: float,
+        character_mcut_enabled: bool,
+        **kwargs
+    ) -> List[Tuple]:
+        """
+        Tag images with several models and fuse their probabilities
+        See EnsembleTagger.batch_predict for the supported keyword arguments.
+        """
+        return self.ensemble.batch_predict(
+            images, model_repos, general_thresh, general_mcut_enabled,
+            character_thresh, character_mcut_enabled, **kwargs
+        )
+    
+    def tag_directory(
+        self,
+        input_path: str,
+        model_repo: str,
+        general_thresh: float,
+        general_mcut_enabled: bool,
+        character_thresh: float,
+        character_mcut_enabled: bool,
+        **kwargs
+    ) -> Dict[str, float]:
+        """
+        Tag a directory or glob of images and write caption sidecar files
+        See DatasetTagger.tag for the supported keyword arguments.
+        """
+        return DatasetTagger(self).tag(
+            input_path, model_repo, general_thresh, general_mcut_enabled,
+            character_thresh, character_mcut_enabled, **kwargs
+        )
+    
+    def _component_metrics(self) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """Counters and gauges kept by other components, under their metric names"""
+        scheduler = self.scheduler.stats()
+        counters = {
+            "scheduler_batches": scheduler["batches"],
+            "scheduler_batched_requests": scheduler["batched_requests"],
+            "scheduler_rejected": scheduler["rejected"],
+        }
+        gauges = {
+            "scheduler_queued": scheduler["queued"],
+            "loaded_models": len(self.registry),
+        }
+        if self.prediction_cache is not None:
+            cache = self.prediction_cache.stats()
+            counters.update({
+                "prediction_cache_hits": cache["hits"],
+                "prediction_cache_disk_hits": cache["disk_hits"],
+                "prediction_cache_misses": cache["misses"],
+            })
+            gauges["prediction_cache_memory_entries"] = cache["memory_entries"]
+        return counters, gauges
+    
+    def metrics_snapshot(self) -> Dict[str, object]:
+        """Stage timings, counters and memory high-water mark"""
+        return self.metrics.snapshot(*self._component_metrics())
+    
+    def metrics_text(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        return self.metrics.prometheus_text(*self._component_metrics())
+    
+    def export_images(self, images: List[str], exporter, model_repo: str, *args, **kwargs) -> Dict[str, float]:
+        """
+        Tag a list of image files into an open exporter
+        See ResultExportStage.export_images for the supported arguments.
+        """
+        return ResultExportStage(self).export_images(images, exporter, model_repo, *args, **kwargs)
+    
+    def tag_index_dir(self) -> str:
+        """Directory the tag index is saved in"""
+        return self.config.tag_index.index_dir or default_tag_index_dir(self.config.cache.root_dir)
+    
+    def get_tag_index(self) -> TagIndex:
+        """The tag index, loaded from disk on first use"""
+        with self._load_lock:
+            if self._tag_index is None:
+                try:
+                    self._tag_index = TagIndex.open(self.tag_index_dir())
+                except Exception as e:
+                    print(f"Could not load tag index, starting a new one: {str(e)}")
+                    self._tag_index = TagIndex()
+            return self._tag_index
+    
+    def save_tag_index(self, force: bool = False):
+        """
+        Persist the tag index if it changed since it was last saved
+        Within save_interval_s of the previous save the write is deferred to a
+        timer (and to exit), so back-to-back batches rewrite the index once.
+        """
+        index = self._tag_index
+        if index is None or not index.dirty:
+            return
+        with self._index_save_lock:
+            delay = self._index_saved_at + self.config.tag_index.save_interval_s - time.monotonic()
+            if not force and delay > 0:
+                if self._index_save_timer is None:
+                    atexit.register(self._flush_tag_index)
+                    self._index_save_timer = threading.Timer(delay, self._flush_tag_index)
+                    self._index_save_timer.daemon = True
+                    self._index_save_timer.start()
+                return
+            if self._index_save_timer is not None:
+                self._index_save_timer.cancel()
+                self._index_save_timer = None
+                atexit.unregister(self._flush_tag_index)
+            index.save(self.tag_index_dir())
+            self._index_saved_at = time.monotonic()
+    
+    def _flush_tag_index(self):
+        """Write a deferred tag index save"""
+        try:
+            self.save_tag_index(force=True)
+        except Exception as e:
+            print(f"Could not save tag index: {str(e)}")
+    
+    def export_directory(
+        self,
+        input_path: str,
+        output_path: str,
+        model_repo: str,
+        general_thresh: float,
+        general_mcut_enabled: bool,
+        character_thresh: float,
+        character_mcut_enabled: bool,
+        **kwargs
+    ) -> Dict[str, float]:
+        """
+        Tag a directory or glob of images and stream the results to a JSONL,
+        Parquet or SQLite file
+        See ResultExportStage.export for the supported keyword arguments.
+        """
+        return ResultExportStage(self).export(
+            input_path, output_path, model_repo, general_thresh, general_mcut_enabled,
+            character_thresh, character_mcut_enabled, **kwargs
+        )
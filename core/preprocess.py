@@ -0,0 +1,126 @@
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from core.config import PreprocessConfig
+
+# Bump whenever the preprocessing output changes, to invalidate cached predictions
+PREPROCESS_VERSION = 2
+
+RESAMPLE_FILTERS = {
+    "lanczos": Image.LANCZOS,
+    "bicubic": Image.BICUBIC,
+    "bilinear": Image.BILINEAR,
+    "box": Image.BOX,
+    "nearest": Image.NEAREST,
+}
+
+def has_alpha(image: Image.Image) -> bool:
+    """Whether the image carries transparency that needs compositing"""
+    if image.mode in ("RGBA", "LA", "PA", "RGBa", "La"):
+        return True
+    if image.mode == "P":
+        return "transparency" in image.info or (
+            image.palette is not None and image.palette.mode == "RGBA"
+        )
+    return False
+
+class ImagePreprocessor:
+    """
+    Turns PIL images into model-ready float32 BGR arrays
+    Alpha is composited onto white only when present, large images are shrunk
+    with draft()/reduce() before the final resample, and the image is resized
+    before it is padded, so no full-resolution padded copy is ever made.
+    """
+
+    def __init__(self, config: PreprocessConfig, metrics=None):
+        if config.resample not in RESAMPLE_FILTERS:
+            raise ValueError(f"Unknown resample filter: {config.resample}")
+        self.config = config
+        self.resample = RESAMPLE_FILTERS[config.resample]
+        self.metrics = metrics
+
+    @property
+    def cache_version(self) -> str:
+        """Identifies everything that affects the preprocessed pixels"""
+        return f"{PREPROCESS_VERSION}-{self.config.resample}-{int(self.config.use_draft)}-{int(self.config.reduce_large_images)}"
+
+    def open_image(self, path: str, target_size: int) -> Image.Image:
+        """Open an image file, letting JPEG decode at a reduced scale"""
+        image = Image.open(path)
+        if self.config.use_draft and image.format == "JPEG":
+            image.draft("RGB", (target_size * 2, target_size * 2))
+        return image
+
+    def _composite(self, image: Image.Image) -> Image.Image:
+        """Flatten onto a white background and return an RGB image"""
+        if has_alpha(image):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            return background
+        if image.mode != "RGB":
+            return image.convert("RGB")
+        return image
+
+    def _shrink(self, image: Image.Image, target_size: int) -> Image.Image:
+        """Cheap integer downscale that keeps at least 2x oversampling"""
+        if not self.config.reduce_large_images:
+            return image
+        factor = max(image.size) // (target_size * 2)
+        if factor >= 2:
+            if image.mode not in ("RGB", "RGBA", "L", "LA"):
+                image = image.convert("RGBA" if has_alpha(image) else "RGB")
+            image = image.reduce(factor)
+        return image
+
+    def prepare(
+        self,
+        image: Union[Image.Image, str],
+        target_size: int,
+        out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Prepare one image as a (target_size, target_size, 3) BGR float32 array
+        If `out` is given the result is written into it, typically a slot of
+        a preallocated batch buffer.
+        """
+        if isinstance(image, str):
+            with self.open_image(image, target_size) as opened:
+                if self.metrics is not None:
+                    with self.metrics.time("decode"):
+                        opened.load()
+                return self.prepare(opened, target_size, out=out)
+
+        if self.metrics is None:
+            return self._prepare_loaded(image, target_size, out)
+        with self.metrics.time("preprocess"):
+            return self._prepare_loaded(image, target_size, out)
+
+    def _prepare_loaded(self, image: Image.Image, target_size: int, out: Optional[np.ndarray]) -> np.ndarray:
+        image = self._composite(self._shrink(image, target_size))
+
+        # Resize the long side to the target, then pad the short side
+        width, height = image.size
+        max_dim = max(width, height)
+        if max_dim != target_size:
+            scale = target_size / max_dim
+            new_size = (
+                max(1, min(target_size, round(width * scale))),
+                max(1, min(target_size, round(height * scale)))
+            )
+            image = image.resize(new_size, self.resample)
+            width, height = new_size
+
+        if (width, height) != (target_size, target_size):
+            canvas = Image.new("RGB", (target_size, target_size), (255, 255, 255))
+            canvas.paste(image, ((target_size - width) // 2, (target_size - height) // 2))
+            image = canvas
+
+        if out is None:
+            out = np.empty((target_size, target_size, 3), dtype=np.float32)
+
+        # Convert PIL-native RGB to BGR while casting into the output buffer
+        np.copyto(out, np.asarray(image)[:, :, ::-1], casting="unsafe")
+        return out
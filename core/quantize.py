@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from core.config import MODEL_PRECISIONS, WDTaggerConfig, default_cache_root, parse_model_id
+from core.fileio import atomic_path
+from core.session import model_revision
+
+# Only MatMul/Gemm are quantized: that is where SwinV2, ViT and ConvNext
+# spend their time, and ConvInteger has poor CPU kernel coverage
+INT8_OP_TYPES = ["MatMul", "Gemm"]
+
+def default_converted_model_dir(cache_root: Optional[str] = None) -> str:
+    """Directory for fp16/int8 model variants under the wd-tagger cache root"""
+    return os.path.join(cache_root or default_cache_root(), "converted")
+
+def converted_model_path(cache_dir: str, repo_id: str, model_path: str, precision: str) -> str:
+    """Where the variant of a model is stored, keyed by the source revision"""
+    return os.path.join(
+        cache_dir,
+        repo_id.replace("/", "--"),
+        model_revision(model_path),
+        f"model.{precision}.onnx"
+    )
+
+def list_converted_models(cache_dir: str, repo_ids: Sequence[str]) -> List[str]:
+    """Model ids ("org/repo@int8") of the variants already converted for these repos"""
+    model_ids = []
+    for repo_id in repo_ids:
+        repo_dir = os.path.join(cache_dir, repo_id.replace("/", "--"))
+        if not os.path.isdir(repo_dir):
+            continue
+        for precision in MODEL_PRECISIONS[1:]:
+            filename = f"model.{precision}.onnx"
+            if any(os.path.isfile(os.path.join(repo_dir, revision, filename)) for revision in os.listdir(repo_dir)):
+                model_ids.append(f"{repo_id}@{precision}")
+    return model_ids
+
+def _convert_int8(model_path: str, output_path: str):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(
+        model_path,
+        output_path,
+        op_types_to_quantize=INT8_OP_TYPES,
+        weight_type=QuantType.QInt8
+    )
+
+def _convert_fp16(model_path: str, output_path: str):
+    import onnx
+    from onnxruntime.transformers.float16 import convert_float_to_float16
+    model = convert_float_to_float16(onnx.load(model_path), keep_io_types=True)
+    onnx.save(model, output_path)
+
+CONVERTERS = {
+    "int8": _convert_int8,
+    "fp16": _convert_fp16,
+}
+
+def convert_model(model_path: str, precision: str, repo_id: str, cache_dir: Optional[str] = None) -> str:
+    """
+    Return the path of a model converted to the given precision
+    Conversions are cached on disk, so only the first call per source
+    revision does any work. fp32 returns the original path unchanged.
+    """
+    if precision == "fp32":
+        return model_path
+    if precision not in CONVERTERS:
+        raise ValueError(f"Unknown model precision: {precision}")
+
+    output_path = converted_model_path(cache_dir or default_converted_model_dir(), repo_id, model_path, precision)
+    if os.path.isfile(output_path):
+        return output_path
+
+    try:
+        print(f"Converting {repo_id} to {precision}...")
+        with atomic_path(output_path) as tmp_path:
+            CONVERTERS[precision](model_path, tmp_path)
+    except ImportError as e:
+        raise Exception(f"Converting to {precision} requires the onnx package: {str(e)}")
+    return output_path
+
+def _tag_sets(preds: np.ndarray, indexes: np.ndarray, threshold: float) -> List[set]:
+    selected = preds[:, indexes] > threshold
+    return [set(indexes[row].tolist()) for row in selected]
+
+def compare_precisions(
+    predictor,
+    repo_id: str,
+    image_paths: Sequence[str],
+    precisions: Sequence[str] = ("int8", "fp16"),
+    threshold: float = 0.35,
+    batch_size: Optional[int] = None
+) -> List[Dict[str, object]]:
+    """
+    Compare converted variants of a model against the fp32 original
+    Every variant runs on the same preprocessed batches, bypassing the
+    prediction cache. Reports probability differences, agreement of the
+    thresholded general/character tag sets (mean Jaccard) and of the top
+    rating, throughput, and the speedup over fp32.
+    """
+    batch_size = batch_size or predictor.config.inference.max_batch_size
+    reference = predictor.get_model(repo_id)
+
+    batches = []
+    for start in range(0, len(image_paths), batch_size):
+        chunk = image_paths[start:start + batch_size]
+        batches.append(np.stack([
+            predictor.preprocessor.prepare(path, reference.target_size) for path in chunk
+        ]))
+    if not batches:
+        raise ValueError("No images to compare on")
+
+    tag_indexes = np.concatenate([reference.general_indexes, reference.character_indexes])
+    rating_indexes = reference.rating_indexes
+
+    def measure(model_id: str) -> Dict[str, object]:
+        entry = predictor.get_model(model_id)
+        predictor.run_batch(batches[0][:1], entry)  # warm-up
+        start = time.perf_counter()
+        preds = np.concatenate([predictor.run_batch(batch, entry) for batch in batches])
+        elapsed = time.perf_counter() - start
+        return {
+            "model_id": model_id,
+            "preds": preds,
+            "images_per_sec": len(preds) / elapsed if elapsed > 0 else 0.0,
+            "model_bytes": entry.memory_bytes,
+        }
+
+    reference = measure(repo_id)
+    reference_preds = reference.pop("preds")
+    reference_tags = _tag_sets(reference_preds, tag_indexes, threshold)
+    reference_ratings = reference_preds[:, rating_indexes].argmax(axis=1)
+
+    reports = []
+    for precision in ("fp32",) + tuple(p for p in precisions if p != "fp32"):
+        if precision == "fp32":
+            result, preds = reference, reference_preds
+        else:
+            result = measure(f"{repo_id}@{precision}")
+            preds = result.pop("preds")
+        diff = np.abs(preds - reference_preds)
+        jaccard = [
+            len(a & b) / len(a | b) if a | b else 1.0
+            for a, b in zip(_tag_sets(preds, tag_indexes, threshold), reference_tags)
+        ]
+        result.update({
+            "precision": precision,
+            "images": len(preds),
+            "max_abs_diff": float(diff.max()),
+            "mean_abs_diff": float(diff.mean()),
+            "tag_jaccard": float(np.mean(jaccard)),
+            "rating_agreement": float(np.mean(preds[:, rating_indexes].argmax(axis=1) == reference_ratings)),
+            "speedup": result["images_per_sec"] / reference["images_per_sec"] if reference["images_per_sec"] else 0.0,
+        })
+        reports.append(result)
+    return reports
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Convert WD Tagger models to fp16/int8 and check their accuracy")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="Create and cache converted variants")
+    convert_parser.add_argument("repo_id")
+    convert_parser.add_argument("--precision", nargs="+", choices=MODEL_PRECISIONS[1:], default=["int8"])
+
+    compare_parser = subparsers.add_parser("compare", help="Compare variants against fp32 on local images")
+    compare_parser.add_argument("repo_id")
+    compare_parser.add_argument("images", help="Directory of images")
+    compare_parser.add_argument("--precision", nargs="+", choices=MODEL_PRECISIONS[1:], default=["int8", "fp16"])
+    compare_parser.add_argument("--threshold", type=float, default=0.35)
+    compare_parser.add_argument("--limit", type=int, default=256, help="Maximum number of images")
+    compare_parser.add_argument("--json", default=None, help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    from core.dataset import find_images
+    from core.predictor import WaifuDiffusionPredictor
+
+    config = WDTaggerConfig()
+    config.prediction_cache.enabled = False
+    predictor = WaifuDiffusionPredictor(config)
+    repo_id, _ = parse_model_id(args.repo_id)
+
+    if args.command == "convert":
+        _, model_path = predictor.download_model(repo_id)
+        for precision in args.precision:
+            path = convert_model(model_path, precision, repo_id, predictor.converted_model_dir())
+            print(f"{precision}: {path} ({os.path.getsize(path) / 1024 ** 2:.1f} MB)")
+        return 0
+
+    image_paths = find_images(args.images, recursive=True)[:args.limit]
+    reports = compare_precisions(predictor, repo_id, image_paths, args.precision, args.threshold)
+    print(f"{'precision':<10}{'img/s':>9}{'speedup':>9}{'size MB':>9}{'max diff':>10}{'mean diff':>11}{'jaccard':>9}{'rating':>8}")
+    for report in reports:
+        print(
+            f"{report['precision']:<10}{report['images_per_sec']:>9.1f}{report['speedup']:>8.2f}x"
+            f"{report['model_bytes'] / 1024 ** 2:>9.1f}{report['max_abs_diff']:>10.4f}"
+            f"{report['mean_abs_diff']:>11.5f}{report['tag_jaccard']:>9.3f}{report['rating_agreement']:>8.3f}"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
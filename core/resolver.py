@@ -0,0 +1,170 @@
+import argparse
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from core.config import WDTaggerConfig
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+class ModelNotAvailableError(Exception):
+    """Raised when model files cannot be found locally and may not be downloaded"""
+
+def sha256_file(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def verify_model_files(csv_path: str, model_path: str, deep: bool = False) -> List[str]:
+    """
+    Check a resolved model for obvious damage and return the problems found
+    The quick check looks at sizes and the label CSV header. With deep=True,
+    files stored as HF cache blobs are also hashed and compared against the
+    blob name, which the hub sets to the SHA-256 of LFS files.
+    """
+    problems = []
+    for path in (csv_path, model_path):
+        if not os.path.isfile(path):
+            problems.append(f"missing file {path}")
+        elif os.path.getsize(path) == 0:
+            problems.append(f"empty file {path}")
+    if problems:
+        return problems
+
+    with open(csv_path, "r", encoding="utf-8") as f:
+        header = f.readline().strip().split(",")
+    if "name" not in header or "category" not in header:
+        problems.append(f"unexpected label header in {csv_path}")
+
+    if deep:
+        for path in (csv_path, model_path):
+            blob_name = os.path.basename(os.path.realpath(path))
+            if _SHA256_RE.match(blob_name) and sha256_file(path) != blob_name:
+                problems.append(f"checksum mismatch for {path}")
+    return problems
+
+class ModelResolver:
+    """
+    Resolves a model repo to local label and model file paths
+    Lookup order is the local models directory, then the HuggingFace cache
+    without touching the network, and only then a download of both files in
+    parallel. In offline mode the last step is skipped.
+    """
+
+    def __init__(self, config: WDTaggerConfig):
+        self.config = config
+
+    @property
+    def filenames(self) -> Tuple[str, str]:
+        return self.config.file_config["label_filename"], self.config.file_config["model_filename"]
+
+    def _local_candidates(self, model_repo: str) -> List[str]:
+        models_dir = self.config.get_local_models_dir()
+        if not models_dir:
+            return []
+        return [
+            os.path.join(models_dir, *model_repo.split("/")),
+            os.path.join(models_dir, model_repo.replace("/", "--")),
+        ]
+
+    def find_local(self, model_repo: str) -> Optional[Tuple[str, str]]:
+        """Label and model paths from the local models directory, if present"""
+        label_filename, model_filename = self.filenames
+        for directory in self._local_candidates(model_repo):
+            csv_path = os.path.join(directory, label_filename)
+            model_path = os.path.join(directory, model_filename)
+            if os.path.isfile(csv_path) and os.path.isfile(model_path):
+                return csv_path, model_path
+        return None
+
+    def _hub_download(self, model_repo: str, filename: str, local_files_only: bool) -> str:
+        import huggingface_hub
+        return huggingface_hub.hf_hub_download(
+            model_repo,
+            filename,
+            token=self.config.get_hf_token() or None,
+            local_files_only=local_files_only,
+        )
+
+    def find_cached(self, model_repo: str) -> Optional[Tuple[str, str]]:
+        """Label and model paths from the HuggingFace cache, without network access"""
+        try:
+            return tuple(self._hub_download(model_repo, filename, True) for filename in self.filenames)
+        except Exception:
+            return None
+
+    def download(self, model_repo: str) -> Tuple[str, str]:
+        """Download the label and model files concurrently"""
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(self._hub_download, model_repo, filename, False)
+                for filename in self.filenames
+            ]
+            return tuple(future.result() for future in futures)
+
+    def resolve(self, model_repo: str) -> Tuple[str, str]:
+        """Return (csv_path, model_path), downloading only when allowed and needed"""
+        paths = self.find_local(model_repo) or self.find_cached(model_repo)
+        if paths is not None:
+            return paths
+
+        if self.config.is_offline():
+            raise ModelNotAvailableError(
+                f"{model_repo} is not available locally and offline mode is enabled"
+            )
+        try:
+            return self.download(model_repo)
+        except Exception as e:
+            raise Exception(f"Failed to download model from {model_repo}: {str(e)}")
+
+    def prefetch(self, model_repo: str, verify: bool = True) -> Dict[str, object]:
+        """Resolve one model ahead of time and check the result"""
+        try:
+            csv_path, model_path = self.resolve(model_repo)
+        except Exception as e:
+            return {"repo_id": model_repo, "ok": False, "problems": [str(e)]}
+
+        problems = verify_model_files(csv_path, model_path, deep=verify)
+        return {
+            "repo_id": model_repo,
+            "ok": not problems,
+            "problems": problems,
+            "csv_path": csv_path,
+            "model_path": model_path,
+        }
+
+    def prefetch_all(self, repos: Optional[Iterable[str]] = None, workers: Optional[int] = None,
+                     verify: bool = True) -> List[Dict[str, object]]:
+        """Prefetch several models concurrently, by default every configured one"""
+        repos = list(repos) if repos else self.config.get_repo_ids()
+        workers = workers or self.config.resolver.prefetch_workers
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            return list(executor.map(lambda repo: self.prefetch(repo, verify), repos))
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Download and verify WD Tagger models ahead of time")
+    parser.add_argument("repos", nargs="*", help="Repo ids to prefetch (default: every configured model)")
+    parser.add_argument("--workers", type=int, default=None, help="Concurrent downloads")
+    parser.add_argument("--models-dir", default=None, help="Local models directory to check first")
+    parser.add_argument("--no-verify", action="store_true", help="Skip checksum verification")
+    args = parser.parse_args(argv)
+
+    config = WDTaggerConfig()
+    if args.models_dir:
+        config.resolver.local_models_dir = args.models_dir
+
+    results = ModelResolver(config).prefetch_all(args.repos, args.workers, verify=not args.no_verify)
+    for result in results:
+        if result["ok"]:
+            print(f"OK      {result['repo_id']} -> {os.path.dirname(result['model_path'])}")
+        else:
+            print(f"FAILED  {result['repo_id']}: {'; '.join(result['problems'])}")
+    return 0 if all(result["ok"] for result in results) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from core.config import SchedulerConfig
+from core.model_cache import LoadedModel
+from core.prediction_cache import image_digest
+
+class QueueFullError(Exception):
+    """Raised when the scheduler already holds the maximum number of requests"""
+
+@dataclass
+class _Request:
+    entry: LoadedModel
+    array: np.ndarray
+    key: Optional[str]
+    future: Future
+    enqueued: float = field(default_factory=time.perf_counter)
+
+class InferenceScheduler:
+    """
+    Serves concurrent single-image requests through one inference thread
+    Callers decode and preprocess on their own thread, then enqueue the
+    array. The worker takes the model with the oldest waiting request, waits
+    up to max_wait_ms for more requests of that model to arrive, and runs
+    them as one batch. Only the worker calls the sessions, so requests for
+    different models are handled one model at a time instead of racing.
+    """
+
+    def __init__(self, predictor, config: SchedulerConfig):
+        self.predictor = predictor
+        self.config = config
+        self._pending: "OrderedDict[str, Deque[_Request]]" = OrderedDict()
+        self._size = 0
+        self._condition = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._stopped = False
+        self.batches = 0
+        self.batched_requests = 0
+        self.rejected = 0
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._stopped = False
+            self._worker = threading.Thread(target=self._run, name="wd-tagger-scheduler", daemon=True)
+            self._worker.start()
+
+    def submit(self, image: Union[Image.Image, str], model_repo: str) -> Future:
+        """
+        Queue one image and return a Future of its raw probability vector
+        Cache hits complete immediately; a full queue raises QueueFullError.
+        """
+        predictor = self.predictor
+        future: Future = Future()
+        entry = predictor.get_model(model_repo)
+
+        key = None
+        if predictor.prediction_cache is not None:
+            key = predictor.prediction_cache.make_key(
+                image_digest(image), entry.repo_id, entry.revision,
+                predictor.preprocessor.cache_version
+            )
+            cached = predictor.prediction_cache.get(key)
+            if cached is not None:
+                future.set_result(cached)
+                return future
+
+        with self._condition:
+            if self._size >= self.config.max_queue_depth:
+                self.rejected += 1
+                raise QueueFullError(
+                    f"Inference queue is full ({self.config.max_queue_depth} requests), try again shortly"
+                )
+            self._size += 1
+
+        try:
+            array = predictor.preprocessor.prepare(image, entry.target_size)
+        except Exception:
+            with self._condition:
+                self._size -= 1
+            raise
+
+        with self._condition:
+            self._pending.setdefault(entry.repo_id, deque()).append(_Request(entry, array, key, future))
+            self._ensure_worker()
+            self._condition.notify()
+        return future
+
+    def infer(self, image: Union[Image.Image, str], model_repo: str) -> np.ndarray:
+        """Blocking form of submit()"""
+        future = self.submit(image, model_repo)
+        with self.predictor.metrics.time("scheduler_wait"):
+            return future.result()
+
+    def _next_batch(self) -> Optional[List[_Request]]:
+        """Wait for work and take up to max_batch_size requests of one model"""
+        max_wait = self.config.max_wait_ms / 1000
+        with self._condition:
+            while not self._pending and not self._stopped:
+                self._condition.wait()
+            if self._stopped:
+                return None
+
+            # The model whose oldest request has waited longest goes first
+            repo_id = min(self._pending, key=lambda repo: self._pending[repo][0].enqueued)
+            queue = self._pending[repo_id]
+            deadline = queue[0].enqueued + max_wait
+            while len(queue) < self.config.max_batch_size and not self._stopped:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            # stop() may have cleared the queues and failed their futures meanwhile
+            if self._stopped:
+                return None
+
+            batch = [queue.popleft() for _ in range(min(len(queue), self.config.max_batch_size))]
+            if not queue:
+                del self._pending[repo_id]
+            self._size -= len(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            # Callers may cancel requests that are still queued
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                preds = self.predictor.run_batch(np.stack([request.array for request in batch]), batch[0].entry)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.batched_requests += len(batch)
+            self.predictor.metrics.observe_batch(len(batch), self.config.max_batch_size)
+            for request, row in zip(batch, preds):
+                if request.key is not None:
+                    self.predictor.prediction_cache.put(request.key, row)
+                request.future.set_result(row)
+
+    def stop(self):
+        """Stop the worker; requests still queued fail"""
+        with self._condition:
+            self._stopped = True
+            pending = [request for queue in self._pending.values() for request in queue]
+            self._pending.clear()
+            self._size = 0
+            self._condition.notify_all()
+        for request in pending:
+            if not request.future.cancelled():
+                request.future.set_exception(RuntimeError("Scheduler stopped"))
+
+    def stats(self) -> Dict[str, float]:
+        """Queue depth and batching counters"""
+        with self._condition:
+            return {
+                "queued": self._size,
+                "batches": self.batches,
+                "batched_requests": self.batched_requests,
+                "mean_batch_size": self.batched_requests / self.batches if self.batches else 0.0,
+                "rejected": self.rejected,
+            }
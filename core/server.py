@@ -0,0 +1,311 @@
+import argparse
+import base64
+import hashlib
+import io
+import json
+import sys
+from collections import deque
+from concurrent.futures import Future, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+from core.export import build_record
+from core.prediction_cache import image_digest
+from core.scheduler import QueueFullError
+
+class RequestError(Exception):
+    """A client error, carrying the HTTP status to answer with"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def _flag(value) -> bool:
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+class TaggingService:
+    """
+    Tags images for the HTTP server, independent of HTTP itself
+    Every image goes through the predictor's scheduler, so images from
+    concurrent requests share batched session calls. The images of one
+    request are preprocessed one after another on the handler thread, so
+    on their own they rarely fill a batch. Models stay loaded in the
+    predictor's registry between requests, and requests that name no
+    model use the first model warmed up.
+    """
+
+    def __init__(self, predictor):
+        self.predictor = predictor
+        self.config = predictor.config
+        self.default_model = self.config.get_default_model()
+
+    def warm_up(self, model_ids: Optional[List[str]] = None) -> List[str]:
+        """Load models ahead of the first request; returns the ones that loaded"""
+        loaded = []
+        for model_id in model_ids or [self.config.get_default_model()]:
+            try:
+                self.predictor.get_model(model_id)
+                loaded.append(model_id)
+            except Exception as e:
+                print(f"Could not load {model_id}: {str(e)}", file=sys.stderr)
+        if loaded:
+            self.default_model = loaded[0]
+        return loaded
+
+    def settings(self, options: Dict[str, object]) -> Dict[str, object]:
+        """Model and thresholds of a request, with the configured defaults"""
+        thresholds = self.config.thresholds
+        try:
+            return {
+                "model": str(options.get("model") or self.default_model),
+                "general_thresh": float(options.get("general_thresh", thresholds.general_default)),
+                "general_mcut": _flag(options.get("general_mcut", False)),
+                "character_thresh": float(options.get("character_thresh", thresholds.character_default)),
+                "character_mcut": _flag(options.get("character_mcut", False)),
+                "top_k": int(options.get("top_k", 0)),
+            }
+        except (TypeError, ValueError) as e:
+            raise RequestError(400, f"Invalid option: {str(e)}")
+
+    def decode_bytes(self, data: bytes) -> Tuple[Image.Image, str]:
+        """Open uploaded image bytes; the digest matches that of the same file on disk"""
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except Exception as e:
+            raise RequestError(400, f"Could not decode image: {str(e)}")
+        return image, hashlib.blake2b(data, digest_size=20).hexdigest()
+
+    def tag(self, sources: List[Tuple[str, Union[Image.Image, str], Optional[str]]],
+            options: Dict[str, object]) -> Dict[str, object]:
+        """
+        Tag (name, image or path, digest) sources with one model
+        A request keeps at most a window of its images in the scheduler's
+        queue and waits on its oldest image before queueing more, so large
+        requests cannot overflow the queue. Failures are reported per image;
+        a queue filled by other requests fails the request with 503 and
+        cancels the images it had queued.
+        """
+        settings = self.settings(options)
+        model = settings["model"]
+        try:
+            labels = self.predictor.get_model(model)
+        except Exception as e:
+            raise RequestError(400, f"Model loading failed: {model}: {str(e)}")
+
+        scheduler = self.predictor.scheduler
+        window = max(1, min(scheduler.config.max_queue_depth, 2 * scheduler.config.max_batch_size))
+        futures: List[Union[Future, Exception]] = []
+        outstanding: Deque[Future] = deque()
+        try:
+            for _, source, _ in sources:
+                while True:
+                    while outstanding and outstanding[0].done():
+                        outstanding.popleft()
+                    if len(outstanding) >= window:
+                        wait([outstanding.popleft()])
+                        continue
+                    try:
+                        future = scheduler.submit(source, model)
+                    except QueueFullError as e:
+                        if not outstanding:
+                            raise RequestError(503, str(e))
+                        wait([outstanding.popleft()])
+                        continue
+                    except Exception as e:
+                        futures.append(e)
+                        break
+                    futures.append(future)
+                    outstanding.append(future)
+                    break
+        except BaseException:
+            for future in outstanding:
+                future.cancel()
+            raise
+
+        thresholds = {
+            key: settings[key]
+            for key in ("general_thresh", "general_mcut", "character_thresh", "character_mcut")
+        }
+        results = []
+        for (name, source, digest), future in zip(sources, futures):
+            try:
+                if isinstance(future, Exception):
+                    raise future
+                preds = future.result()
+                result = self.predictor.process_predictions(
+                    preds, settings["general_thresh"], settings["general_mcut"],
+                    settings["character_thresh"], settings["character_mcut"], labels=labels
+                )
+                results.append(build_record(
+                    name, digest or image_digest(source), model, thresholds, result,
+                    preds, labels.tag_names, settings["top_k"]
+                ))
+            except Exception as e:
+                results.append({"path": name, "error": str(e)})
+        return {"model": model, "results": results}
+
+    def tag_json(self, body: Dict[str, object]) -> Dict[str, object]:
+        """Handle {"paths": [...], "images": [base64, ...], ...options}"""
+        sources = []
+        paths = body.get("paths") or []
+        if paths and not self.config.server.allow_paths:
+            raise RequestError(403, "This server does not accept file paths")
+        for path in paths:
+            sources.append((str(path), str(path), None))
+        for position, encoded in enumerate(body.get("images") or []):
+            try:
+                data = base64.b64decode(encoded, validate=True)
+            except Exception:
+                raise RequestError(400, f"Image {position} is not valid base64")
+            image, digest = self.decode_bytes(data)
+            sources.append((f"upload-{position}", image, digest))
+        if not sources:
+            raise RequestError(400, "Provide \"paths\" or base64 \"images\"")
+        return self.tag(sources, body)
+
+    def tag_bytes(self, data: bytes, options: Dict[str, object], name: str = "upload-0") -> Dict[str, object]:
+        """Handle one raw image body"""
+        image, digest = self.decode_bytes(data)
+        return self.tag([(name, image, digest)], options)
+
+    def health(self) -> Dict[str, object]:
+        return {
+            "status": "ok",
+            "loaded_models": self.predictor.registry.loaded_repos(),
+            "scheduler": self.predictor.scheduler.stats(),
+        }
+
+def make_handler(service: TaggingService):
+    """Request handler class bound to a service"""
+    max_body = int(service.config.server.max_body_mb * 1024 * 1024)
+
+    class TaggingRequestHandler(BaseHTTPRequestHandler):
+        server_version = "WDTagger"
+
+        def _send(self, status: int, body: Union[bytes, str, Dict], content_type: str = "application/json"):
+            if isinstance(body, dict):
+                body = json.dumps(body, ensure_ascii=False)
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            route = urlparse(self.path).path
+            if route == "/health":
+                self._send(200, service.health())
+            elif route == "/models":
+                self._send(200, {
+                    "models": service.predictor.model_choices(),
+                    "default": service.default_model,
+                })
+            elif route == "/metrics":
+                self._send(200, service.predictor.metrics_text(), "text/plain; version=0.0.4")
+            else:
+                self._send(404, {"error": f"Unknown route: {route}"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/tag":
+                self._send(404, {"error": f"Unknown route: {url.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > max_body:
+                    raise RequestError(413, f"Request body exceeds {service.config.server.max_body_mb:g} MB")
+                data = self.rfile.read(length)
+                content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip()
+                options = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                if content_type == "application/json":
+                    try:
+                        body = json.loads(data or b"{}")
+                    except ValueError as e:
+                        raise RequestError(400, f"Invalid JSON: {str(e)}")
+                    if not isinstance(body, dict):
+                        raise RequestError(400, "Expected a JSON object")
+                    self._send(200, service.tag_json({**options, **body}))
+                else:
+                    self._send(200, service.tag_bytes(data, options, options.get("name", "upload-0")))
+            except RequestError as e:
+                self._send(e.status, {"error": str(e)})
+            except Exception as e:
+                print(f"Request failed: {str(e)}", file=sys.stderr)
+                self._send(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+    return TaggingRequestHandler
+
+def create_server(service: TaggingService, host: Optional[str] = None,
+                  port: Optional[int] = None) -> ThreadingHTTPServer:
+    """HTTP server around a tagging service; call serve_forever() to run it"""
+    config = service.config.server
+    server = ThreadingHTTPServer(
+        (host or config.host, config.port if port is None else port),
+        make_handler(service)
+    )
+    server.daemon_threads = True
+    return server
+
+def add_server_arguments(parser: argparse.ArgumentParser, config):
+    parser.add_argument("--host", default=config.server.host)
+    parser.add_argument("--port", type=int, default=config.server.port)
+    parser.add_argument("--model", action="append", dest="models", default=None,
+                        help="Model to keep loaded; repeat for several (default: the default model)")
+    parser.add_argument("--threads", type=int, default=None, help="ONNX Runtime intra-op threads")
+    parser.add_argument("--max-batch-size", type=int, default=config.scheduler.max_batch_size)
+    parser.add_argument("--max-wait-ms", type=float, default=config.scheduler.max_wait_ms)
+    parser.add_argument("--no-paths", action="store_true", help="Reject requests that name local files")
+    parser.add_argument("--models-dir", default=None, help="Local models directory to check first")
+
+def serve(args, config) -> int:
+    """Start the service from parsed add_server_arguments() options"""
+    from core.predictor import WaifuDiffusionPredictor
+
+    if args.threads is not None:
+        config.session_profile.intra_op_num_threads = args.threads
+    if args.models_dir:
+        config.resolver.local_models_dir = args.models_dir
+    config.scheduler.max_batch_size = args.max_batch_size
+    config.scheduler.max_wait_ms = args.max_wait_ms
+    config.server.allow_paths = config.server.allow_paths and not args.no_paths
+
+    predictor = WaifuDiffusionPredictor(config)
+    service = TaggingService(predictor)
+    loaded = service.warm_up(args.models or config.server.preload_models or None)
+    if not loaded:
+        print("No model could be loaded", file=sys.stderr)
+        return 1
+
+    server = create_server(service, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"WD Tagger serving {', '.join(loaded)} on http://{host}:{port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        predictor.scheduler.stop()
+    return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from core.config import WDTaggerConfig
+
+    config = WDTaggerConfig()
+    parser = argparse.ArgumentParser(description="Serve WD Tagger over HTTP without the WebUI")
+    add_server_arguments(parser, config)
+    return serve(parser.parse_args(argv), config)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import platform
+from typing import Dict, List, Optional, Tuple
+
+from core.config import SessionProfile, default_cache_root
+from core.fileio import atomic_path, atomic_write
+
+# onnxruntime is imported on first use so that registering the extension
+# tab does not pay for it; these map profile values to its enum names
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+EXECUTION_MODES = {
+    "sequential": "ORT_SEQUENTIAL",
+    "parallel": "ORT_PARALLEL",
+}
+
+def _onnxruntime():
+    import onnxruntime
+    return onnxruntime
+
+def build_session_options(profile: SessionProfile) -> "onnxruntime.SessionOptions":
+    """Translate a session profile into ONNX Runtime session options"""
+    if profile.graph_optimization_level not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown graph optimization level: {profile.graph_optimization_level}")
+    if profile.execution_mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode: {profile.execution_mode}")
+
+    rt = _onnxruntime()
+    options = rt.SessionOptions()
+    options.intra_op_num_threads = profile.intra_op_num_threads
+    options.inter_op_num_threads = profile.inter_op_num_threads
+    options.graph_optimization_level = getattr(
+        rt.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[profile.graph_optimization_level]
+    )
+    options.execution_mode = getattr(rt.ExecutionMode, EXECUTION_MODES[profile.execution_mode])
+    options.enable_cpu_mem_arena = profile.enable_cpu_mem_arena
+    options.enable_mem_pattern = profile.enable_mem_pattern
+    return options
+
+def resolve_providers(profile: SessionProfile) -> List[str]:
+    """Keep the requested providers that are available, always ending with CPU"""
+    available = set(_onnxruntime().get_available_providers())
+    providers = [p for p in profile.providers if p in available and p != "CPUExecutionProvider"]
+    providers.append("CPUExecutionProvider")
+    return providers
+
+def default_optimized_model_dir(cache_root: Optional[str] = None) -> str:
+    """Directory for optimized graphs under the wd-tagger cache root"""
+    return os.path.join(cache_root or default_cache_root(), "optimized")
+
+def model_revision(model_path: str) -> str:
+    """Revision of a downloaded model, taken from its HF snapshot path"""
+    parts = os.path.normpath(model_path).split(os.sep)
+    if "snapshots" in parts[:-2]:
+        return parts[parts.index("snapshots") + 1]
+    stat = os.stat(model_path)
+    return f"{stat.st_size}-{int(stat.st_mtime)}"
+
+def optimized_model_key(repo_id: str, model_path: str, profile: SessionProfile) -> Dict[str, object]:
+    """Everything an optimized graph depends on"""
+    return {
+        "repo_id": repo_id,
+        "revision": model_revision(model_path),
+        "source_size": os.path.getsize(model_path),
+        "onnxruntime": _onnxruntime().__version__,
+        "machine": platform.machine(),
+        "providers": resolve_providers(profile),
+        "graph_optimization_level": profile.graph_optimization_level,
+        "execution_mode": profile.execution_mode,
+    }
+
+def _optimized_model_paths(cache_dir: str, key: Dict[str, object]) -> Tuple[str, str]:
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    repo_dir = os.path.join(cache_dir, str(key["repo_id"]).replace("/", "--"))
+    return os.path.join(repo_dir, f"{digest}.onnx"), os.path.join(repo_dir, f"{digest}.json")
+
+def _remove_quietly(*paths: str):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _load_optimized(onnx_path: str, meta_path: str, key: Dict[str, object],
+                    profile: SessionProfile) -> Optional["onnxruntime.InferenceSession"]:
+    """Load a previously optimized graph if it is present and matches the key"""
+    if not (os.path.isfile(onnx_path) and os.path.isfile(meta_path)):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("key") != key or meta.get("size") != os.path.getsize(onnx_path):
+            raise ValueError("optimized model metadata does not match")
+
+        # The graph is already optimized, so skip the expensive passes
+        rt = _onnxruntime()
+        options = build_session_options(profile)
+        options.graph_optimization_level = rt.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return rt.InferenceSession(onnx_path, sess_options=options, providers=key["providers"])
+    except Exception as e:
+        print(f"Discarding optimized model cache {onnx_path}: {str(e)}")
+        _remove_quietly(onnx_path, meta_path)
+        return None
+
+def _create_and_persist(model_path: str, onnx_path: str, meta_path: str,
+                        key: Dict[str, object], profile: SessionProfile) -> "onnxruntime.InferenceSession":
+    """Create a session from the original model and save its optimized graph"""
+    rt = _onnxruntime()
+    options = build_session_options(profile)
+    session = None
+    try:
+        # ORT writes the optimized graph while creating the session
+        with atomic_path(onnx_path) as tmp_path:
+            options.optimized_model_filepath = tmp_path
+            session = rt.InferenceSession(model_path, sess_options=options, providers=key["providers"])
+        with atomic_write(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "size": os.path.getsize(onnx_path)}, f, indent=2)
+    except OSError as e:
+        if session is None:
+            raise
+        print(f"Could not persist optimized model for {key['repo_id']}: {str(e)}")
+        _remove_quietly(onnx_path, meta_path)
+    return session
+
+def create_session(
+    model_path: str,
+    profile: SessionProfile,
+    repo_id: Optional[str] = None,
+    cache_dir: Optional[str] = None
+) -> "onnxruntime.InferenceSession":
+    """
+    Create an inference session configured by the given profile
+    When a repo_id and cache_dir are given, the optimized graph is stored on
+    first load and reused on later loads, falling back to the original model
+    whenever the cached copy is missing, stale or fails to load.
+    """
+    rt = _onnxruntime()
+    providers = resolve_providers(profile)
+    if repo_id is None or cache_dir is None or profile.graph_optimization_level == "disable":
+        return rt.InferenceSession(
+            model_path,
+            sess_options=build_session_options(profile),
+            providers=providers
+        )
+
+    key = optimized_model_key(repo_id, model_path, profile)
+    onnx_path, meta_path = _optimized_model_paths(cache_dir, key)
+
+    session = _load_optimized(onnx_path, meta_path, key, profile)
+    if session is not None:
+        return session
+
+    try:
+        return _create_and_persist(model_path, onnx_path, meta_path, key, profile)
+    except Exception as e:
+        print(f"Optimized model cache unavailable for {repo_id}: {str(e)}")
+        return rt.InferenceSession(
+            model_path,
+            sess_options=build_session_options(profile),
+            providers=providers
+        )
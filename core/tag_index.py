@@ -0,0 +1,423 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.config import default_cache_root
+
+# Bump whenever the on-disk layout changes
+TAG_INDEX_VERSION = 1
+
+INDEX_ARRAYS = ("offsets", "image_ids", "scores", "alive")
+
+_TERM_RE = re.compile(r"^(?P<tag>.+?)\s*(?:>=?\s*(?P<score>[0-9]*\.?[0-9]+))?$")
+
+def default_tag_index_dir(cache_root: Optional[str] = None) -> str:
+    """Directory of the tag index when none is configured"""
+    return os.path.join(cache_root or default_cache_root(), "tag-index")
+
+@dataclass
+class QueryTerm:
+    """One tag of a query with its minimum confidence"""
+    tag: str
+    min_score: float = 0.0
+
+@dataclass
+class TagQuery:
+    """
+    Images must have every AND clause, and no NOT term
+    Each AND clause is a list of alternatives (OR).
+    """
+    all_of: List[List[QueryTerm]] = field(default_factory=list)
+    none_of: List[QueryTerm] = field(default_factory=list)
+
+def parse_query(text: str, min_score: float = 0.0) -> TagQuery:
+    """
+    Parse a comma separated query such as "1girl, long hair>0.6, smile|grin, -monochrome"
+    "|" separates alternatives, a leading "-" excludes a tag and ">x" sets a
+    per-tag minimum confidence; min_score applies to every other tag.
+    """
+    query = TagQuery()
+    for clause in text.split(","):
+        clause = clause.strip()
+        if not clause:
+            continue
+        negate = clause.startswith("-")
+        terms = []
+        for part in clause.lstrip("-").split("|"):
+            match = _TERM_RE.match(part.strip())
+            if match is None or not match.group("tag").strip():
+                continue
+            score = match.group("score")
+            terms.append(QueryTerm(match.group("tag").strip(), float(score) if score else min_score))
+        if not terms:
+            continue
+        if negate:
+            query.none_of.extend(terms)
+        else:
+            query.all_of.append(terms)
+    return query
+
+def _contains(sorted_ids: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Mask of which ids occur in the sorted array, in O(len(ids) log n)"""
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=bool)
+    positions = np.searchsorted(sorted_ids, ids)
+    positions[positions == len(sorted_ids)] = len(sorted_ids) - 1
+    return sorted_ids[positions] == ids
+
+def _lookup(sorted_ids: np.ndarray, scores: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Score of each id in a posting list, 0 where absent"""
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=np.float32)
+    positions = np.searchsorted(sorted_ids, ids)
+    positions[positions == len(sorted_ids)] = len(sorted_ids) - 1
+    found = sorted_ids[positions] == ids
+    return np.where(found, scores[positions].astype(np.float32), 0.0)
+
+class TagIndex:
+    """
+    Inverted index from tag to the images that carry it
+    Every tag has a posting list of image ids (sorted uint32) with float16
+    confidences alongside. Image ids are handed out in increasing order, so
+    adding images only appends to posting lists; re-indexing a path retires
+    its old id, and saving compacts retired ids away. Saved indexes are
+    memory-mapped on load, and new postings are merged into a tag's arrays
+    the first time a query touches it.
+    """
+
+    def __init__(self):
+        self.paths: List[str] = []
+        self.digests: List[Optional[str]] = []
+        self.tag_names: List[str] = []
+        self._tag_ids: Dict[str, int] = {}
+        self._path_ids: Dict[str, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._alive_count = 0
+        self._postings: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._pending: Dict[int, Tuple[List[int], List[float]]] = {}
+        self._changes = 0
+        self._saved_changes = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        """Number of live images"""
+        return self._alive_count
+
+    @property
+    def dirty(self) -> bool:
+        """Whether images were added or removed since the index was loaded or saved"""
+        return self._changes != self._saved_changes
+
+    def _tag_id(self, tag: str) -> int:
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = self._tag_ids[tag] = len(self.tag_names)
+            self.tag_names.append(tag)
+            self._postings.append((np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.float16)))
+        return tag_id
+
+    def _grow_alive(self, size: int):
+        if size > len(self._alive):
+            grown = np.zeros(max(size, 2 * len(self._alive), 1024), dtype=bool)
+            grown[:len(self._alive)] = self._alive
+            self._alive = grown
+
+    def add(self, path: str, tags: Dict[str, float], digest: Optional[str] = None) -> int:
+        """Index one image's tags and return its image id"""
+        with self._lock:
+            previous = self._path_ids.get(path)
+            if previous is not None and self._alive[previous]:
+                self._alive[previous] = False
+                self._alive_count -= 1
+
+            image_id = len(self.paths)
+            self.paths.append(path)
+            self.digests.append(digest)
+            self._path_ids[path] = image_id
+            self._grow_alive(image_id + 1)
+            self._alive[image_id] = True
+            self._alive_count += 1
+            self._changes += 1
+
+            for tag, score in tags.items():
+                ids, scores = self._pending.setdefault(self._tag_id(tag), ([], []))
+                ids.append(image_id)
+                scores.append(score)
+            return image_id
+
+    def add_result(self, path: str, result: tuple, digest: Optional[str] = None) -> int:
+        """Index a predict()-style result tuple"""
+        _, _, rating_dict, character_dict, general_dict = result
+        return self.add(path, {**rating_dict, **general_dict, **character_dict}, digest)
+
+    def add_record(self, record: Dict[str, object]) -> int:
+        """Index an export record (see core.export.build_record)"""
+        tags = {
+            item["tag"]: item["score"]
+            for category in ("rating", "general", "character")
+            for item in record.get(category, [])
+        }
+        return self.add(record["path"], tags, record.get("digest"))
+
+    def remove(self, path: str) -> bool:
+        """Drop an image from query results"""
+        with self._lock:
+            image_id = self._path_ids.pop(path, None)
+            if image_id is None or not self._alive[image_id]:
+                return False
+            self._alive[image_id] = False
+            self._alive_count -= 1
+            self._changes += 1
+            return True
+
+    def _posting(self, tag_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Posting list of a tag with pending additions merged in"""
+        pending = self._pending.pop(tag_id, None)
+        if pending is not None:
+            ids, scores = self._postings[tag_id]
+            self._postings[tag_id] = (
+                np.concatenate([ids, np.asarray(pending[0], dtype=np.uint32)]),
+                np.concatenate([scores, np.asarray(pending[1], dtype=np.float16)]),
+            )
+        return self._postings[tag_id]
+
+    def resolve_tag(self, tag: str) -> Optional[int]:
+        """Tag id of a query tag, accepting underscores for spaces"""
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = self._tag_ids.get(tag.replace("_", " "))
+        return tag_id
+
+    def _term_ids(self, term: QueryTerm) -> Tuple[np.ndarray, np.ndarray]:
+        tag_id = self.resolve_tag(term.tag)
+        if tag_id is None:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.float16)
+        ids, scores = self._posting(tag_id)
+        if term.min_score > 0:
+            keep = scores >= term.min_score
+            ids, scores = ids[keep], scores[keep]
+        return ids, scores
+
+    def _clause_ids(self, clause: List[QueryTerm]) -> np.ndarray:
+        lists = [self._term_ids(term)[0] for term in clause]
+        if len(lists) == 1:
+            return lists[0]
+        return np.unique(np.concatenate(lists))
+
+    def search(self, query: TagQuery, limit: Optional[int] = 100) -> List[Tuple[str, float]]:
+        """
+        Paths matching a query with their relevance, best first
+        Relevance is the mean confidence over the AND clauses, taking the
+        best alternative of OR clauses.
+        """
+        with self._lock:
+            if not query.all_of:
+                return []
+
+            clauses = sorted(((clause, self._clause_ids(clause)) for clause in query.all_of),
+                             key=lambda item: len(item[1]))
+            ids = clauses[0][1]
+            for _, clause_ids in clauses[1:]:
+                if len(ids) == 0:
+                    break
+                ids = ids[_contains(clause_ids, ids)]
+
+            for term in query.none_of:
+                if len(ids) == 0:
+                    break
+                ids = ids[~_contains(self._term_ids(term)[0], ids)]
+
+            ids = ids[self._alive[ids]]
+            if len(ids) == 0:
+                return []
+
+            relevance = np.zeros(len(ids), dtype=np.float32)
+            for clause, _ in clauses:
+                relevance += np.max([_lookup(*self._term_ids(term), ids) for term in clause], axis=0)
+            relevance /= len(clauses)
+
+            order = np.argsort(-relevance, kind="stable")
+            if limit is not None:
+                order = order[:limit]
+            return [(self.paths[ids[i]], float(relevance[i])) for i in order]
+
+    def query(self, text: str, min_score: float = 0.0, limit: Optional[int] = 100) -> List[Tuple[str, float]]:
+        """Parse and run a query string"""
+        return self.search(parse_query(text, min_score), limit)
+
+    def tag_counts(self, top: int = 50) -> List[Tuple[str, int]]:
+        """Most frequent tags by posting list length, ignoring retired images"""
+        with self._lock:
+            counts = [
+                (tag, int(self._alive[self._posting(tag_id)[0]].sum()))
+                for tag_id, tag in enumerate(self.tag_names)
+            ]
+        counts.sort(key=lambda item: -item[1])
+        return counts[:top]
+
+    def stats(self) -> Dict[str, int]:
+        """Sizes of the index"""
+        with self._lock:
+            postings = sum(len(ids) for ids, _ in self._postings)
+            postings += sum(len(ids) for ids, _ in self._pending.values())
+            return {
+                "images": self._alive_count,
+                "retired_images": len(self.paths) - self._alive_count,
+                "tags": len(self.tag_names),
+                "postings": postings,
+            }
+
+    def compact(self) -> int:
+        """
+        Drop retired images and renumber the live ones in their order
+        Returns the number of images dropped. Image ids returned by add()
+        before compaction are no longer valid afterwards.
+        """
+        with self._lock:
+            retired = len(self.paths) - self._alive_count
+            if retired == 0:
+                return 0
+            for tag_id in list(self._pending):
+                self._posting(tag_id)
+            alive = self._alive[:len(self.paths)]
+            # Old id -> new id; increasing, so posting lists stay sorted
+            new_ids = (np.cumsum(alive) - 1).astype(np.uint32)
+            postings = []
+            for ids, scores in self._postings:
+                keep = alive[ids]
+                postings.append((new_ids[ids[keep]], scores[keep]))
+            self._postings = postings
+            live = np.flatnonzero(alive)
+            self.paths = [self.paths[i] for i in live]
+            self.digests = [self.digests[i] for i in live]
+            self._path_ids = {path: image_id for image_id, path in enumerate(self.paths)}
+            self._alive = np.ones(len(self.paths), dtype=bool)
+            return retired
+
+    def save(self, directory: str):
+        """
+        Write the index as memory-mappable arrays, replacing any previous copy atomically
+        The posting lists are kept in memory from then on, so no file of the
+        replaced copy stays mapped (Windows cannot rename mapped files).
+        Retired images are compacted away first.
+        """
+        with self._lock:
+            self.compact()
+            for tag_id in list(self._pending):
+                self._posting(tag_id)
+            lengths = np.array([len(ids) for ids, _ in self._postings], dtype=np.int64)
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            image_ids = np.concatenate([ids for ids, _ in self._postings] or [np.zeros(0, dtype=np.uint32)])
+            scores = np.concatenate([scores for _, scores in self._postings] or [np.zeros(0, dtype=np.float16)])
+            # Views of the fresh copies release any mapping of the saved files
+            self._postings = [
+                (image_ids[offsets[i]:offsets[i + 1]], scores[offsets[i]:offsets[i + 1]])
+                for i in range(len(self._postings))
+            ]
+            changes = self._changes
+            arrays = {
+                "offsets": offsets,
+                "image_ids": image_ids,
+                "scores": scores,
+                "alive": self._alive[:len(self.paths)].copy(),
+            }
+            meta = {
+                "version": TAG_INDEX_VERSION,
+                "saved": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "tags": self.tag_names,
+                "paths": self.paths,
+                "digests": self.digests,
+            }
+
+        directory = os.path.abspath(directory)
+        parent = os.path.dirname(directory)
+        os.makedirs(parent, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(directory)}.", suffix=".tmp", dir=parent)
+        new_dir = os.path.join(work_dir, "new")
+        try:
+            os.makedirs(new_dir)
+            for name, array in arrays.items():
+                np.save(os.path.join(new_dir, f"{name}.npy"), array)
+            with open(os.path.join(new_dir, "index.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            if os.path.isdir(directory):
+                os.replace(directory, os.path.join(work_dir, "old"))
+            os.replace(new_dir, directory)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        self._saved_changes = changes
+
+    @classmethod
+    def load(cls, directory: str) -> "TagIndex":
+        """Load a saved index, memory-mapping its posting lists"""
+        with open(os.path.join(directory, "index.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != TAG_INDEX_VERSION:
+            raise ValueError(f"Unsupported tag index version: {meta.get('version')}")
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in INDEX_ARRAYS
+        }
+
+        index = cls()
+        index.tag_names = meta["tags"]
+        index._tag_ids = {tag: tag_id for tag_id, tag in enumerate(index.tag_names)}
+        index.paths = meta["paths"]
+        index.digests = meta["digests"]
+        index._alive = np.array(arrays["alive"], dtype=bool)
+        index._alive_count = int(index._alive.sum())
+        index._path_ids = {path: image_id for image_id, path in enumerate(index.paths) if index._alive[image_id]}
+        offsets = arrays["offsets"]
+        index._postings = [
+            (arrays["image_ids"][offsets[i]:offsets[i + 1]], arrays["scores"][offsets[i]:offsets[i + 1]])
+            for i in range(len(index.tag_names))
+        ]
+        return index
+
+    @classmethod
+    def open(cls, directory: str) -> "TagIndex":
+        """Load an index if one was saved there, otherwise start an empty one"""
+        if os.path.isfile(os.path.join(directory, "index.json")):
+            return cls.load(directory)
+        return cls()
+
+    @classmethod
+    def from_export(cls, path: str, index: Optional["TagIndex"] = None) -> "TagIndex":
+        """Build (or extend) an index from a JSONL, Parquet or SQLite export"""
+        from core.export import export_format_for
+
+        index = index or cls()
+        export_format = export_format_for(path)
+        if export_format == "parquet":
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise Exception("Reading Parquet exports requires pyarrow (pip install pyarrow)")
+            columns = ["path", "digest", "rating", "character", "general"]
+            for batch in pq.ParquetFile(path).iter_batches(columns=columns):
+                for record in batch.to_pylist():
+                    index.add_record(record)
+        elif export_format == "sqlite":
+            import sqlite3
+            connection = sqlite3.connect(path)
+            try:
+                for image_id, image_path, digest in connection.execute("SELECT id, path, digest FROM images ORDER BY id").fetchall():
+                    tags = dict(connection.execute("SELECT tag, score FROM tags WHERE image_id = ?", (image_id,)))
+                    index.add(image_path, tags, digest)
+            finally:
+                connection.close()
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        index.add_record(json.loads(line))
+        return index
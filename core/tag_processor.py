@@ -1,16 +1,41 @@
 import re
-from typing import List, Tuple, Dict, Set
+from typing import Callable, Iterable, List, Tuple, Dict
+import numpy as np
+from core.categorizer import DEFAULT_RULES_PATH, TagCategorizer
 from core.config import WDTaggerConfig
 
+WHITESPACE_PATTERN = re.compile(r'\s+')
+R34_INVALID_PATTERN = re.compile(r'[^\w\-_]')
+UNDERSCORES_PATTERN = re.compile(r'_+')
+
+class TagVocabulary:
+    """Precomputed output forms for every tag of a label set, by tag index"""
+    
+    def __init__(self, names: np.ndarray, standard: np.ndarray, r34: np.ndarray, r34_plain: np.ndarray, categories: np.ndarray):
+        self.names = names
+        self.standard = standard
+        self.r34 = r34
+        self.r34_plain = r34_plain
+        self.categories = categories
+    
+    def __len__(self) -> int:
+        return len(self.names)
+
 class TagProcessor:
     """Handles tag processing and formatting"""
     
     def __init__(self, config: WDTaggerConfig):
         self.config = config
         self.r34_tag_mappings = self._init_r34_mappings()
-        self.nsfw_indicators = self._init_nsfw_indicators()
-        self.quality_tags = self._init_quality_tags()
-        self.style_tags = self._init_style_tags()
+        self.categorizer = self._init_categorizer()
+        self.nsfw_indicators = self.categorizer.exact_patterns("nsfw")
+        self.quality_tags = self.categorizer.exact_patterns("quality")
+        self.style_tags = self.categorizer.exact_patterns("style")
+        
+        # Formatted forms by tag name, filled by build_vocabulary and on demand
+        self._standard_forms: Dict[str, str] = {}
+        self._r34_forms: Dict[str, str] = {}
+        self._r34_plain_forms: Dict[str, str] = {}
     
     def _init_r34_mappings(self) -> Dict[str, str]:
         """Initialize R34-specific tag mappings"""
@@ -123,48 +148,89 @@ class TagProcessor:
             "traditional art": "traditional_art"
         }
     
-    def _init_nsfw_indicators(self) -> Set[str]:
-        """Initialize NSFW indicator tags"""
-        return {
-            "nude", "naked", "topless", "bottomless", "underwear", "lingerie",
-            "bikini", "swimsuit", "cleavage", "nipples", "areolae", "pussy",
-            "penis", "ass", "buttocks", "thighs", "panties", "bra", "sex",
-            "cum", "orgasm", "masturbation", "vibrator", "dildo", "bondage",
-            "bdsm", "tentacles", "rape", "forced", "gangbang", "orgy",
-            "futanari", "shemale", "transgender", "yaoi", "yuri", "hentai",
-            "ecchi", "lewd", "nsfw", "explicit", "adult", "mature"
-        }
-    
-    def _init_quality_tags(self) -> Set[str]:
-        """Initialize quality indicator tags"""
-        return {
-            "masterpiece", "best quality", "high quality", "detailed",
-            "ultra detailed", "extremely detailed", "highly detailed",
-            "amazing", "beautiful", "gorgeous", "stunning", "perfect",
-            "flawless", "incredible", "outstanding", "exceptional",
-            "professional", "official art", "promotional art"
-        }
+    def _init_categorizer(self) -> TagCategorizer:
+        """Build the categorization engine from the bundled and user rules"""
+        categorizer = TagCategorizer.from_file(self.config.categories.rules_file or DEFAULT_RULES_PATH)
+        if self.config.categories.user_rules_file:
+            categorizer.load_rules(self.config.categories.user_rules_file, first=True)
+        return categorizer
     
-    def _init_style_tags(self) -> Set[str]:
-        """Initialize style indicator tags"""
-        return {
-            "anime", "manga", "realistic", "photorealistic", "semi-realistic",
-            "cartoon", "chibi", "sketch", "line art", "cel shading",
-            "soft shading", "hard shading", "watercolor", "oil painting",
-            "digital art", "traditional art", "concept art", "illustration",
-            "cg", "3d", "2d", "pixiv", "danbooru", "gelbooru"
-        }
+    def add_category_rule(self, category: str, patterns: List[str], match: str = "substring"):
+        """
+        Add a user-defined category rule that takes precedence over the defaults
+        Vocabularies built before the call keep their old categories.
+        """
+        self.categorizer.add_rule(category, patterns, match, first=True)
     
     def clean_tag(self, tag: str) -> str:
         """Clean and normalize a single tag"""
         # Remove extra spaces and normalize
-        tag = re.sub(r'\s+', ' ', tag.strip())
+        tag = WHITESPACE_PATTERN.sub(' ', tag.strip())
         
         # Handle parentheses (escape for some formats)
         tag = tag.replace('(', '\\(').replace(')', '\\)')
         
         return tag
     
+    def _sanitize_r34(self, tag: str) -> str:
+        """Strip characters R34 does not accept and collapse underscores"""
+        tag = R34_INVALID_PATTERN.sub('', tag)
+        return UNDERSCORES_PATTERN.sub('_', tag).strip('_')
+    
+    def to_standard(self, tag: str) -> str:
+        """Standard (escaped) form of a tag, memoized"""
+        form = self._standard_forms.get(tag)
+        if form is None:
+            form = self._standard_forms[tag] = self.clean_tag(tag)
+        return form
+    
+    def to_r34(self, tag: str) -> str:
+        """R34 form of a tag, honoring the R34 mappings, memoized"""
+        form = self._r34_forms.get(tag)
+        if form is None:
+            if tag in self.r34_tag_mappings:
+                form = self.r34_tag_mappings[tag]
+            else:
+                # Convert spaces to underscores for R34 format
+                form = self._sanitize_r34(tag.replace(' ', '_'))
+            self._r34_forms[tag] = form
+        return form
+    
+    def to_r34_plain(self, tag: str) -> str:
+        """R34 form of a tag without the R34 mappings, memoized"""
+        form = self._r34_plain_forms.get(tag)
+        if form is None:
+            form = self._r34_plain_forms[tag] = self._sanitize_r34(tag.replace(' ', '_'))
+        return form
+    
+    def build_vocabulary(self, tag_names: Iterable[str]) -> TagVocabulary:
+        """Precompute the standard and R34 forms and category of a whole label set"""
+        names = np.asarray(list(tag_names), dtype=object)
+        return TagVocabulary(
+            names=names,
+            standard=np.array([self.to_standard(tag) for tag in names], dtype=object),
+            r34=np.array([self.to_r34(tag) for tag in names], dtype=object),
+            r34_plain=np.array([self.to_r34_plain(tag) for tag in names], dtype=object),
+            categories=self.categorizer.categorize_vocabulary(names)
+        )
+    
+    def _sort_by_confidence(self, indexes: np.ndarray, probs: np.ndarray) -> np.ndarray:
+        """Tag indexes ordered by descending confidence, ties in input order"""
+        return indexes[np.argsort(-probs, kind="stable")]
+    
+    def format_standard_indexes(self, vocabulary: TagVocabulary, indexes: np.ndarray, probs: np.ndarray) -> str:
+        """Format tags given by vocabulary index in standard format"""
+        if len(indexes) == 0:
+            return ""
+        return ", ".join(vocabulary.standard[self._sort_by_confidence(indexes, probs)].tolist())
+    
+    def format_r34_indexes(self, vocabulary: TagVocabulary, indexes: np.ndarray, probs: np.ndarray) -> str:
+        """Format tags given by vocabulary index in R34 format"""
+        if len(indexes) == 0:
+            return ""
+        forms = vocabulary.r34[self._sort_by_confidence(indexes, probs)].tolist()
+        return " ".join(dict.fromkeys(form for form in forms if form))
+    
     def format_standard_tags(self, tag_results: List[Tuple[str, float]]) -> str:
         """Format tags in standard comma-separated format"""
         if not tag_results:
@@ -173,13 +239,7 @@ class TagProcessor:
         # Sort by confidence
         sorted_tags = sorted(tag_results, key=lambda x: x[1], reverse=True)
         
-        # Clean and format tags
-        formatted_tags = []
-        for tag, confidence in sorted_tags:
-            cleaned_tag = self.clean_tag(tag)
-            formatted_tags.append(cleaned_tag)
-        
-        return ", ".join(formatted_tags)
+        return ", ".join(self.to_standard(tag) for tag, confidence in sorted_tags)
     
     def format_r34_tags(self, tag_results: List[Tuple[str, float]]) -> str:
         """Format tags specifically for R34 and similar platforms"""
@@ -189,32 +249,38 @@ class TagProcessor:
         # Sort by confidence
         sorted_tags = sorted(tag_results, key=lambda x: x[1], reverse=True)
         
-        # Process tags for R34 format
-        r34_tags = []
-        for tag, confidence in sorted_tags:
-            # Apply R34-specific mappings
-            if tag in self.r34_tag_mappings:
-                r34_tag = self.r34_tag_mappings[tag]
-            else:
-                # Convert spaces to underscores for R34 format
-                r34_tag = tag.replace(' ', '_')
-                
-                # Remove special characters that might cause issues
-                r34_tag = re.sub(r'[^\w\-_]', '', r34_tag)
-                
-                # Handle multiple underscores
-                r34_tag = re.sub(r'_+', '_', r34_tag)
-                
-                # Remove leading/trailing underscores
-                r34_tag = r34_tag.strip('_')
-            
-            if r34_tag and r34_tag not in r34_tags:
-                r34_tags.append(r34_tag)
+        # Map to R34 forms, dropping empties and duplicates in order
+        r34_tags = dict.fromkeys(
+            r34_tag for r34_tag in (self.to_r34(tag) for tag, confidence in sorted_tags) if r34_tag
+        )
         
         return " ".join(r34_tags)
     
-    def categorize_tags(self, tag_results: List[Tuple[str, float]]) -> Dict[str, List[str]]:
-        """Categorize tags by type"""
+    def prepend_character_tags(self, standard_tags: str, r34_tags: str, character_dict: Dict[str, float]) -> Tuple[str, str]:
+        """Add detected character names to the front of both tag strings"""
+        if not character_dict:
+            return standard_tags, r34_tags
+        
+        character_names = list(character_dict.keys())
+        
+        # Prepend to standard tags
+        standard_character_tags = ", ".join(name.replace("_", " ") for name in character_names)
+        if standard_tags:
+            standard_tags = f"{standard_character_tags}, {standard_tags}"
+        else:
+            standard_tags = standard_character_tags
+        
+        # Prepend to R34 tags
+        r34_character_tags = " ".join(name.replace(" ", "_") for name in character_names)
+        if r34_tags:
+            r34_tags = f"{r34_character_tags} {r34_tags}"
+        else:
+            r34_tags = r34_character_tags
+        
+        return standard_tags, r34_tags
+    
+    def _empty_categories(self) -> Dict[str, List[str]]:
+        """Category buckets, including any user-defined categories"""
         categories = {
             "character": [],
             "clothing": [],
@@ -225,32 +291,33 @@ class TagProcessor:
             "nsfw": [],
             "other": []
         }
-        
-        clothing_keywords = {"uniform", "outfit", "clothes", "dress", "shirt", "skirt", "pants", "jacket", "coat", "hat", "shoes", "boots", "socks", "stockings", "gloves", "accessories"}
-        pose_keywords = {"sitting", "standing", "lying", "kneeling", "running", "walking", "dancing", "jumping", "flying", "pose", "position"}
-        background_keywords = {"room", "school", "house", "building", "street", "park", "beach", "mountain", "forest", "sky", "cloud", "water", "background"}
+        for category in self.categorizer.categories():
+            categories.setdefault(category, [])
+        return categories
+    
+    def categorize_tags(self, tag_results: List[Tuple[str, float]]) -> Dict[str, List[str]]:
+        """Categorize tags by type"""
+        categories = self._empty_categories()
         
         for tag, confidence in tag_results:
-            tag_lower = tag.lower()
-            
-            # Check categories
-            if any(keyword in tag_lower for keyword in clothing_keywords):
-                categories["clothing"].append(tag)
-            elif any(keyword in tag_lower for keyword in pose_keywords):
-                categories["pose"].append(tag)
-            elif any(keyword in tag_lower for keyword in background_keywords):
-                categories["background"].append(tag)
-            elif tag_lower in self.quality_tags:
-                categories["quality"].append(tag)
-            elif tag_lower in self.style_tags:
-                categories["style"].append(tag)
-            elif tag_lower in self.nsfw_indicators:
-                categories["nsfw"].append(tag)
-            else:
-                categories["other"].append(tag)
+            categories[self.categorizer.categorize(tag)].append(tag)
         
         return categories
     
+    def _index_buckets(self, vocabulary: TagVocabulary, indexes: np.ndarray) -> Dict[str, List[int]]:
+        """Vocabulary indexes grouped by their precomputed category, in input order"""
+        buckets = self._empty_categories()
+        for index, category in zip(indexes.tolist(), vocabulary.categories[indexes].tolist()):
+            buckets[category].append(index)
+        return buckets
+    
+    def categorize_indexes(self, vocabulary: TagVocabulary, indexes: np.ndarray) -> Dict[str, List[str]]:
+        """Categorize tags given by vocabulary index using the precomputed table"""
+        return {
+            category: vocabulary.names[bucket].tolist() if bucket else []
+            for category, bucket in self._index_buckets(vocabulary, np.asarray(indexes)).items()
+        }
+    
     def filter_tags_by_confidence(self, tag_results: List[Tuple[str, float]], min_confidence: float = 0.1) -> List[Tuple[str, float]]:
         """Filter tags by minimum confidence threshold"""
         return [(tag, conf) for tag, conf in tag_results if conf >= min_confidence]
@@ -280,39 +347,43 @@ class TagProcessor:
         filtered_tags = self.remove_duplicate_tags(tag_results)
         filtered_tags = self.filter_tags_by_confidence(filtered_tags, 0.1)
         
-        # Categorize tags
-        categorized = self.categorize_tags(filtered_tags)
-        
-        # Build R34 tag string with priority order
+        return self._join_r34_categories(self.categorize_tags(filtered_tags), self.to_r34, self.to_r34_plain)
+    
+    def enhance_r34_indexes(self, vocabulary: TagVocabulary, indexes: np.ndarray, probs: np.ndarray) -> str:
+        """
+        enhance_r34_tags for tags given by vocabulary index
+        Categories and R34 forms come from the vocabulary's precomputed
+        tables, so no tag name is matched or formatted per image. Tag names
+        are unique within a label set, so there are no duplicates to drop.
+        """
+        indexes = np.asarray(indexes)[np.asarray(probs) >= 0.1]
+        if len(indexes) == 0:
+            return ""
+        return self._join_r34_categories(
+            self._index_buckets(vocabulary, indexes), vocabulary.r34.__getitem__, vocabulary.r34_plain.__getitem__
+        )
+    
+    def _join_r34_categories(self, categorized: Dict[str, list], r34_form: Callable, r34_plain_form: Callable) -> str:
+        """R34 tag string from categorized tags, in category priority order"""
         r34_parts = []
         
-        # High priority tags first
-        priority_order = ["character", "quality", "style", "clothing", "pose", "background", "other"]
+        # High priority tags first, user-defined categories just before "other"
+        priority_order = ["character", "quality", "style", "clothing", "pose", "background"]
+        priority_order += [c for c in categorized if c not in priority_order and c not in ("nsfw", "other")]
+        priority_order.append("other")
         
         for category in priority_order:
             if categorized[category]:
-                category_tags = []
-                for tag in categorized[category]:
-                    r34_tag = self.r34_tag_mappings.get(tag, tag.replace(' ', '_'))
-                    r34_tag = re.sub(r'[^\w\-_]', '', r34_tag)
-                    r34_tag = re.sub(r'_+', '_', r34_tag).strip('_')
-                    
-                    if r34_tag and r34_tag not in category_tags:
-                        category_tags.append(r34_tag)
-                
+                category_tags = dict.fromkeys(
+                    r34_tag for r34_tag in (r34_form(tag) for tag in categorized[category]) if r34_tag
+                )
                 r34_parts.extend(category_tags)
         
         # Add NSFW tags at the end if present
         if categorized["nsfw"]:
-            nsfw_tags = []
-            for tag in categorized["nsfw"]:
-                r34_tag = tag.replace(' ', '_')
-                r34_tag = re.sub(r'[^\w\-_]', '', r34_tag)
-                r34_tag = re.sub(r'_+', '_', r34_tag).strip('_')
-                
-                if r34_tag and r34_tag not in nsfw_tags:
-                    nsfw_tags.append(r34_tag)
-            
+            nsfw_tags = dict.fromkeys(
+                r34_tag for r34_tag in (r34_plain_form(tag) for tag in categorized["nsfw"]) if r34_tag
+            )
             r34_parts.extend(nsfw_tags)
         
         return " ".join(r34_parts)
\ No newline at end of file
@@ -10,13 +10,22 @@ class WaifuDiffusionTagger:
     """Main class for WaifuDiffusion Tagger"""
     
     def __init__(self):
-        self.predictor = WaifuDiffusionPredictor()
         self.config = WDTaggerConfig()
+        self.predictor = WaifuDiffusionPredictor(self.config)
         self.ui_manager = WaifuDiffusionUI(self.predictor, self.config)
 
+_tagger = None
+
+def get_tagger() -> WaifuDiffusionTagger:
+    """Shared tagger instance, created on first use"""
+    global _tagger
+    if _tagger is None:
+        _tagger = WaifuDiffusionTagger()
+    return _tagger
+
 def on_ui_tabs():
     """Register the extension as a standalone tab"""
-    tagger = WaifuDiffusionTagger()
+    tagger = get_tagger()
     
     # Crear la interfaz dentro del contexto correcto
     with gr.Blocks(analytics_enabled=False) as wd_tagger_interface:
@@ -35,5 +44,21 @@ def load_css():
     except FileNotFoundError:
         return ""
 
+def on_app_started(demo, app):
+    """Optionally load the default model and expose metrics once the WebUI is up"""
+    tagger = get_tagger()
+    if tagger.config.warmup_enabled():
+        tagger.predictor.warm_up()
+    
+    metrics = tagger.config.metrics
+    if metrics.enabled and metrics.expose_endpoint:
+        from fastapi.responses import PlainTextResponse
+        
+        def metrics_endpoint():
+            return PlainTextResponse(tagger.predictor.metrics_text(), media_type="text/plain; version=0.0.4")
+        
+        app.add_api_route(metrics.endpoint, metrics_endpoint, methods=["GET"])
+
 # Register the tab
-script_callbacks.on_ui_tabs(on_ui_tabs)
\ No newline at end of file
+script_callbacks.on_ui_tabs(on_ui_tabs)
+script_callbacks.on_app_started(on_app_started)
\ No newline at end of file
@@ -2,7 +2,9 @@ import gradio as gr
 from typing import Dict, Any, Tuple, List
 from core.predictor import WaifuDiffusionPredictor
 from core.config import WDTaggerConfig
+from core.metrics import STAGES
 import json
+import time
 
 class WaifuDiffusionUI:
     """Main UI class for WaifuDiffusion Tagger"""
@@ -26,17 +28,113 @@ class WaifuDiffusionUI:
                     """
                 )
                 
-                # Image upload
-                image_input = gr.Image(
-                    type="pil",
-                    image_mode="RGBA",
-                    label="Upload Image",
-                    elem_classes=[self.config.css_classes["image_upload"]]
-                )
+                with gr.Tabs(elem_classes=["wd-tagger-input-tabs"]):
+                    with gr.TabItem("🖼️ Single Image", elem_classes=["wd-tagger-tab"]):
+                        # Image upload
+                        image_input = gr.Image(
+                            type="pil",
+                            image_mode="RGBA",
+                            label="Upload Image",
+                            elem_classes=[self.config.css_classes["image_upload"]]
+                        )
+                    
+                    with gr.TabItem("📁 Batch Folder", elem_classes=["wd-tagger-tab"]):
+                        batch_input_path = gr.Textbox(
+                            label="Input Folder or Glob",
+                            placeholder="/path/to/dataset or /path/to/dataset/**/*.png",
+                            elem_classes=["wd-tagger-batch-input"]
+                        )
+                        batch_output_dir = gr.Textbox(
+                            label="Output Folder",
+                            placeholder="Leave empty to write captions next to each image",
+                            elem_classes=["wd-tagger-batch-input"]
+                        )
+                        batch_caption_format = gr.Radio(
+                            choices=["standard", "r34"],
+                            value="standard",
+                            label="Caption Format"
+                        )
+                        with gr.Row():
+                            batch_recursive = gr.Checkbox(
+                                value=True,
+                                label="Include Subfolders",
+                                elem_classes=["wd-tagger-checkbox"]
+                            )
+                            batch_skip_existing = gr.Checkbox(
+                                value=True,
+                                label="Skip Up-to-date Captions",
+                                info="Resume by skipping images whose caption is newer than the image",
+                                elem_classes=["wd-tagger-checkbox"]
+                            )
+                            batch_incremental = gr.Checkbox(
+                                value=False,
+                                label="Incremental (Manifest)",
+                                info="Only tag new or changed images; re-derive captions when only thresholds change",
+                                elem_classes=["wd-tagger-checkbox"]
+                            )
+                        batch_size = gr.Slider(
+                            minimum=1,
+                            maximum=64,
+                            step=1,
+                            value=self.config.inference.max_batch_size,
+                            label="Batch Size",
+                            info="Images per model call"
+                        )
+                        batch_btn = gr.Button(
+                            "📁 Tag Folder",
+                            variant="primary",
+                            elem_classes=["wd-tagger-button", "wd-tagger-predict-button"]
+                        )
+                    
+                    with gr.TabItem("🔎 Search", elem_classes=["wd-tagger-tab"]):
+                        search_query = gr.Textbox(
+                            label="Tag Query",
+                            placeholder="1girl, long hair>0.6, smile|grin, -monochrome",
+                            info="Comma = AND, | = OR, leading - = NOT, >x = minimum confidence",
+                            elem_classes=["wd-tagger-batch-input"]
+                        )
+                        with gr.Row():
+                            search_min_score = gr.Slider(
+                                minimum=0.0,
+                                maximum=1.0,
+                                step=self.config.thresholds.slider_step,
+                                value=0.0,
+                                label="Minimum Confidence",
+                                elem_classes=["wd-tagger-slider"]
+                            )
+                            search_limit = gr.Slider(
+                                minimum=1,
+                                maximum=500,
+                                step=1,
+                                value=100,
+                                label="Max Results"
+                            )
+                        search_btn = gr.Button(
+                            "🔎 Search Index",
+                            variant="primary",
+                            elem_classes=["wd-tagger-button", "wd-tagger-predict-button"]
+                        )
+                        search_results = gr.Gallery(
+                            label="Matching Images",
+                            columns=4,
+                            height="auto",
+                            elem_classes=["wd-tagger-search-results"]
+                        )
+                        with gr.Accordion("Index Management", open=False):
+                            index_import_path = gr.Textbox(
+                                label="Import Export File",
+                                placeholder="/path/to/tags.jsonl or /path/to/tags.db",
+                                elem_classes=["wd-tagger-batch-input"]
+                            )
+                            index_import_btn = gr.Button(
+                                "📥 Add to Index",
+                                size="sm",
+                                elem_classes=["wd-tagger-button"]
+                            )
                 
                 # Model selection
                 model_dropdown = gr.Dropdown(
-                    choices=self.config.get_model_choices(),
+                    choices=self.predictor.model_choices(),
                     value=self.config.get_default_model(),
                     label="Model Selection",
                     info="Choose the AI model for tagging",
@@ -86,18 +184,6 @@ class WaifuDiffusionUI:
                             info="Add character names to the beginning of the tag list",
                             elem_classes=["wd-tagger-checkbox"]
                         )
-                    
-                    # Batch processing
-                    with gr.Row():
-                        batch_size = gr.Slider(
-                            minimum=1,
-                            maximum=10,
-                            step=1,
-                            value=1,
-                            label="Batch Size",
-                            info="Process multiple images at once",
-                            visible=False  # Hidden for now
-                        )
                 
                 # Action buttons
                 with gr.Row(elem_classes=[self.config.css_classes["button_row"]]):
@@ -175,6 +261,9 @@ class WaifuDiffusionUI:
                         elem_classes=["wd-tagger-info"]
                     )
         
+        # Raw prediction of the last tagged image, for live re-thresholding
+        raw_predictions = gr.State(None)
+        
         # Store components for event handling
         self.components = {
             "image_input": image_input,
@@ -184,6 +273,21 @@ class WaifuDiffusionUI:
             "character_thresh": character_thresh,
             "character_mcut": character_mcut,
             "prepend_character_tags": prepend_character_tags,
+            "batch_input_path": batch_input_path,
+            "batch_output_dir": batch_output_dir,
+            "batch_caption_format": batch_caption_format,
+            "batch_recursive": batch_recursive,
+            "batch_skip_existing": batch_skip_existing,
+            "batch_incremental": batch_incremental,
+            "batch_size": batch_size,
+            "batch_btn": batch_btn,
+            "search_query": search_query,
+            "search_min_score": search_min_score,
+            "search_limit": search_limit,
+            "search_btn": search_btn,
+            "search_results": search_results,
+            "index_import_path": index_import_path,
+            "index_import_btn": index_import_btn,
             "predict_btn": predict_btn,
             "clear_btn": clear_btn,
             "standard_output": standard_output,
@@ -192,6 +296,7 @@ class WaifuDiffusionUI:
             "character_output": character_output,
             "all_tags_output": all_tags_output,
             "processing_info": processing_info,
+            "raw_predictions": raw_predictions,
             "copy_standard_btn": copy_standard_btn,
             "copy_r34_btn": copy_r34_btn
         }
@@ -207,11 +312,55 @@ class WaifuDiffusionUI:
     
     def _setup_event_handlers(self):
         """Set up event handlers for the interface"""
+        threshold_inputs = [
+            self.components["model_dropdown"],
+            self.components["general_thresh"],
+            self.components["general_mcut"],
+            self.components["character_thresh"],
+            self.components["character_mcut"],
+            self.components["prepend_character_tags"]
+        ]
+        result_outputs = [
+            self.components["standard_output"],
+            self.components["r34_output"],
+            self.components["rating_output"],
+            self.components["character_output"],
+            self.components["all_tags_output"],
+            self.components["processing_info"]
+        ]
+        
         # Main prediction
         self.components["predict_btn"].click(
             fn=self._predict_wrapper,
+            inputs=[self.components["image_input"]] + threshold_inputs,
+            outputs=result_outputs + [self.components["raw_predictions"]]
+        )
+        
+        # Threshold changes only re-slice the stored prediction
+        for name in ["general_thresh", "general_mcut", "character_thresh", "character_mcut", "prepend_character_tags"]:
+            self.components[name].change(
+                fn=self._rethreshold_wrapper,
+                inputs=[self.components["raw_predictions"]] + threshold_inputs,
+                outputs=result_outputs
+            )
+        
+        # A new image invalidates the stored prediction
+        self.components["image_input"].change(
+            fn=lambda: None,
+            outputs=[self.components["raw_predictions"]]
+        )
+        
+        # Batch folder tagging
+        self.components["batch_btn"].click(
+            fn=self._batch_wrapper,
             inputs=[
-                self.components["image_input"],
+                self.components["batch_input_path"],
+                self.components["batch_output_dir"],
+                self.components["batch_caption_format"],
+                self.components["batch_recursive"],
+                self.components["batch_skip_existing"],
+                self.components["batch_incremental"],
+                self.components["batch_size"],
                 self.components["model_dropdown"],
                 self.components["general_thresh"],
                 self.components["general_mcut"],
@@ -219,14 +368,22 @@ class WaifuDiffusionUI:
                 self.components["character_mcut"],
                 self.components["prepend_character_tags"]
             ],
-            outputs=[
-                self.components["standard_output"],
-                self.components["r34_output"],
-                self.components["rating_output"],
-                self.components["character_output"],
-                self.components["all_tags_output"],
-                self.components["processing_info"]
-            ]
+            outputs=[self.components["processing_info"]]
+        )
+        
+        # Tag index search
+        search_inputs = [
+            self.components["search_query"],
+            self.components["search_min_score"],
+            self.components["search_limit"]
+        ]
+        search_outputs = [self.components["search_results"], self.components["processing_info"]]
+        self.components["search_btn"].click(fn=self._search_wrapper, inputs=search_inputs, outputs=search_outputs)
+        self.components["search_query"].submit(fn=self._search_wrapper, inputs=search_inputs, outputs=search_outputs)
+        self.components["index_import_btn"].click(
+            fn=self._index_import_wrapper,
+            inputs=[self.components["index_import_path"]],
+            outputs=[self.components["processing_info"]]
         )
         
         # Clear button
@@ -239,7 +396,8 @@ class WaifuDiffusionUI:
                 self.components["rating_output"],
                 self.components["character_output"],
                 self.components["all_tags_output"],
-                self.components["processing_info"]
+                self.components["processing_info"],
+                self.components["raw_predictions"]
             ]
         )
         # Copy buttons with JS
@@ -287,66 +445,173 @@ class WaifuDiffusionUI:
             _js=js_copy_func_r34
         )
     
+    def _empty_outputs(self, message):
+        """Outputs for the single-image tabs when there is nothing to show"""
+        return ("", "", None, None, None, message)
+    
+    def _render_outputs(self, preds, model_repo, general_thresh, general_mcut, character_thresh, character_mcut, prepend_character_tags, timings=None):
+        """Derive every single-image output from a raw prediction vector"""
+        standard_tags, r34_tags, rating_dict, character_dict, general_dict = self.predictor.predict_from_raw(
+            preds, model_repo, general_thresh, general_mcut, character_thresh, character_mcut
+        )
+        
+        if prepend_character_tags:
+            standard_tags, r34_tags = self.predictor.tag_processor.prepend_character_tags(
+                standard_tags, r34_tags, character_dict
+            )
+        
+        # Create processing info
+        processing_info = self._create_processing_info(
+            model_repo, general_thresh, character_thresh, 
+            len(general_dict), len(character_dict), timings
+        )
+        
+        return (
+            standard_tags,
+            r34_tags,
+            rating_dict,
+            character_dict,
+            general_dict,
+            processing_info
+        )
+    
     def _predict_wrapper(self, image, model_repo, general_thresh, general_mcut, character_thresh, character_mcut, prepend_character_tags):
         """Wrapper for the prediction function with UI updates"""
         if image is None:
-            return (
-                "",
-                "",
-                None,
-                None,
-                None,
-                "No image provided for processing."
-            )
+            return self._empty_outputs("No image provided for processing.") + (None,)
         
         try:
-            # Run prediction
-            standard_tags, r34_tags, rating_dict, character_dict, general_dict = self.predictor.predict(
-                image, model_repo, general_thresh, general_mcut, character_thresh, character_mcut
-            )
-
-            if prepend_character_tags and character_dict:
-                character_names = list(character_dict.keys())
-                # Prepend to standard tags
-                standard_character_tags = ", ".join(name.replace("_", " ") for name in character_names)
-                if standard_tags:
-                    standard_tags = f"{standard_character_tags}, {standard_tags}"
-                else:
-                    standard_tags = standard_character_tags
-
-                # Prepend to R34 tags
-                r34_character_tags = " ".join(name.replace(" ", "_") for name in character_names)
-                if r34_tags:
-                    r34_tags = f"{r34_character_tags} {r34_tags}"
-                else:
-                    r34_tags = r34_character_tags
-            
-            # Create processing info
-            processing_info = self._create_processing_info(
-                model_repo, general_thresh, character_thresh, 
-                len(general_dict), len(character_dict)
-            )
-            
-            return (
-                standard_tags,
-                r34_tags,
-                rating_dict,
-                character_dict,
-                general_dict,
-                processing_info
-            )
+            with self.predictor.metrics.request() as timings:
+                # Run the model once and keep the raw vector for re-thresholding
+                preds = self.predictor.predict_raw(image, model_repo)
+                raw_state = {"model_repo": model_repo, "preds": preds}
+                
+                return self._render_outputs(
+                    preds, model_repo, general_thresh, general_mcut,
+                    character_thresh, character_mcut, prepend_character_tags, timings
+                ) + (raw_state,)
             
         except Exception as e:
             error_info = f"**Error Details:**\n```\n{str(e)}\n```"
             
-            return (
-                "",
-                "",
-                None,
-                None,
-                None,
-                error_info
+            return self._empty_outputs(error_info) + (None,)
+    
+    def _rethreshold_wrapper(self, raw_state, model_repo, general_thresh, general_mcut, character_thresh, character_mcut, prepend_character_tags):
+        """Re-derive outputs from the stored prediction when thresholds change"""
+        if not raw_state or raw_state["model_repo"] != model_repo:
+            # Nothing tagged yet with this model; wait for Generate Tags
+            return tuple(gr.update() for _ in range(6))
+        
+        try:
+            with self.predictor.metrics.request() as timings:
+                return self._render_outputs(
+                    raw_state["preds"], model_repo, general_thresh, general_mcut,
+                    character_thresh, character_mcut, prepend_character_tags, timings
+                )
+        except Exception as e:
+            return self._empty_outputs(f"**Error Details:**\n```\n{str(e)}\n```")
+    
+    def _batch_wrapper(self, input_path, output_dir, caption_format, recursive, skip_existing, incremental,
+                       batch_size, model_repo, general_thresh, general_mcut, character_thresh, character_mcut,
+                       prepend_character_tags, progress=gr.Progress()):
+        """Wrapper for folder tagging with progress reporting"""
+        if not input_path or not input_path.strip():
+            return "No input folder provided for batch tagging."
+        
+        def report(done, total, path):
+            progress(done / max(total, 1), desc=f"Tagged {done}/{total}")
+        
+        index = self.predictor.get_tag_index() if self.config.tag_index.update_on_batch else None
+        try:
+            stats = self.predictor.tag_directory(
+                input_path.strip(), model_repo, general_thresh, general_mcut,
+                character_thresh, character_mcut,
+                caption_format=caption_format,
+                output_dir=output_dir.strip() or None,
+                prepend_character_tags=prepend_character_tags,
+                skip_existing=skip_existing,
+                incremental=incremental,
+                recursive=recursive,
+                batch_size=int(batch_size),
+                progress=report,
+                index=index
             )
+            if index is not None:
+                self.predictor.save_tag_index()
+        except Exception as e:
+            return f"**Error Details:**\n```\n{str(e)}\n```"
+        
+        return self._create_batch_info(model_repo, caption_format, stats)
+    
+    def _search_wrapper(self, query, min_score, limit):
+        """Run a tag query against the index and show the matching images"""
+        if not query or not query.strip():
+            return [], "Enter a tag query to search the index."
+        
+        try:
+            index = self.predictor.get_tag_index()
+            start = time.perf_counter()
+            matches = index.query(query, float(min_score), int(limit))
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            return [], f"**Error Details:**\n```\n{str(e)}\n```"
+        
+        gallery = [(path, f"{score:.2f}") for path, score in matches]
+        stats = index.stats()
+        return gallery, f"""
+        ### Search Results
+        
+        **Query:** `{query.strip()}`
+        
+        **Results:**
+        - Matches Shown: `{len(matches)}`
+        - Indexed Images: `{stats["images"]}`
+        - Indexed Tags: `{stats["tags"]}`
+        
+        **Query Time:** `{elapsed_ms:.1f}` ms
+        """
+    
+    def _index_import_wrapper(self, export_path):
+        """Add the rows of a JSONL or SQLite export to the index"""
+        if not export_path or not export_path.strip():
+            return "No export file provided."
+        
+        try:
+            index = self.predictor.get_tag_index()
+            before = len(index)
+            index.from_export(export_path.strip(), index)
+            self.predictor.save_tag_index()
+        except Exception as e:
+            return f"**Error Details:**\n```\n{str(e)}\n```"
+        
+        return f"""
+        ### Index Updated
+        
+        **Imported From:** `{export_path.strip()}`
+        
+        - Images Added or Updated: `{len(index) - before}` net, `{len(index)}` total
+        """
+    
+    def _create_batch_info(self, model_repo, caption_format, stats):
+        """Create batch processing summary display"""
+        model_name = model_repo.split('/')[-1] if '/' in model_repo else model_repo
+        
+        return f"""
+        ### Batch Details
+        
+        **Model Used:** `{model_name}`
+        
+        **Caption Format:** `{caption_format}`
+        
+        **Results:**
+        - Images Found: `{stats["total"]}`
+        - Captions Written: `{stats["tagged"]}`
+        - Re-derived from Stored Scores: `{stats["rederived"]}`
+        - Skipped (up to date): `{stats["skipped"]}`
+        - Failed: `{stats["failed"]}`
+        
+        **Throughput:** `{stats["images_per_sec"]:.2f}` images/sec over `{stats["elapsed"]:.1f}` s
+        """
     
     def _clear_all(self):
         """Clear all outputs"""
@@ -357,10 +622,11 @@ class WaifuDiffusionUI:
             None,  # rating_output
             None,  # character_output
             None,  # all_tags_output
-            "Upload an image to begin tagging."
+            "Upload an image to begin tagging.",
+            None   # raw_predictions
         )
     
-    def _create_processing_info(self, model_repo, general_thresh, character_thresh, general_count, character_count):
+    def _create_processing_info(self, model_repo, general_thresh, character_thresh, general_count, character_count, timings=None):
         """Create processing information display"""
         model_name = model_repo.split('/')[-1] if '/' in model_repo else model_repo
         
@@ -378,8 +644,36 @@ class WaifuDiffusionUI:
         - Character Tags Found: `{character_count}`
         
         **Model Repository:** `{model_repo}`
+        {self._create_metrics_info(timings)}
         """
     
+    def _create_metrics_info(self, timings):
+        """Stage timings of this request and the predictor's counters"""
+        if not self.config.metrics.enabled:
+            return ""
+        
+        lines = ["", "        **Timings (this request):**"]
+        stages = [stage for stage in STAGES if stage in (timings or {})]
+        for stage in stages:
+            lines.append(f"        - {stage.replace('_', ' ').title()}: `{timings[stage] * 1000:.1f}` ms")
+        if not stages:
+            lines.append("        - No stages timed")
+        
+        snapshot = self.predictor.metrics_snapshot()
+        counters = snapshot["counters"]
+        cache_hits = counters.get("prediction_cache_hits", 0) + counters.get("prediction_cache_disk_hits", 0)
+        cache_misses = counters.get("prediction_cache_misses", 0)
+        lines += [
+            "",
+            "        **Counters:**",
+            f"        - Prediction Cache Hits / Misses: `{cache_hits:g}` / `{cache_misses:g}`",
+            f"        - Model Loads: `{counters.get('model_loads', 0):g}` (evictions `{counters.get('model_evictions', 0):g}`)",
+            f"        - Batch Fill Ratio: `{snapshot['batch_fill_ratio']:.0%}`",
+        ]
+        if snapshot["peak_rss_mb"] is not None:
+            lines.append(f"        - Peak Memory: `{snapshot['peak_rss_mb']:.0f}` MB")
+        return "\n".join(lines)
+    
     def get_example_inputs(self):
         """Get example inputs for the interface"""
         return [